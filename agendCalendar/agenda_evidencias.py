@@ -1,13 +1,30 @@
 # agenda_evidencias.py
 # Endpoints para subir/listar/eliminar/servir evidencias de agenda
-# Estructura en disco: uploads/agenda/item-<idItem>/<idItem>_<archivo>(n).ext
+# Estructura en disco: uploads/agenda/item-<idItem>/<idItem>_<archivo>-<sufijo>.ext
+# (el nombre original se guarda en agenda_archivos.nombreArchivo)
+# Archivos grandes: subida por partes reanudable (subidas_agenda.py)
+# Descarga de todas las evidencias de un item: ZIP generado al vuelo
 
-from flask import Blueprint, jsonify, request, g, send_file
+from flask import Blueprint, jsonify, request, g, Response, stream_with_context
 import os
+import json
+import uuid
+import shutil
+import zipfile
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 from werkzeug.utils import secure_filename
+from werkzeug.security import safe_join
 from db_config import get_connection
 from utils.session_validator import session_validator
 from utils.auditoria import registrar_auditoria
+from utils.entrega_archivos import enviar_archivo
+from utils.cache_archivos import stat_archivo, olvidar_stat
+from utils.almacenamiento import obtener_almacenamiento
+from utils.imagenes import es_imagen, procesar_imagen, eliminar_variantes, resolver_variante, ImagenRechazada
+from utils.salida_zip import SalidaZip
+from agendCalendar import subidas_agenda
+from agendCalendar.subidas_agenda import SubidaError
 
 # Blueprints
 agenda_bp = Blueprint('agenda', __name__)
@@ -18,6 +35,10 @@ UPLOADS_ROOT = 'uploads'
 AGENDA_BASE = os.path.join(UPLOADS_ROOT, 'agenda')
 os.makedirs(AGENDA_BASE, exist_ok=True)  # asegura carpeta base
 
+# Hilos para escribir (y post-procesar) varios archivos de una misma subida
+AGENDA_IO_WORKERS = int(os.getenv('AGENDA_IO_WORKERS', 4))
+_pool_io = ThreadPoolExecutor(max_workers=AGENDA_IO_WORKERS, thread_name_prefix='agenda-io')
+
 def _carpeta_item_agenda(id_item: int) -> str:
     """
     Crea (si no existe) y devuelve la carpeta única por item:
@@ -27,50 +48,96 @@ def _carpeta_item_agenda(id_item: int) -> str:
     os.makedirs(ruta, exist_ok=True)
     return ruta
 
-def _nombre_unico(directorio: str, nombre_original: str, prefijo: str = '') -> str:
-    """
-    Genera un nombre de archivo único en 'directorio' evitando sobrescribir:
-    file.jpg -> file.jpg / file(1).jpg / file(2).jpg ...
-    """
-    base = secure_filename(nombre_original)
-    if prefijo:
-        base = f"{prefijo}{base}"
-    nombre, ext = os.path.splitext(base)
-    candidato = base
-    i = 1
-    while os.path.exists(os.path.join(directorio, candidato)):
-        candidato = f"{nombre}({i}){ext}"
-        i += 1
-    return candidato
+def _nombre_visible(nombre_original: str) -> str:
+    """Nombre que ve el usuario (se guarda en agenda_archivos.nombreArchivo)."""
+    nombre = os.path.basename((nombre_original or '').replace('\\', '/')).strip()
+    return nombre[:255] or 'archivo'
 
-def _guardar_archivo_agenda(id_item: int, file_storage) -> dict:
+def _reservar_archivo_agenda(id_item: int, nombre_original: str) -> tuple:
     """
-    Guarda archivo en uploads/agenda/item-<idItem>/ y devuelve metadata para DB.
+    Crea el archivo vacío en uploads/agenda/item-<idItem>/ con nombre único:
+    <idItem>_<nombre>-<sufijo aleatorio>.ext. La creación exclusiva (O_EXCL)
+    garantiza que dos subidas simultáneas no compartan archivo, sin recorrer
+    file(1).jpg, file(2).jpg ... Devuelve (ruta_fs, ruta_relativa).
     """
     carpeta = _carpeta_item_agenda(id_item)
-    nombre_final = _nombre_unico(carpeta, file_storage.filename, prefijo=f"{id_item}_")
-    ruta_fs = os.path.join(carpeta, nombre_final)
+    nombre, ext = os.path.splitext(secure_filename(nombre_original) or 'archivo')
+    while True:
+        nombre_disco = f"{id_item}_{nombre[:80]}-{uuid.uuid4().hex[:12]}{ext.lower()}"
+        ruta_fs = os.path.join(carpeta, nombre_disco)
+        try:
+            open(ruta_fs, 'xb').close()
+        except FileExistsError:
+            continue
+        # guardamos ruta relativa legible bajo uploads/ (como en fotos de usuario)
+        return ruta_fs, f"agenda/item-{id_item}/{nombre_disco}"
+
+def _escribir_archivo_agenda(file_storage, ruta_fs: str, ruta_rel: str) -> dict:
+    """Escribe el archivo en su ruta reservada y devuelve metadata para DB (corre en _pool_io)."""
     file_storage.save(ruta_fs)
+    return _metadata_archivo_agenda(file_storage.filename, ruta_fs, ruta_rel)
 
-    tam = os.path.getsize(ruta_fs)
-    # guardamos ruta relativa legible bajo uploads/ (como en fotos de usuario)
-    ruta_rel = f"agenda/item-{id_item}/{nombre_final}"
-
-    return {
-        'nombreArchivo': nombre_final,
+def _enlazar_archivo_agenda(id_item: int, ruta_origen: str, nombre_original: str) -> dict:
+    """
+    Coloca un archivo ya escrito (subida por partes) en uploads/agenda/item-<idItem>/
+    con un hard link: no copia los datos y el original sigue en la sesión, así
+    finalizar se puede reintentar si el registro en DB falla. Si algo falla
+    aquí no queda archivo en la carpeta del item.
+    """
+    ruta_fs, ruta_rel = _reservar_archivo_agenda(id_item, nombre_original)
+    try:
+        temporal = f"{ruta_fs}.tmp"
+        try:
+            os.link(ruta_origen, temporal)
+        except OSError:
+            shutil.copyfile(ruta_origen, temporal)  # sistema de archivos sin hard links
+        os.replace(temporal, ruta_fs)
+        return _metadata_archivo_agenda(nombre_original, ruta_fs, ruta_rel)
+    except ImagenRechazada:
+        raise  # _metadata_archivo_agenda ya lo borró
+    except Exception:
+        _eliminar_archivo_agenda(ruta_rel)
+        raise
+
+def _metadata_archivo_agenda(nombre_original: str, ruta_fs: str, ruta_rel: str) -> dict:
+    """Post-proceso del archivo ya colocado, publicación en el backend y metadata para DB."""
+    # fotos de evidencia: orientación EXIF, sin metadatos y variantes WebP
+    try:
+        variantes = procesar_imagen(ruta_fs) if es_imagen(ruta_fs) else []
+    except ImagenRechazada:
+        _eliminar_archivo_agenda(ruta_rel)  # no queda en la carpeta del item
+        raise
+    metadata = {
+        'nombreArchivo': _nombre_visible(nombre_original),
         'rutaRelativa': ruta_rel,
-        'tamanoBytes': tam,
+        'tamanoBytes': os.path.getsize(ruta_fs),
     }
 
-def _eliminar_archivo_agenda(id_item: int, nombre_archivo: str) -> bool:
+    # con S3 se sube (multipart si es grande) y se libera el disco local
+    almacen = obtener_almacenamiento()
+    for publicable in [ruta_fs, *variantes]:
+        almacen.publicar(publicable)
+    olvidar_stat(*variantes)
+    return metadata
+
+def _ruta_relativa_agenda(row: dict) -> str:
+    """
+    Ruta bajo uploads/ de un renglón de agenda_archivos. rutaArchivo manda; los
+    renglones viejos sin ella usaban nombreArchivo como nombre en disco.
     """
-    Borra el archivo físico si existe. No falla si no está.
+    return row.get('rutaArchivo') or f"agenda/item-{row['idItem']}/{row['nombreArchivo']}"
+
+def _eliminar_archivo_agenda(ruta_rel: str) -> bool:
+    """
+    Borra el archivo físico (ruta relativa bajo uploads/) si existe. No falla si no está.
     También intenta borrar la carpeta si queda vacía (opcional).
     """
-    ruta = os.path.join(AGENDA_BASE, f'item-{id_item}', nombre_archivo)
-    if os.path.exists(ruta):
+    almacen = obtener_almacenamiento()
+    ruta = safe_join(UPLOADS_ROOT, ruta_rel)
+    if ruta and almacen.info(ruta) is not None:
         try:
-            os.remove(ruta)
+            eliminar_variantes(ruta)
+            almacen.eliminar(ruta)
             # intenta quitar carpeta si queda vacía
             try:
                 os.rmdir(os.path.dirname(ruta))
@@ -126,70 +193,259 @@ def subir_archivos_agenda(id_item):
     except:
         subidoPor = getattr(g, 'user_id', None)
 
+    # 1) Nombres en orden (rápido) y escritura en paralelo (lento: disco + miniaturas)
+    reservas = []
+    metas = []
+    try:
+        for f in files:
+            reservas.append(_reservar_archivo_agenda(id_item, f.filename))
+        futuros = [
+            _pool_io.submit(_escribir_archivo_agenda, f, ruta_fs, ruta_rel)
+            for f, (ruta_fs, ruta_rel) in zip(files, reservas)
+        ]
+        errores = []
+        for futuro in futuros:
+            try:
+                metas.append(futuro.result())
+            except Exception as e:
+                errores.append(e)
+        if errores:
+            raise errores[0]
+    except Exception as e:
+        for _, ruta_rel in reservas:
+            _eliminar_archivo_agenda(ruta_rel)
+        if isinstance(e, ImagenRechazada):
+            return jsonify({'error': 'Imagen demasiado grande'}), 400
+        print("Error subir_archivos_agenda:", e)
+        return jsonify({'error': 'Error al subir archivos'}), 500
+
+    # 2) Un solo INSERT para todo el lote
+    filas = [
+        (id_item, meta['nombreArchivo'], f.mimetype or 'application/octet-stream',
+         meta['rutaRelativa'], meta['tamanoBytes'], notas, subidoPor)
+        for f, meta in zip(files, metas)
+    ]
     guardados = []
     conn = get_connection()
     try:
         conn.start_transaction()
         with conn.cursor(dictionary=True) as c:
-            for f in files:
-                meta = _guardar_archivo_agenda(id_item, f)
-
-                c.execute("""
-                    INSERT INTO agenda_archivos
-                    (idItem, nombreArchivo, tipoMime, rutaArchivo, tamanoBytes, notas, subidoPor)
-                    VALUES (%s,%s,%s,%s,%s,%s,%s)
-                """, (
-                    id_item,
-                    meta['nombreArchivo'],
-                    f.mimetype or 'application/octet-stream',
-                    meta['rutaRelativa'],
-                    meta['tamanoBytes'],
-                    notas,
-                    subidoPor
-                ))
-                new_id = c.lastrowid
-
-                # Auditoría
-                try:
-                    registrar_auditoria(
-                        getattr(g, 'user_id', None),
-                        'create',
-                        'agenda_archivos',
-                        new_id,
-                        valores_anteriores=None,
-                        valores_nuevos={
-                            'idItem': id_item,
-                            'nombreArchivo': meta['nombreArchivo'],
-                            'ruta': meta['rutaRelativa'],
-                            'tamanoBytes': meta['tamanoBytes'],
-                            'notas': notas,
-                            'subidoPor': subidoPor
-                        }
-                    )
-                except Exception:
-                    pass
-
-                guardados.append({
-                    'idArchivo': new_id,
-                    'idItem': id_item,
-                    'nombreArchivo': meta['nombreArchivo'],
-                    'tipoMime': f.mimetype or 'application/octet-stream',
-                    'tamanoBytes': meta['tamanoBytes'],
-                    'notas': notas,
-                    'subidoPor': subidoPor,
-                    'ruta': f"/archivo/agenda/{id_item}/{new_id}"
-                })
+            c.executemany("""
+                INSERT INTO agenda_archivos
+                (idItem, nombreArchivo, tipoMime, rutaArchivo, tamanoBytes, notas, subidoPor)
+                VALUES (%s,%s,%s,%s,%s,%s,%s)
+            """, filas)
+
+            # ids por ruta (única por archivo), sin suponer autoincrementos consecutivos
+            marcadores = ", ".join(["%s"] * len(metas))
+            c.execute(f"""
+                SELECT idArchivo, rutaArchivo FROM agenda_archivos
+                WHERE idItem=%s AND rutaArchivo IN ({marcadores})
+            """, (id_item, *[meta['rutaRelativa'] for meta in metas]))
+            ids = {r['rutaArchivo']: r['idArchivo'] for r in c.fetchall()}
 
         conn.commit()
-        return jsonify({'mensaje': f'{len(guardados)} archivo(s) subido(s)', 'archivos': guardados}), 201
-
     except Exception as e:
         conn.rollback()
+        for meta in metas:
+            _eliminar_archivo_agenda(meta['rutaRelativa'])
         print("Error subir_archivos_agenda:", e)
         return jsonify({'error': 'Error al subir archivos'}), 500
     finally:
         conn.close()
 
+    for f, meta in zip(files, metas):
+        new_id = ids.get(meta['rutaRelativa'])
+        guardados.append({
+            'idArchivo': new_id,
+            'idItem': id_item,
+            'nombreArchivo': meta['nombreArchivo'],
+            'tipoMime': f.mimetype or 'application/octet-stream',
+            'tamanoBytes': meta['tamanoBytes'],
+            'notas': notas,
+            'subidoPor': subidoPor,
+            'ruta': f"/archivo/agenda/{id_item}/{new_id}"
+        })
+
+    # 3) Auditoría: un registro para todo el lote
+    try:
+        registrar_auditoria(
+            getattr(g, 'user_id', None),
+            'create',
+            'agenda_archivos',
+            None,
+            valores_anteriores=None,
+            valores_nuevos={
+                'idItem': id_item,
+                'notas': notas,
+                'subidoPor': subidoPor,
+                'archivos': [
+                    {
+                        'idArchivo': a['idArchivo'],
+                        'nombreArchivo': a['nombreArchivo'],
+                        'ruta': meta['rutaRelativa'],
+                        'tamanoBytes': a['tamanoBytes']
+                    }
+                    for a, meta in zip(guardados, metas)
+                ]
+            }
+        )
+    except Exception:
+        pass
+
+    return jsonify({'mensaje': f'{len(guardados)} archivo(s) subido(s)', 'archivos': guardados}), 201
+
+
+# ---------- Subidas por partes (reanudables, ver subidas_agenda.py) ----------
+
+@agenda_bp.post('/agenda/<int:id_item>/archivos/subidas')
+@session_validator(tabla="agenda_archivos", accion="create")
+def crear_subida_agenda(id_item):
+    """
+    JSON: { nombreArchivo, tamanoBytes, tipoMime?, notas?, sha256? }
+    Responde idSubida, tamanoChunk y totalChunks para mandar los PUT.
+    """
+    if not _item_existe(id_item):
+        return jsonify({'error': 'Item no encontrado'}), 404
+
+    try:
+        subida = subidas_agenda.crear_subida(id_item, g.user_id, request.get_json(silent=True) or {})
+        return jsonify(subida), 201
+    except SubidaError as e:
+        return jsonify({'error': str(e)}), e.status
+    except Exception as e:
+        print("Error crear_subida_agenda:", e)
+        return jsonify({'error': 'Error al crear la subida'}), 500
+
+
+@agenda_bp.put('/agenda/archivos/subidas/<string:id_subida>/chunks/<int:numero>')
+@session_validator(tabla="agenda_archivos", accion="create")
+def subir_chunk_agenda(id_subida, numero):
+    """Cuerpo crudo (application/octet-stream) con los bytes del chunk"""
+    try:
+        subida = subidas_agenda.escribir_chunk(
+            id_subida, g.user_id, numero, request.stream, request.content_length
+        )
+        return jsonify(subida), 200
+    except SubidaError as e:
+        return jsonify({'error': str(e)}), e.status
+    except Exception as e:
+        print("Error subir_chunk_agenda:", e)
+        return jsonify({'error': 'Error al guardar el chunk'}), 500
+
+
+@agenda_bp.get('/agenda/archivos/subidas/<string:id_subida>')
+@session_validator(tabla="agenda_archivos", accion="create")
+def estado_subida_agenda(id_subida):
+    """Para reanudar: el cliente manda sólo los chunks en 'faltantes'"""
+    try:
+        return jsonify(subidas_agenda.obtener_subida(id_subida, g.user_id)), 200
+    except SubidaError as e:
+        return jsonify({'error': str(e)}), e.status
+
+
+@agenda_bp.delete('/agenda/archivos/subidas/<string:id_subida>')
+@session_validator(tabla="agenda_archivos", accion="create")
+def cancelar_subida_agenda(id_subida):
+    try:
+        subidas_agenda.obtener_subida(id_subida, g.user_id)
+        subidas_agenda.descartar_subida(id_subida)
+        return jsonify({'mensaje': 'Subida cancelada'}), 200
+    except SubidaError as e:
+        return jsonify({'error': str(e)}), e.status
+
+
+@agenda_bp.post('/agenda/archivos/subidas/<string:id_subida>/finalizar')
+@session_validator(tabla="agenda_archivos", accion="create")
+def finalizar_subida_agenda(id_subida):
+    """
+    Coloca el archivo armado en la carpeta del item y crea el renglón de
+    agenda_archivos en una transacción. Si el INSERT falla no queda archivo
+    huérfano en la carpeta del item y la sesión sigue viva para reintentar;
+    sólo una imagen rechazada la descarta.
+    """
+    try:
+        meta, ruta_part, sha256 = subidas_agenda.completar_subida(id_subida, g.user_id)
+    except SubidaError as e:
+        return jsonify({'error': str(e)}), e.status
+    except Exception as e:
+        print("Error finalizar_subida_agenda:", e)
+        return jsonify({'error': 'Error al finalizar la subida'}), 500
+
+    id_item = meta['idItem']
+    if not _item_existe(id_item):
+        return jsonify({'error': 'Item no encontrado'}), 404
+
+    conn = get_connection()
+    meta_archivo = None
+    try:
+        meta_archivo = _enlazar_archivo_agenda(id_item, ruta_part, meta['nombreArchivo'])
+        conn.start_transaction()
+        with conn.cursor() as c:
+            c.execute("""
+                INSERT INTO agenda_archivos
+                (idItem, nombreArchivo, tipoMime, rutaArchivo, tamanoBytes, notas, subidoPor)
+                VALUES (%s,%s,%s,%s,%s,%s,%s)
+            """, (
+                id_item,
+                meta_archivo['nombreArchivo'],
+                meta['tipoMime'],
+                meta_archivo['rutaRelativa'],
+                meta_archivo['tamanoBytes'],
+                meta['notas'],
+                g.user_id
+            ))
+            new_id = c.lastrowid
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        if meta_archivo:
+            _eliminar_archivo_agenda(meta_archivo['rutaRelativa'])
+        if isinstance(e, ImagenRechazada):
+            subidas_agenda.descartar_subida(id_subida)
+            return jsonify({'error': 'Imagen demasiado grande'}), 400
+        print("Error finalizar_subida_agenda:", e)
+        return jsonify({'error': 'Error al registrar el archivo'}), 500
+    finally:
+        conn.close()
+
+    subidas_agenda.descartar_subida(id_subida)
+
+    try:
+        registrar_auditoria(
+            g.user_id,
+            'create',
+            'agenda_archivos',
+            new_id,
+            valores_anteriores=None,
+            valores_nuevos={
+                'idItem': id_item,
+                'nombreArchivo': meta_archivo['nombreArchivo'],
+                'ruta': meta_archivo['rutaRelativa'],
+                'tamanoBytes': meta_archivo['tamanoBytes'],
+                'sha256': sha256,
+                'notas': meta['notas'],
+                'subidoPor': g.user_id
+            }
+        )
+    except Exception:
+        pass
+
+    return jsonify({
+        'mensaje': '1 archivo(s) subido(s)',
+        'archivos': [{
+            'idArchivo': new_id,
+            'idItem': id_item,
+            'nombreArchivo': meta_archivo['nombreArchivo'],
+            'tipoMime': meta['tipoMime'],
+            'tamanoBytes': meta_archivo['tamanoBytes'],
+            'sha256': sha256,
+            'notas': meta['notas'],
+            'subidoPor': g.user_id,
+            'ruta': f"/archivo/agenda/{id_item}/{new_id}"
+        }]
+    }), 201
+
 
 @agenda_bp.get('/agenda/<int:id_item>/archivos')
 @session_validator(tabla="agenda_archivos", accion="read")
@@ -225,7 +481,7 @@ def eliminar_archivo_agenda(id_archivo):
         conn.start_transaction()
         with conn.cursor(dictionary=True) as c:
             c.execute("""
-                SELECT idArchivo, idItem, nombreArchivo
+                SELECT idArchivo, idItem, nombreArchivo, rutaArchivo
                 FROM agenda_archivos
                 WHERE idArchivo=%s
             """, (id_archivo,))
@@ -238,7 +494,7 @@ def eliminar_archivo_agenda(id_archivo):
             nombre = row['nombreArchivo']
 
             # 1) Borrar físico
-            _eliminar_archivo_agenda(id_item, nombre)
+            _eliminar_archivo_agenda(_ruta_relativa_agenda(row))
 
             # 2) Borrar DB
             c.execute("DELETE FROM agenda_archivos WHERE idArchivo=%s", (id_archivo,))
@@ -274,13 +530,13 @@ def eliminar_archivo_agenda(id_archivo):
 def servir_archivo_agenda(id_item, id_archivo):
     """
     Sirve un archivo de evidencias por su id/file, con mimetype desde DB.
-    Ruta física: uploads/agenda/item-<idItem>/<nombreArchivo>
+    Ruta física: uploads/<rutaArchivo>; nombreArchivo es el nombre de descarga
     """
     conn = get_connection()
     try:
         with conn.cursor(dictionary=True) as c:
             c.execute("""
-                SELECT nombreArchivo, tipoMime
+                SELECT idItem, nombreArchivo, tipoMime, rutaArchivo
                 FROM agenda_archivos
                 WHERE idArchivo=%s AND idItem=%s
             """, (id_archivo, id_item))
@@ -288,17 +544,147 @@ def servir_archivo_agenda(id_item, id_archivo):
             if not row:
                 return jsonify({'error': 'Archivo no encontrado'}), 404
 
-            nombre_archivo = row['nombreArchivo']
             mimetype = row['tipoMime'] or 'application/octet-stream'
 
-            ruta = os.path.join(AGENDA_BASE, f'item-{id_item}', nombre_archivo)
-            if not os.path.exists(ruta):
-                return jsonify({'error': 'Archivo no encontrado en disco'}), 404
+            ruta = safe_join(UPLOADS_ROOT, _ruta_relativa_agenda(row))
+            if not ruta or stat_archivo(ruta) is None:
+                return jsonify({'error': 'Archivo no encontrado'}), 404
 
-            return send_file(ruta, mimetype=mimetype)
+            # ?size=thumb|medium|full (sólo imágenes con variantes generadas)
+            variante = resolver_variante(ruta, request.args.get('size'))
+            if variante != ruta:
+                return enviar_archivo(variante)
+            return enviar_archivo(ruta, mimetype=mimetype, download_name=row['nombreArchivo'])
 
     except Exception as e:
         print("Error al servir archivo agenda:", e)
         return jsonify({"error": "Error al obtener archivo"}), 500
     finally:
         conn.close()
+
+
+# ---------- Descarga de evidencias en ZIP ----------
+
+# Archivos más grandes que esto no se meten al ZIP (quedan en resumen.json)
+AGENDA_ZIP_MAX_ARCHIVO = int(os.getenv('AGENDA_ZIP_MAX_ARCHIVO', 200 * 1024 * 1024))
+_ZIP_BLOQUE = 256 * 1024
+
+
+def _fecha_filtro(valor):
+    """'YYYY-MM-DD' -> date; ValueError si no tiene ese formato"""
+    return datetime.strptime(valor, '%Y-%m-%d').date() if valor else None
+
+
+def _nombre_en_zip(nombre, usados):
+    """Nombre visible sin repetir dentro del ZIP: foto.jpg, foto (2).jpg, ..."""
+    base, ext = os.path.splitext(nombre)
+    candidato, n = nombre, 1
+    while candidato.lower() in usados:
+        n += 1
+        candidato = f"{base} ({n}){ext}"
+    usados.add(candidato.lower())
+    return candidato
+
+
+def _zip_evidencias(id_item, rows):
+    """
+    Generador del ZIP: cada archivo se copia por bloques del almacenamiento a
+    la respuesta, así la memoria no depende del tamaño de las evidencias.
+    """
+    salida = SalidaZip()
+    almacen = obtener_almacenamiento()
+    usados = set()
+    omitidos = []
+    archivos = 0
+    total_bytes = 0
+
+    # ZIP_STORED: las evidencias son en su mayoría fotos y PDF ya comprimidos
+    zf = zipfile.ZipFile(salida, 'w', zipfile.ZIP_STORED, allowZip64=True)
+    for row in rows:
+        ruta = safe_join(UPLOADS_ROOT, _ruta_relativa_agenda(row))
+        stat = stat_archivo(ruta) if ruta else None
+        if stat is None:
+            omitidos.append({'idArchivo': row['idArchivo'], 'nombreArchivo': row['nombreArchivo'],
+                             'motivo': 'Archivo no encontrado'})
+            continue
+        if stat.st_size > AGENDA_ZIP_MAX_ARCHIVO:
+            omitidos.append({'idArchivo': row['idArchivo'], 'nombreArchivo': row['nombreArchivo'],
+                             'motivo': f'Excede {AGENDA_ZIP_MAX_ARCHIVO} bytes',
+                             'ruta': f"/archivo/agenda/{id_item}/{row['idArchivo']}"})
+            continue
+
+        info = zipfile.ZipInfo(
+            _nombre_en_zip(row['nombreArchivo'], usados),
+            date_time=(row['subidoEn'] or datetime.now()).timetuple()[:6]
+        )
+        info.compress_type = zipfile.ZIP_STORED
+        info.file_size = stat.st_size
+        try:
+            with almacen.abrir(ruta) as origen, zf.open(info, 'w') as destino:
+                for bloque in iter(lambda: origen.read(_ZIP_BLOQUE), b''):
+                    destino.write(bloque)
+                    yield salida.vaciar()
+        except Exception as e:
+            # El encabezado ya salió: el ZIP queda con esta entrada truncada
+            print(f"Error al agregar evidencia {row['idArchivo']} al ZIP:", e)
+            raise
+        archivos += 1
+        total_bytes += stat.st_size
+        yield salida.vaciar()
+
+    resumen = {'idItem': id_item, 'archivos': archivos, 'bytes': total_bytes, 'omitidos': omitidos}
+    zf.writestr('resumen.json', json.dumps(resumen, ensure_ascii=False, indent=2))
+    zf.close()
+    yield salida.vaciar()
+
+
+@archivos_agenda_bp.get('/archivo/agenda/<int:id_item>/zip')
+@session_validator(tabla="agenda_archivos", accion="read")
+def descargar_zip_agenda(id_item):
+    """
+    Todas las evidencias del item en un ZIP generado al vuelo (sin archivos
+    temporales). Query opcional: ?desde=YYYY-MM-DD&hasta=YYYY-MM-DD sobre subidoEn.
+    Los archivos omitidos (tamaño o faltantes) se listan en resumen.json.
+    """
+    try:
+        desde = _fecha_filtro(request.args.get('desde'))
+        hasta = _fecha_filtro(request.args.get('hasta'))
+    except ValueError:
+        return jsonify({'error': 'desde/hasta deben tener formato YYYY-MM-DD'}), 400
+
+    where, params = ["idItem=%s"], [id_item]
+    if desde:
+        where.append("subidoEn >= %s")
+        params.append(desde)
+    if hasta:
+        where.append("subidoEn < DATE_ADD(%s, INTERVAL 1 DAY)")
+        params.append(hasta)
+
+    conn = get_connection()
+    try:
+        with conn.cursor(dictionary=True) as c:
+            c.execute("SELECT 1 FROM agenda_items WHERE idItem=%s", (id_item,))
+            if c.fetchone() is None:
+                return jsonify({'error': 'Item no encontrado'}), 404
+            c.execute(f"""
+                SELECT idArchivo, idItem, nombreArchivo, rutaArchivo, subidoEn
+                FROM agenda_archivos
+                WHERE {' AND '.join(where)}
+                ORDER BY subidoEn ASC, idArchivo ASC
+            """, tuple(params))
+            rows = c.fetchall()
+    except Exception as e:
+        print("Error al preparar ZIP de agenda:", e)
+        return jsonify({'error': 'Error al preparar descarga'}), 500
+    finally:
+        conn.close()
+
+    if not rows:
+        return jsonify({'error': 'No hay evidencias para descargar'}), 404
+
+    nombre_zip = f"agenda_item_{id_item}_evidencias.zip"
+    return Response(
+        stream_with_context(_zip_evidencias(id_item, rows)),
+        mimetype='application/zip',
+        headers={'Content-Disposition': f'attachment; filename="{nombre_zip}"'}
+    )
@@ -0,0 +1,273 @@
+# agendCalendar/subidas_agenda.py
+# Subidas por partes (reanudables) para evidencias grandes de agenda.
+#
+# Protocolo (rutas en agenda_evidencias.py):
+#   1) POST   /agenda/<idItem>/archivos/subidas          -> crea la sesión
+#   2) PUT    /agenda/archivos/subidas/<id>/chunks/<n>   -> cuerpo crudo del chunk n
+#   3) GET    /agenda/archivos/subidas/<id>              -> chunks recibidos / faltantes
+#   4) POST   /agenda/archivos/subidas/<id>/finalizar    -> registra en agenda_archivos
+#
+# Estado en disco (sobrevive reinicios y se comparte entre workers):
+#   uploads/agenda/_subidas/<id>/meta.json    datos de la sesión
+#   uploads/agenda/_subidas/<id>/datos.part   chunks escritos en su offset
+#   uploads/agenda/_subidas/<id>/<n>.ok       marca de chunk completo (contiene su sha256)
+#
+# Cada chunk se copia del socket a disco en bloques de 64 KB, así la memoria no
+# depende del tamaño del archivo. Un chunk interrumpido no deja marca y se
+# vuelve a mandar; los que ya tienen marca no se repiten.
+
+import os
+import json
+import time
+import uuid
+import shutil
+import hashlib
+import threading
+from datetime import datetime
+
+SUBIDAS_BASE = os.path.join('uploads', 'agenda', '_subidas')
+
+SUBIDA_CHUNK_BYTES = int(os.getenv('AGENDA_CHUNK_BYTES', 8 * 1024 * 1024))
+SUBIDA_MAX_BYTES = int(os.getenv('AGENDA_SUBIDA_MAX_BYTES', 2 * 1024 ** 3))
+# Límites por usuario sobre las sesiones abiertas
+SUBIDAS_ACTIVAS_MAX = int(os.getenv('AGENDA_SUBIDAS_ACTIVAS_MAX', 5))
+SUBIDAS_CUOTA_BYTES = int(os.getenv('AGENDA_SUBIDAS_CUOTA_BYTES', 4 * 1024 ** 3))
+# Sesiones sin actividad por más de esto se descartan
+SUBIDA_TTL = int(os.getenv('AGENDA_SUBIDA_TTL', 24 * 3600))
+
+_COPIA_BLOQUE = 64 * 1024
+
+# Hash incremental en memoria mientras los chunks llegan en orden:
+# {idSubida: (siguiente_chunk, hashlib.sha256)}. Si se pierde (reinicio, otro
+# worker, chunks fuera de orden) finalizar recalcula leyendo datos.part.
+_hashes = {}
+_hashes_lock = threading.Lock()
+
+
+class SubidaError(Exception):
+    """Error de validación del protocolo; lleva el código HTTP a responder"""
+
+    def __init__(self, mensaje, status=400):
+        super().__init__(mensaje)
+        self.status = status
+
+
+# ----------------------------
+# Helpers
+# ----------------------------
+
+def _carpeta(id_subida):
+    if not id_subida or not all(c in '0123456789abcdef' for c in id_subida):
+        raise SubidaError('Subida no encontrada', 404)
+    return os.path.join(SUBIDAS_BASE, id_subida)
+
+
+def _leer_meta(id_subida):
+    try:
+        with open(os.path.join(_carpeta(id_subida), 'meta.json'), encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        raise SubidaError('Subida no encontrada', 404)
+
+
+def _guardar_meta(meta):
+    ruta = os.path.join(_carpeta(meta['idSubida']), 'meta.json')
+    temporal = f"{ruta}.tmp"
+    with open(temporal, 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False)
+    os.replace(temporal, ruta)
+
+
+def _meta_propia(id_subida, id_usuario):
+    meta = _leer_meta(id_subida)
+    if meta['idUsuario'] != id_usuario:
+        raise SubidaError('Subida no encontrada', 404)
+    return meta
+
+
+def _recibidos(id_subida):
+    carpeta = _carpeta(id_subida)
+    return sorted(int(n[:-3]) for n in os.listdir(carpeta) if n.endswith('.ok'))
+
+
+def _ultima_actividad(carpeta):
+    try:
+        return max(os.path.getmtime(os.path.join(carpeta, n)) for n in os.listdir(carpeta))
+    except (OSError, ValueError):
+        return 0
+
+
+def _sesiones_usuario(id_usuario):
+    """Sesiones vigentes del usuario; de paso borra las vencidas de cualquiera"""
+    if not os.path.isdir(SUBIDAS_BASE):
+        return []
+    ahora = time.time()
+    vigentes = []
+    for id_subida in os.listdir(SUBIDAS_BASE):
+        carpeta = os.path.join(SUBIDAS_BASE, id_subida)
+        if ahora - _ultima_actividad(carpeta) > SUBIDA_TTL:
+            descartar_subida(id_subida)
+            continue
+        try:
+            meta = _leer_meta(id_subida)
+        except (SubidaError, ValueError):
+            continue
+        if meta['idUsuario'] == id_usuario:
+            vigentes.append(meta)
+    return vigentes
+
+
+def estado(meta):
+    recibidos = _recibidos(meta['idSubida'])
+    faltantes = sorted(set(range(meta['totalChunks'])) - set(recibidos))
+    return {
+        'idSubida': meta['idSubida'],
+        'idItem': meta['idItem'],
+        'nombreArchivo': meta['nombreArchivo'],
+        'tamanoBytes': meta['tamanoBytes'],
+        'tamanoChunk': meta['tamanoChunk'],
+        'totalChunks': meta['totalChunks'],
+        'recibidos': recibidos,
+        'faltantes': faltantes,
+        'completa': not faltantes
+    }
+
+
+# ----------------------------
+# Operaciones
+# ----------------------------
+
+def crear_subida(id_item, id_usuario, datos):
+    nombre = (datos.get('nombreArchivo') or '').strip()
+    try:
+        tamano = int(datos.get('tamanoBytes'))
+    except (TypeError, ValueError):
+        raise SubidaError('tamanoBytes es requerido')
+    if not nombre:
+        raise SubidaError('nombreArchivo es requerido')
+    if tamano <= 0:
+        raise SubidaError('tamanoBytes debe ser mayor a 0')
+    if tamano > SUBIDA_MAX_BYTES:
+        raise SubidaError(f'El archivo excede el máximo de {SUBIDA_MAX_BYTES} bytes', 413)
+
+    abiertas = _sesiones_usuario(id_usuario)
+    if len(abiertas) >= SUBIDAS_ACTIVAS_MAX:
+        raise SubidaError('Demasiadas subidas en curso', 429)
+    if sum(m['tamanoBytes'] for m in abiertas) + tamano > SUBIDAS_CUOTA_BYTES:
+        raise SubidaError('Se excedió la cuota de subidas en curso', 413)
+
+    id_subida = uuid.uuid4().hex
+    carpeta = os.path.join(SUBIDAS_BASE, id_subida)
+    os.makedirs(carpeta)
+
+    # Archivo del tamaño final: cada chunk se escribe en su offset
+    with open(os.path.join(carpeta, 'datos.part'), 'wb') as f:
+        f.truncate(tamano)
+
+    meta = {
+        'idSubida': id_subida,
+        'idItem': id_item,
+        'idUsuario': id_usuario,
+        'nombreArchivo': nombre,
+        'tipoMime': datos.get('tipoMime') or 'application/octet-stream',
+        'notas': datos.get('notas'),
+        'sha256': (datos.get('sha256') or '').lower() or None,
+        'tamanoBytes': tamano,
+        'tamanoChunk': SUBIDA_CHUNK_BYTES,
+        'totalChunks': -(-tamano // SUBIDA_CHUNK_BYTES),
+        'creado': datetime.now().isoformat(timespec='seconds')
+    }
+    _guardar_meta(meta)
+    return estado(meta)
+
+
+def escribir_chunk(id_subida, id_usuario, numero, flujo, longitud):
+    """Copia el cuerpo del request (flujo) al offset del chunk 'numero'"""
+    meta = _meta_propia(id_subida, id_usuario)
+    if numero < 0 or numero >= meta['totalChunks']:
+        raise SubidaError('Número de chunk fuera de rango')
+
+    offset = numero * meta['tamanoChunk']
+    esperado = min(meta['tamanoChunk'], meta['tamanoBytes'] - offset)
+    if longitud is not None and longitud != esperado:
+        raise SubidaError(f'El chunk {numero} debe medir {esperado} bytes')
+
+    carpeta = _carpeta(id_subida)
+    marca = os.path.join(carpeta, f'{numero}.ok')
+    if os.path.exists(marca):
+        return estado(meta)  # ya recibido (reintento del cliente)
+
+    with _hashes_lock:
+        siguiente, total = _hashes.get(id_subida, (0, None))
+    en_orden = numero == siguiente
+    digest_total = (total or hashlib.sha256()).copy() if en_orden else None
+    digest = hashlib.sha256()
+
+    escritos = 0
+    with open(os.path.join(carpeta, 'datos.part'), 'r+b') as f:
+        f.seek(offset)
+        while escritos < esperado:
+            bloque = flujo.read(min(_COPIA_BLOQUE, esperado - escritos))
+            if not bloque:
+                break
+            f.write(bloque)
+            digest.update(bloque)
+            if digest_total:
+                digest_total.update(bloque)
+            escritos += len(bloque)
+        if flujo.read(1):
+            raise SubidaError(f'El chunk {numero} debe medir {esperado} bytes')
+
+    if escritos != esperado:
+        # Conexión cortada: sin marca, el cliente reintenta este chunk
+        raise SubidaError(f'Chunk {numero} incompleto ({escritos} de {esperado} bytes)')
+
+    with open(marca, 'w') as f:
+        f.write(digest.hexdigest())
+
+    if en_orden:
+        with _hashes_lock:
+            if _hashes.get(id_subida, (0, None))[0] == numero:
+                _hashes[id_subida] = (numero + 1, digest_total)
+
+    return estado(meta)
+
+
+def obtener_subida(id_subida, id_usuario):
+    return estado(_meta_propia(id_subida, id_usuario))
+
+
+def completar_subida(id_subida, id_usuario):
+    """
+    Verifica que estén todos los chunks y devuelve (meta, ruta de datos.part,
+    sha256). El llamador coloca una copia (hard link) en su destino y descarta
+    la sesión cuando queda registrada; si falla, la sesión sigue para reintentar.
+    """
+    meta = _meta_propia(id_subida, id_usuario)
+    info = estado(meta)
+    if not info['completa']:
+        raise SubidaError(f"Faltan {len(info['faltantes'])} chunk(s)", 409)
+
+    ruta = os.path.join(_carpeta(id_subida), 'datos.part')
+    with _hashes_lock:
+        siguiente, digest = _hashes.get(id_subida, (0, None))
+
+    if digest is not None and siguiente == meta['totalChunks']:
+        codigo = digest.hexdigest()
+    else:
+        digest = hashlib.sha256()
+        with open(ruta, 'rb') as f:
+            for bloque in iter(lambda: f.read(_COPIA_BLOQUE), b''):
+                digest.update(bloque)
+        codigo = digest.hexdigest()
+
+    if meta['sha256'] and meta['sha256'] != codigo:
+        raise SubidaError('El sha256 del archivo no coincide', 422)
+
+    return meta, ruta, codigo
+
+
+def descartar_subida(id_subida):
+    with _hashes_lock:
+        _hashes.pop(id_subida, None)
+    shutil.rmtree(os.path.join(SUBIDAS_BASE, id_subida), ignore_errors=True)
@@ -10,7 +10,7 @@ from openpyxl import Workbook
 from openpyxl.styles import Font, Alignment, Border, Side, PatternFill
 from openpyxl.utils import get_column_letter
 
-import pdfkit
+from utils.pdf_render import respuesta_pdf
 from flask import render_template, request, send_file
 
 empresas_bp = Blueprint('empresas', __name__)
@@ -637,16 +637,10 @@ def exportar_empresas_pdf():
             fecha=datetime.now().strftime('%d/%m/%Y %H:%M')
         )
 
-        # Configuración de PDFKit (ajusta si wkhtmltopdf está en otro path)
-        config = pdfkit.configuration(wkhtmltopdf='/usr/local/bin/wkhtmltopdf')
-
-        pdf = pdfkit.from_string(html, False, configuration=config)
-
-        return send_file(
-            io.BytesIO(pdf),
-            as_attachment=True,
-            download_name=f'reporte_empresas_{datetime.now().strftime("%Y%m%d_%H%M")}.pdf',
-            mimetype='application/pdf'
+        # wkhtmltopdf se transmite directo a la respuesta (ruta en WKHTMLTOPDF_PATH)
+        return respuesta_pdf(
+            html,
+            f'reporte_empresas_{datetime.now().strftime("%Y%m%d_%H%M")}.pdf'
         )
 
     except Exception as e:
@@ -10,7 +10,6 @@ from openpyxl import Workbook
 from openpyxl.styles import Font, Alignment, Border, Side, PatternFill
 from openpyxl.utils import get_column_letter
 
-import pdfkit
 from flask import render_template, request, send_file
 
 personas_bp = Blueprint('personas', __name__)
@@ -425,7 +424,7 @@ def cambiar_estado_persona(id_cliente):
 # Endpoint para exportar personas a PDF
 from flask import render_template, request, send_file, jsonify
 from datetime import datetime
-import pdfkit
+from utils.pdf_render import respuesta_reporte
 import io
 
 @personas_bp.route('/personas/exportar/pdf', methods=['GET'])
@@ -439,29 +438,21 @@ def exportar_personas_pdf():
         # Obtener datos
         personas = obtener_personas_filtradas(search, estatus)
 
-        # Renderizar HTML
-        html = render_template(
-            'clientes_reporte.html',
-            titulo="REPORTE DE PERSONAS",
-            fecha=datetime.now().strftime("%d/%m/%Y %H:%M"),
-            personas=personas
-        )
-
         # Configuración opcional de wkhtmltopdf (si lo requieres)
         options = {
             'encoding': "UTF-8",
             'enable-local-file-access': None
         }
 
-        # Generar PDF en memoria
-        pdf = pdfkit.from_string(html, False, options=options)
-
-        # Enviar archivo
-        return send_file(
-            io.BytesIO(pdf),
-            as_attachment=True,
-            download_name=f'reporte_personas_{datetime.now().strftime("%Y%m%d_%H%M")}.pdf',
-            mimetype='application/pdf'
+        # Generar y enviar PDF (por bloques en paralelo si hay muchas filas)
+        return respuesta_reporte(
+            'clientes_reporte.html',
+            'personas',
+            personas,
+            f'reporte_personas_{datetime.now().strftime("%Y%m%d_%H%M")}.pdf',
+            options=options,
+            titulo="REPORTE DE PERSONAS",
+            fecha=datetime.now().strftime("%d/%m/%Y %H:%M")
         )
 
     except Exception as e:
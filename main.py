@@ -1,4 +1,6 @@
+import os
 from flask import Flask
+from werkzeug.middleware.proxy_fix import ProxyFix
 from flask_cors import CORS
 from user_system.login import auth_bp
 from user_system.user.registro_usuario import registro_bp, usuarios_bp, procedures_bp, archivos_bp
@@ -17,10 +19,20 @@ from product_system.productos import (
 )
 from product_system.sales.cotizaciones import cotizaciones_bp
 from agendCalendar.agenda_evidencias import agenda_bp, archivos_agenda_bp
+from utils.limpiar_huerfanos import iniciar_barrido_periodico
+from utils.sesiones import iniciar_barrido_sesiones
 
 
+# Proxies (nginx, balanceador) delante de la app que agregan X-Forwarded-For.
+# Con PROXY_SALTOS > 0 request.remote_addr es la IP del cliente (la usan el
+# limitador de login y el historial de sesiones); sin proxy dejar en 0 para que
+# el encabezado no se pueda falsificar.
+PROXY_SALTOS = int(os.getenv('PROXY_SALTOS', 0))
+
 app = Flask(__name__)
 CORS(app)
+if PROXY_SALTOS > 0:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=PROXY_SALTOS)
 
 # Si tu app usa prefijo '/api' para rutas REST:
 app.register_blueprint(agenda_bp, url_prefix='/api')
@@ -46,6 +58,13 @@ app.register_blueprint(roles_bp, url_prefix='/api')
 app.register_blueprint(empresas_bp, url_prefix='/api')
 app.register_blueprint(personas_bp, url_prefix='/api')
 
+# Limpieza periódica de uploads/ sin referencia (HUERFANOS_INTERVALO > 0); cada
+# worker lanza su hilo, pero sólo barre el que obtiene el candado en MySQL
+iniciar_barrido_periodico()
+# Cierre de sesiones vencidas y archivo mensual (SESIONES_INTERVALO > 0), también
+# bajo candado en MySQL
+iniciar_barrido_sesiones()
+
 '''
 if __name__ == '__main__':
     app.run(debug=True, port=5000)
@@ -0,0 +1,235 @@
+# /product_system/importar_productos.py
+# Importación masiva de productos desde XLSX / CSV (upsert por NoSerie).
+# Requiere índice único en productos.NoSerie (ver sql/productos_noserie_unico.sql).
+
+import os
+import csv
+import uuid
+import threading
+from datetime import datetime, timedelta
+from openpyxl import load_workbook
+from db_config import get_connection
+from utils.auditoria import registrar_auditoria
+
+IMPORT_CHUNK = int(os.getenv('PRODUCTOS_IMPORT_CHUNK', 500))
+IMPORT_MAX_ERRORES = 1000
+# Segundos que se conserva el resultado de un trabajo terminado
+IMPORT_RETENCION = int(os.getenv('PRODUCTOS_IMPORT_RETENCION', 3600))
+
+CAMPOS_REQUERIDOS = ['nombre', 'NoSerie', 'marca', 'modelo', 'precio', 'stock', 'idProveedor', 'idCategoria']
+
+_UPSERT = """
+    INSERT INTO productos
+        (nombre, NoSerie, marca, modelo, descripcion, precio, stock, idProveedor, idCategoria)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE
+        nombre = VALUES(nombre),
+        marca = VALUES(marca),
+        modelo = VALUES(modelo),
+        descripcion = VALUES(descripcion),
+        precio = VALUES(precio),
+        stock = VALUES(stock),
+        idProveedor = VALUES(idProveedor),
+        idCategoria = VALUES(idCategoria)
+"""
+
+# Trabajos en memoria del proceso: {id: {...estado...}}; los terminados se
+# retiran IMPORT_RETENCION segundos después de terminar
+_trabajos = {}
+_trabajos_lock = threading.Lock()
+
+
+def _purgar_trabajos():
+    """Quita los trabajos terminados hace más de IMPORT_RETENCION (con _trabajos_lock tomado)"""
+    limite = (datetime.now() - timedelta(seconds=IMPORT_RETENCION)).isoformat(timespec='seconds')
+    for id_trabajo in [i for i, t in _trabajos.items() if t['terminado'] and t['terminado'] < limite]:
+        del _trabajos[id_trabajo]
+
+
+# ----------------------------
+# Lectura por streaming
+# ----------------------------
+
+def _filas_xlsx(ruta):
+    wb = load_workbook(ruta, read_only=True, data_only=True)
+    try:
+        filas = wb.active.iter_rows(values_only=True)
+        encabezados = [str(h).strip() if h is not None else '' for h in next(filas, [])]
+        for n, valores in enumerate(filas, start=2):
+            if not any(v not in (None, '') for v in valores):
+                continue
+            yield n, dict(zip(encabezados, valores))
+    finally:
+        wb.close()
+
+
+def _filas_csv(ruta):
+    with open(ruta, newline='', encoding='utf-8-sig') as f:
+        lector = csv.DictReader(f)
+        lector.fieldnames = [h.strip() for h in (lector.fieldnames or [])]
+        for n, fila in enumerate(lector, start=2):
+            if not any((v or '').strip() for v in fila.values() if isinstance(v, str)):
+                continue
+            yield n, fila
+
+
+def _validar(fila, proveedores, categorias):
+    """Devuelve la tupla para el upsert o lanza ValueError con el motivo"""
+    faltantes = [c for c in CAMPOS_REQUERIDOS if fila.get(c) in (None, '')]
+    if faltantes:
+        raise ValueError(f"Faltan campos: {', '.join(faltantes)}")
+
+    try:
+        precio = float(fila['precio'])
+        stock = int(float(fila['stock']))
+        id_proveedor = int(fila['idProveedor'])
+        id_categoria = int(fila['idCategoria'])
+    except (TypeError, ValueError):
+        raise ValueError("precio, stock, idProveedor e idCategoria deben ser numéricos")
+
+    if precio < 0:
+        raise ValueError("El precio no puede ser negativo")
+    if id_proveedor not in proveedores:
+        raise ValueError(f"Proveedor {id_proveedor} no existe")
+    if id_categoria not in categorias:
+        raise ValueError(f"Categoría {id_categoria} no existe")
+
+    return (
+        str(fila['nombre']).strip(), str(fila['NoSerie']).strip(),
+        str(fila['marca']).strip(), str(fila['modelo']).strip(),
+        fila.get('descripcion') or None,
+        precio, stock, id_proveedor, id_categoria
+    )
+
+
+# ----------------------------
+# Trabajo
+# ----------------------------
+
+def _error(trabajo, fila, mensaje):
+    trabajo['totalErrores'] += 1
+    if len(trabajo['errores']) < IMPORT_MAX_ERRORES:
+        trabajo['errores'].append({'fila': fila, 'error': mensaje})
+
+
+def _guardar_bloque(conexion, trabajo, bloque):
+    """executemany del bloque; si falla, se reintenta fila por fila para ubicar el error"""
+    with conexion.cursor() as cursor:
+        try:
+            cursor.executemany(_UPSERT, [valores for _, valores in bloque])
+            conexion.commit()
+            trabajo['procesadas'] += len(bloque)
+            return
+        except Exception:
+            conexion.rollback()
+
+        for n, valores in bloque:
+            try:
+                cursor.execute(_UPSERT, valores)
+                conexion.commit()
+                trabajo['procesadas'] += 1
+            except Exception as e:
+                conexion.rollback()
+                _error(trabajo, n, str(e))
+
+
+def _ejecutar(trabajo, ruta, id_usuario):
+    conexion = get_connection()
+    try:
+        # Catálogos en memoria: una consulta por tabla en vez de una por fila
+        with conexion.cursor() as cursor:
+            cursor.execute("SELECT idProveedor FROM proveedores")
+            proveedores = {r[0] for r in cursor.fetchall()}
+            cursor.execute("SELECT idCategoria FROM categorias")
+            categorias = {r[0] for r in cursor.fetchall()}
+
+        lector = _filas_xlsx if trabajo['archivo'].lower().endswith('.xlsx') else _filas_csv
+        bloque = []
+        for n, fila in lector(ruta):
+            trabajo['filasLeidas'] += 1
+            try:
+                bloque.append((n, _validar(fila, proveedores, categorias)))
+            except ValueError as e:
+                _error(trabajo, n, str(e))
+
+            if len(bloque) >= IMPORT_CHUNK:
+                _guardar_bloque(conexion, trabajo, bloque)
+                bloque = []
+
+        if bloque:
+            _guardar_bloque(conexion, trabajo, bloque)
+
+        trabajo['estado'] = 'terminado'
+    except Exception as e:
+        print(f"Error en importación de productos: {e}")
+        trabajo['estado'] = 'error'
+        trabajo['mensaje'] = str(e)
+    finally:
+        conexion.close()
+        trabajo['terminado'] = datetime.now().isoformat(timespec='seconds')
+        try:
+            os.remove(ruta)
+        except OSError:
+            pass
+
+    # Un solo registro de auditoría para todo el archivo
+    registrar_auditoria(
+        id_usuario,
+        'import',
+        'productos',
+        None,
+        valores_anteriores=None,
+        valores_nuevos={
+            'idImportacion': trabajo['id'],
+            'archivo': trabajo['archivo'],
+            'filasLeidas': trabajo['filasLeidas'],
+            'procesadas': trabajo['procesadas'],
+            'errores': trabajo['totalErrores'],
+            'estado': trabajo['estado']
+        }
+    )
+
+
+def iniciar_importacion(archivo, id_usuario):
+    """
+    Guarda el archivo subido en un temporal y procesa en segundo plano.
+    Devuelve el estado inicial del trabajo (consultar con obtener_importacion).
+    """
+    extension = os.path.splitext(archivo.filename or '')[1].lower()
+    if extension not in ('.xlsx', '.csv'):
+        raise ValueError("Formato no soportado, use .xlsx o .csv")
+
+    carpeta = os.path.join('uploads', 'importaciones')
+    os.makedirs(carpeta, exist_ok=True)
+    id_trabajo = uuid.uuid4().hex
+    ruta = os.path.join(carpeta, f"{id_trabajo}{extension}")
+    archivo.save(ruta)
+
+    trabajo = {
+        'id': id_trabajo,
+        'archivo': archivo.filename,
+        'estado': 'en_proceso',
+        'filasLeidas': 0,
+        'procesadas': 0,
+        'totalErrores': 0,
+        'errores': [],
+        'idUsuario': id_usuario,
+        'iniciado': datetime.now().isoformat(timespec='seconds'),
+        'terminado': None
+    }
+    with _trabajos_lock:
+        _purgar_trabajos()
+        _trabajos[id_trabajo] = trabajo
+
+    threading.Thread(target=_ejecutar, args=(trabajo, ruta, id_usuario), daemon=True).start()
+    return trabajo
+
+
+def obtener_importacion(id_trabajo, id_usuario):
+    """Estado del trabajo si existe y lo inició id_usuario; None en otro caso"""
+    with _trabajos_lock:
+        _purgar_trabajos()
+        trabajo = _trabajos.get(id_trabajo)
+        if not trabajo or trabajo['idUsuario'] != id_usuario:
+            return None
+        return dict(trabajo, errores=list(trabajo['errores']))
@@ -6,7 +6,12 @@ from werkzeug.utils import secure_filename
 from db_config import get_connection
 from utils.session_validator import session_validator
 from utils.auditoria import registrar_auditoria
-from utils.file_utils import subir_archivo, eliminar_archivo  # Asumiré que creamos estas funciones
+from utils.file_utils import subir_archivo, confirmar_archivo, cancelar_archivo, eliminar_archivo
+from utils.entrega_archivos import enviar_archivo
+from utils.imagenes import resolver_variante, ImagenRechazada
+from utils.blob_store import ruta_en_disco, es_blob, desvincular_blob, liberar_blob
+from utils.cache_archivos import archivo_registro, invalidar_referencia
+from product_system.importar_productos import iniciar_importacion, obtener_importacion
 
 # Crear blueprints
 categorias_bp = Blueprint('categorias', __name__)
@@ -502,6 +507,7 @@ def crear_producto():
         return jsonify({"error": "El precio no puede ser negativo"}), 400
 
     conexion = get_connection()
+    blob = None
     try:
         with conexion.cursor() as cursor:
             # Insertar producto
@@ -516,19 +522,18 @@ def crear_producto():
             # Si se envió una imagen, guardarla
             nombre_archivo = None
             if archivo:
-                nombre_archivo = subir_archivo(
-                    tabla='productos',
-                    id_registro=id_producto,
-                    archivo=archivo,
-                    campo='foto',
-                    carpeta='productos'
-                )
+                # La referencia al blob va en la misma transacción que el INSERT
+                blob = subir_archivo(conexion, 'productos', id_producto, archivo, 'foto')
+                nombre_archivo = blob['nombre']
                 # Actualizar el registro con el nombre del archivo
                 cursor.execute(
                     "UPDATE productos SET foto = %s WHERE idProducto = %s",
                     (nombre_archivo, id_producto))
 
             conexion.commit()
+            if blob:
+                confirmar_archivo(blob)
+                blob = None
 
             # Preparar datos para auditoría
             datos_auditoria = {k: datos[k] for k in datos}
@@ -545,8 +550,13 @@ def crear_producto():
             )
 
         return jsonify({"mensaje": "Producto creado", "id": id_producto}), 201
+    except ImagenRechazada:
+        conexion.rollback()
+        return jsonify({"error": "Imagen demasiado grande"}), 400
     except Exception as e:
         conexion.rollback()
+        if blob:
+            cancelar_archivo(blob)
         print(f"Error al crear producto: {e}")
         return jsonify({"error": "Error al crear producto"}), 500
     finally:
@@ -567,6 +577,7 @@ def actualizar_producto(id_producto):
         return jsonify({"error": "El precio no puede ser negativo"}), 400
 
     conexion = get_connection()
+    blob = None
     try:
         with conexion.cursor(dictionary=True) as cursor:
             # Obtener producto anterior
@@ -587,26 +598,31 @@ def actualizar_producto(id_producto):
 
             # Manejo de imagen
             nombre_archivo = None
+            blob_liberado = None
+            foto_quitada = None
             if archivo:
-                nombre_archivo = subir_archivo(
-                    tabla='productos',
-                    id_registro=id_producto,
-                    archivo=archivo,
-                    campo='foto',
-                    carpeta='productos'
-                )
+                blob = subir_archivo(conexion, 'productos', id_producto, archivo, 'foto')
+                nombre_archivo = blob['nombre']
                 cursor.execute(
                     "UPDATE productos SET foto = %s WHERE idProducto = %s",
                     (nombre_archivo, id_producto))
             elif 'foto' in datos and datos['foto'] == '':  # Si se indica borrar la imagen
-                # Eliminar imagen actual si existe
-                if producto_anterior['foto']:
-                    eliminar_archivo(producto_anterior['foto'], 'productos')
+                # La referencia se quita en la misma transacción; el archivo, después del commit
+                foto_quitada = producto_anterior['foto']
+                blob_liberado = desvincular_blob(conexion, 'productos', id_producto, 'foto')
                 cursor.execute(
                     "UPDATE productos SET foto = NULL WHERE idProducto = %s",
                     (id_producto,))
 
             conexion.commit()
+            invalidar_referencia('productos', id_producto, 'foto')
+            if blob:
+                confirmar_archivo(blob)
+                blob = None
+            if blob_liberado:
+                liberar_blob(blob_liberado)
+            elif foto_quitada and not es_blob(foto_quitada):
+                eliminar_archivo(foto_quitada, 'productos', 'productos', id_producto, 'foto')
 
             # Preparar auditoría
             valores_anteriores = {k: producto_anterior[k] for k in producto_anterior}
@@ -626,8 +642,13 @@ def actualizar_producto(id_producto):
             )
 
         return jsonify({"mensaje": "Producto actualizado"}), 200
+    except ImagenRechazada:
+        conexion.rollback()
+        return jsonify({"error": "Imagen demasiado grande"}), 400
     except Exception as e:
         conexion.rollback()
+        if blob:
+            cancelar_archivo(blob)
         print(f"Error al actualizar producto: {e}")
         return jsonify({"error": "Error al actualizar producto"}), 500
     finally:
@@ -646,13 +667,19 @@ def eliminar_producto(id_producto):
             if not producto:
                 return jsonify({"error": "Producto no encontrado"}), 404
 
-            # Eliminar imagen si existe
-            if producto['foto']:
-                eliminar_archivo(producto['foto'], 'productos')
+            # La referencia a la foto se quita en la misma transacción que el DELETE
+            blob_liberado = desvincular_blob(conexion, 'productos', id_producto, 'foto')
 
             # Eliminar producto
             cursor.execute("DELETE FROM productos WHERE idProducto = %s", (id_producto,))
             conexion.commit()
+            invalidar_referencia('productos', id_producto)
+
+            # Después del commit: el blob se borra si nadie más lo usa
+            if blob_liberado:
+                liberar_blob(blob_liberado)
+            elif producto['foto'] and not es_blob(producto['foto']):
+                eliminar_archivo(producto['foto'], 'productos', 'productos', id_producto, 'foto')
 
             # Auditoría
             registrar_auditoria(
@@ -673,29 +700,57 @@ def eliminar_producto(id_producto):
         conexion.close()
 
 
-# Servir imagen del producto
-@archivos_productos_bp.route('/archivo/productos/<int:id_producto>/foto', methods=['GET'])
-def servir_foto_producto(id_producto):
-    conexion = get_connection()
+# Importación masiva desde XLSX / CSV (upsert por NoSerie)
+@productos_bp.route('/productos/importar', methods=['POST'])
+@session_validator(tabla="productos", accion="create")
+def importar_productos():
+    archivo = request.files.get('archivo', None)
+    if not archivo or not archivo.filename:
+        return jsonify({"error": "No se envió ningún archivo"}), 400
+
     try:
-        with conexion.cursor(dictionary=True) as cursor:
-            cursor.execute("SELECT foto FROM productos WHERE idProducto = %s", (id_producto,))
-            producto = cursor.fetchone()
-            if not producto or not producto['foto']:
-                return jsonify({'error': 'Foto no encontrada'}), 404
+        trabajo = iniciar_importacion(archivo, g.user_id)
+        return jsonify({
+            "mensaje": "Importación iniciada",
+            "id": trabajo['id'],
+            "estado": f"/api/productos/importar/{trabajo['id']}"
+        }), 202
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        print(f"Error al iniciar importación: {e}")
+        return jsonify({"error": "Error al iniciar importación"}), 500
 
-            nombre_archivo = producto['foto']
-            ruta_archivo = os.path.join(PRODUCTOS_FOLDER, nombre_archivo)
 
-            if not os.path.exists(ruta_archivo):
-                return jsonify({'error': 'Archivo no encontrado'}), 404
+@productos_bp.route('/productos/importar/<string:id_trabajo>', methods=['GET'])
+@session_validator(tabla="productos", accion="create")
+def estado_importacion_productos(id_trabajo):
+    # Sólo quien inició la importación puede consultarla
+    trabajo = obtener_importacion(id_trabajo, g.user_id)
+    if not trabajo:
+        return jsonify({"error": "Importación no encontrada"}), 404
+    return jsonify(trabajo), 200
 
-            return send_file(ruta_archivo, mimetype='image/jpeg')
+
+# Servir imagen del producto
+@archivos_productos_bp.route('/archivo/productos/<int:id_producto>/foto', methods=['GET'])
+def servir_foto_producto(id_producto):
+    try:
+        # Nombre de la foto desde caché (sin conexión a la DB en el caso común)
+        existe, nombre_archivo, ruta_archivo, stat = archivo_registro(
+            'productos', id_producto, 'foto', lambda nombre: ruta_en_disco('productos', nombre))
+        if not existe or not nombre_archivo:
+            return jsonify({'error': 'Foto no encontrada'}), 404
+
+        if stat is None:
+            return jsonify({'error': 'Archivo no encontrado'}), 404
+
+        # ?size=thumb|medium|full
+        ruta_archivo = resolver_variante(ruta_archivo, request.args.get('size'))
+        return enviar_archivo(ruta_archivo)
     except Exception as e:
         print("Error al servir archivo:", e)
         return jsonify({"error": "Error al obtener foto"}), 500
-    finally:
-        conexion.close()
 
 
 # Nuevo endpoint en productos.py
@@ -0,0 +1,292 @@
+# sales/analitica_cotizaciones.py
+# Snapshot columnar (Parquet) de cotizaciones e items para análisis fuera de MySQL.
+#
+# Estructura en disco (particionado Hive por mes de la cotización):
+#   analitica/cotizaciones/anio_mes=2025-01/lote-<lote>-0.parquet
+#   analitica/cotizacion_items/anio_mes=2025-01/lote-<lote>-0.parquet
+#   analitica/_estado.json   -> marca de agua (fechaActualizacion, idCotizacion)
+#
+# Cada corrida agrega sólo cotizaciones nuevas o modificadas desde la marca de
+# agua. Una cotización modificada queda con varias versiones (una por lote);
+# las funciones de consulta devuelven sólo la más reciente. Las cotizaciones
+# eliminadas en MySQL no se retiran del snapshot.
+#
+# Uso:  python -m product_system.sales.analitica_cotizaciones
+
+import os
+import json
+import time
+from datetime import datetime
+from decimal import Decimal
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+from db_config import get_connection
+
+SNAPSHOT_DIR = os.getenv('ANALITICA_DIR', 'analitica')
+SNAPSHOT_LOTE = int(os.getenv('ANALITICA_LOTE', 2000))
+
+_ESQUEMA_COTIZACIONES = pa.schema([
+    ('idCotizacion', pa.int64()),
+    ('folio', pa.string()),
+    ('fecha', pa.timestamp('us')),
+    ('estatus', pa.string()),
+    ('idCliente', pa.int64()),
+    ('clienteTipo', pa.string()),
+    ('clienteNombre', pa.string()),
+    ('clienteRfc', pa.string()),
+    ('idUsuario', pa.int64()),
+    ('asesorNombre', pa.string()),
+    ('asesorEmail', pa.string()),
+    ('descuentoPorcentaje', pa.float64()),
+    ('ivaHabilitado', pa.bool_()),
+    ('ivaPorcentaje', pa.float64()),
+    ('subtotal', pa.float64()),
+    ('descuentoImporte', pa.float64()),
+    ('ivaImporte', pa.float64()),
+    ('total', pa.float64()),
+    ('fechaCreacion', pa.timestamp('us')),
+    ('fechaActualizacion', pa.timestamp('us')),
+    ('_lote', pa.int64()),
+    ('anio_mes', pa.string()),
+])
+
+_ESQUEMA_ITEMS = pa.schema([
+    ('idItem', pa.int64()),
+    ('idCotizacion', pa.int64()),
+    ('idProducto', pa.int64()),
+    ('nombre', pa.string()),
+    ('marca', pa.string()),
+    ('modelo', pa.string()),
+    ('NoSerie', pa.string()),
+    ('precioUnitario', pa.float64()),
+    ('cantidad', pa.int64()),
+    ('importe', pa.float64()),
+    # Columnas desnormalizadas del encabezado
+    ('folio', pa.string()),
+    ('fecha', pa.timestamp('us')),
+    ('estatus', pa.string()),
+    ('idCliente', pa.int64()),
+    ('clienteNombre', pa.string()),
+    ('idUsuario', pa.int64()),
+    ('asesorNombre', pa.string()),
+    ('fechaActualizacion', pa.timestamp('us')),
+    ('_lote', pa.int64()),
+    ('anio_mes', pa.string()),
+])
+
+
+# ----------------------------
+# Helpers
+# ----------------------------
+
+def _float(v):
+    return float(v) if isinstance(v, Decimal) else v
+
+
+def _leer_estado(destino):
+    ruta = os.path.join(destino, '_estado.json')
+    if not os.path.exists(ruta):
+        return {'fechaActualizacion': '1970-01-01 00:00:00', 'idCotizacion': 0}
+    with open(ruta, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _guardar_estado(destino, estado):
+    ruta = os.path.join(destino, '_estado.json')
+    temporal = f"{ruta}.tmp"
+    with open(temporal, 'w', encoding='utf-8') as f:
+        json.dump(estado, f, ensure_ascii=False, indent=2, default=str)
+    os.replace(temporal, ruta)
+
+
+def _siguiente_lote(cursor, estado, limite):
+    """Keyset sobre (version, idCotizacion) para no repetir ni saltar filas"""
+    cursor.execute("""
+        SELECT
+            ct.idCotizacion, ct.folio, ct.fecha, ct.estatus,
+            ct.idCliente,
+            c.tipoCliente AS clienteTipo,
+            CASE WHEN c.tipoCliente = 'Persona'
+                 THEN CONCAT(c.nombre, ' ', COALESCE(c.apellidoP,''), ' ', COALESCE(c.apellidoM,''))
+                 ELSE c.nombre END AS clienteNombre,
+            c.rfc AS clienteRfc,
+            ct.idUsuario,
+            CONCAT(u.nombre, ' ', COALESCE(u.apellidop,''), ' ', COALESCE(u.apellidom,'')) AS asesorNombre,
+            u.email AS asesorEmail,
+            ct.descuentoPorcentaje, ct.ivaHabilitado, ct.ivaPorcentaje,
+            ct.subtotal, ct.descuentoImporte, ct.ivaImporte, ct.total,
+            ct.fechaCreacion,
+            COALESCE(ct.fechaActualizacion, ct.fechaCreacion) AS fechaActualizacion
+        FROM cotizaciones ct
+        JOIN clientes c ON c.idCliente = ct.idCliente
+        LEFT JOIN usuarios u ON u.idUsuario = ct.idUsuario
+        WHERE (COALESCE(ct.fechaActualizacion, ct.fechaCreacion) > %s
+               OR (COALESCE(ct.fechaActualizacion, ct.fechaCreacion) = %s AND ct.idCotizacion > %s))
+          -- fechaActualizacion tiene resolución de segundos: el segundo en curso
+          -- se deja para la siguiente corrida, así ninguna fila con un id menor
+          -- puede quedar detrás de la marca de agua dentro del mismo segundo
+          AND COALESCE(ct.fechaActualizacion, ct.fechaCreacion) < NOW() - INTERVAL 1 SECOND
+        ORDER BY COALESCE(ct.fechaActualizacion, ct.fechaCreacion) ASC, ct.idCotizacion ASC
+        LIMIT %s
+    """, (estado['fechaActualizacion'], estado['fechaActualizacion'], estado['idCotizacion'], limite))
+    return cursor.fetchall()
+
+
+def _items_de(cursor, ids):
+    marcadores = ", ".join(["%s"] * len(ids))
+    cursor.execute(f"""
+        SELECT idItem, idCotizacion, idProducto, nombre, marca, modelo, NoSerie,
+               precioUnitario, cantidad
+        FROM cotizacion_items
+        WHERE idCotizacion IN ({marcadores})
+        ORDER BY idCotizacion ASC, idItem ASC
+    """, tuple(ids))
+    return cursor.fetchall()
+
+
+def _escribir(destino, nombre, filas, esquema, lote):
+    if not filas:
+        return
+    tabla = pa.Table.from_pylist(filas, schema=esquema)
+    ds.write_dataset(
+        tabla,
+        os.path.join(destino, nombre),
+        format='parquet',
+        partitioning=ds.partitioning(pa.schema([('anio_mes', pa.string())]), flavor='hive'),
+        basename_template=f"lote-{lote}-{{i}}.parquet",
+        existing_data_behavior='overwrite_or_ignore'
+    )
+
+
+# ----------------------------
+# Exportación incremental
+# ----------------------------
+
+def exportar_snapshot(destino=SNAPSHOT_DIR, lote=SNAPSHOT_LOTE):
+    """
+    Agrega al snapshot las cotizaciones nuevas o modificadas desde la última
+    corrida. La marca de agua se guarda después de escribir cada lote, así una
+    corrida interrumpida continúa donde se quedó (a lo sumo repite un lote,
+    que las consultas descartan por _lote).
+    """
+    os.makedirs(destino, exist_ok=True)
+    estado = _leer_estado(destino)
+    total_cot = 0
+    total_items = 0
+
+    conn = get_connection()
+    try:
+        with conn.cursor(dictionary=True) as cursor:
+            while True:
+                cotizaciones = _siguiente_lote(cursor, estado, lote)
+                if not cotizaciones:
+                    break
+
+                id_lote = time.time_ns() // 1000
+                encabezados = {}
+                for cot in cotizaciones:
+                    cot = {k: _float(v) for k, v in cot.items()}
+                    cot['ivaHabilitado'] = bool(cot['ivaHabilitado'])
+                    cot['anio_mes'] = cot['fecha'].strftime('%Y-%m') if cot['fecha'] else 'sin-fecha'
+                    cot['_lote'] = id_lote
+                    encabezados[cot['idCotizacion']] = cot
+
+                items = []
+                for it in _items_de(cursor, list(encabezados)):
+                    cot = encabezados[it['idCotizacion']]
+                    it = {k: _float(v) for k, v in it.items()}
+                    it['importe'] = (it['precioUnitario'] or 0) * (it['cantidad'] or 0)
+                    for k in ('folio', 'fecha', 'estatus', 'idCliente', 'clienteNombre',
+                              'idUsuario', 'asesorNombre', 'fechaActualizacion', '_lote', 'anio_mes'):
+                        it[k] = cot[k]
+                    items.append(it)
+
+                _escribir(destino, 'cotizaciones', list(encabezados.values()), _ESQUEMA_COTIZACIONES, id_lote)
+                _escribir(destino, 'cotizacion_items', items, _ESQUEMA_ITEMS, id_lote)
+
+                ultima = cotizaciones[-1]
+                estado = {
+                    'fechaActualizacion': str(ultima['fechaActualizacion']),
+                    'idCotizacion': ultima['idCotizacion'],
+                    'ultimaCorrida': datetime.now().isoformat(timespec='seconds')
+                }
+                _guardar_estado(destino, estado)
+
+                total_cot += len(encabezados)
+                total_items += len(items)
+                if len(cotizaciones) < lote:
+                    break
+    finally:
+        conn.close()
+
+    return {'cotizaciones': total_cot, 'items': total_items, 'estado': estado}
+
+
+# ----------------------------
+# Consulta
+# ----------------------------
+
+def _dataset(destino, nombre):
+    return ds.dataset(os.path.join(destino, nombre), format='parquet', partitioning='hive')
+
+
+def _ultimos_lotes(destino):
+    """
+    (idCotizacion, _lote) de la versión más reciente de cada cotización, sobre
+    todos los encabezados y sin filtros: una versión vieja que cumpla el filtro
+    (o esté en otro mes) no debe pasar por vigente.
+    """
+    tabla = _dataset(destino, 'cotizaciones').to_table(columns=['idCotizacion', '_lote'])
+    ultimos = tabla.group_by('idCotizacion').aggregate([('_lote', 'max')])
+    return ultimos.rename_columns(['idCotizacion', '_lote'])
+
+
+def _vigentes(nombre, meses=None, columnas=None, filtro=None, destino=SNAPSHOT_DIR):
+    """
+    Lee un dataset del snapshot dejando sólo las filas del último _lote de cada
+    cotización según los encabezados. Para items esto descarta también los de
+    versiones anteriores cuando la versión actual se quedó sin items.
+    """
+    dataset = _dataset(destino, nombre)
+
+    condicion = None
+    if meses:
+        condicion = ds.field('anio_mes').isin(list(meses))
+    if filtro is not None:
+        condicion = filtro if condicion is None else (condicion & filtro)
+
+    lectura = None
+    if columnas:
+        lectura = list(dict.fromkeys([*columnas, 'idCotizacion', '_lote']))
+    tabla = dataset.to_table(columns=lectura, filter=condicion)
+
+    tabla = tabla.join(_ultimos_lotes(destino), keys=['idCotizacion', '_lote'], join_type='inner')
+    return tabla.select(columnas) if columnas else tabla
+
+
+def consultar_cotizaciones(meses=None, columnas=None, filtro=None, destino=SNAPSHOT_DIR):
+    """
+    Encabezados vigentes como pyarrow.Table (usar .to_pandas() si se requiere).
+    meses: ['2025-01', '2025-02'] limita las particiones que se leen.
+    filtro: expresión pyarrow, p.ej. ds.field('estatus') == 'enviada'.
+    """
+    return _vigentes('cotizaciones', meses, columnas, filtro, destino)
+
+
+def consultar_items(meses=None, columnas=None, filtro=None, destino=SNAPSHOT_DIR):
+    """Items vigentes (con columnas de cliente y asesor) como pyarrow.Table"""
+    return _vigentes('cotizacion_items', meses, columnas, filtro, destino)
+
+
+def total_por_mes(meses=None, destino=SNAPSHOT_DIR):
+    """Ejemplo de agregación: importe vendido por mes y asesor"""
+    items = consultar_items(meses, ['anio_mes', 'asesorNombre', 'importe'], destino=destino)
+    return items.group_by(['anio_mes', 'asesorNombre']).aggregate([('importe', 'sum')]) \
+        .sort_by([('anio_mes', 'ascending'), ('importe_sum', 'descending')])
+
+
+if __name__ == '__main__':
+    resumen = exportar_snapshot()
+    print(f"Snapshot actualizado: {resumen['cotizaciones']} cotización(es), {resumen['items']} item(s)")
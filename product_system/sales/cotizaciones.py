@@ -55,6 +55,32 @@ def _cliente_nombre_expr():
             "THEN CONCAT(c.nombre, ' ', COALESCE(c.apellidoP,''), ' ', COALESCE(c.apellidoM,'')) "
             "ELSE c.nombre END")
 
+def _filtros_cotizaciones(search, status):
+    """
+    Construye las condiciones WHERE (alias ct = cotizaciones, c = clientes)
+    para los filtros de búsqueda y estatus. Devuelve (where, params).
+    """
+    where = ["1=1"]
+    params = []
+
+    # Filtro status
+    if status in ('guardada','enviada','borrador','cancelada'):
+        where.append("ct.estatus = %s")
+        params.append(status)
+
+    # Filtro búsqueda
+    if search:
+        # Coincidir por folio o por nombre de cliente (persona o empresa)
+        where.append("("
+                     "ct.folio LIKE %s OR "
+                     "(c.tipoCliente = 'Persona' AND CONCAT(c.nombre,' ',COALESCE(c.apellidoP,''),' ',COALESCE(c.apellidoM,'')) LIKE %s) OR "
+                     "(c.tipoCliente <> 'Persona' AND c.nombre LIKE %s)"
+                     ")")
+        s = f"%{search}%"
+        params.extend([s, s, s])
+
+    return where, params
+
 def _fetch_cotizacion(conn, id_cot):
     with conn.cursor(dictionary=True) as cur:
         # Header
@@ -212,6 +238,9 @@ def crear_cotizacion():
 
         conn.commit()
 
+        if estatus == 'enviada':
+            _precalentar_pdf_cotizacion(id_cot)
+
         # Auditoría
         registrar_auditoria(
             g.user_id, 'create', 'cotizaciones', id_cot,
@@ -265,24 +294,7 @@ def listar_cotizaciones():
     except ValueError:
         page, per_page = 1, 10
 
-    where = ["1=1"]
-    params = []
-
-    # Filtro status
-    if status in ('guardada','enviada','borrador','cancelada'):
-        where.append("ct.estatus = %s")
-        params.append(status)
-
-    # Filtro búsqueda
-    if search:
-        # Coincidir por folio o por nombre de cliente (persona o empresa)
-        where.append("("
-                     "ct.folio LIKE %s OR "
-                     "(c.tipoCliente = 'Persona' AND CONCAT(c.nombre,' ',COALESCE(c.apellidoP,''),' ',COALESCE(c.apellidoM,'')) LIKE %s) OR "
-                     "(c.tipoCliente <> 'Persona' AND c.nombre LIKE %s)"
-                     ")")
-        s = f"%{search}%"
-        params.extend([s, s, s])
+    where, params = _filtros_cotizaciones(search, status)
 
     # Orden
     order = "ct.fecha DESC"
@@ -393,7 +405,8 @@ def actualizar_cotizacion(id_cot):
                        subtotal = %s,
                        descuentoImporte = %s,
                        ivaImporte = %s,
-                       total = %s
+                       total = %s,
+                       fechaActualizacion = NOW()
                  WHERE idCotizacion = %s
             """, (estatus, str(desc_pct), int(iva_enabled), str(iva_pct),
                   str(subtotal), str(desc_imp), str(iva_imp), str(total),
@@ -414,6 +427,11 @@ def actualizar_cotizacion(id_cot):
 
         conn.commit()
 
+        # El PDF cacheado ya no corresponde a esta versión
+        invalidar_pdf_cache(id_cot)
+        if estatus == 'enviada' and anterior['estatus'] != 'enviada':
+            _precalentar_pdf_cotizacion(id_cot)
+
         nuevo = _fetch_cotizacion(conn, id_cot)
         registrar_auditoria(g.user_id, 'update', 'cotizaciones', id_cot,
                             valores_anteriores=anterior, valores_nuevos=nuevo)
@@ -443,6 +461,8 @@ def eliminar_cotizacion(id_cot):
 
         conn.commit()
 
+        invalidar_pdf_cache(id_cot)
+
         registrar_auditoria(g.user_id, 'delete', 'cotizaciones', id_cot,
                             valores_anteriores=anterior, valores_nuevos=None)
         return jsonify({"mensaje": "Cotización eliminada"}), 200
@@ -459,116 +479,379 @@ def eliminar_cotizacion(id_cot):
 # exportacion pdf
 
 # user_system/cotizaciones.py
-from flask import jsonify, request, send_file, render_template, g
+from flask import jsonify, request, send_file, render_template, g, current_app
 from db_config import get_connection
 from utils.session_validator import session_validator
+from utils.pdf_cache import obtener_pdf_cache, guardar_pdf_cache, invalidar_pdf_cache, ruta_pdf_cache
+from utils.pdf_render import html_a_pdf, respuesta_pdf, obtener_pool, contar_paginas, PDF_MAX_WORKERS
 from datetime import datetime, timedelta
-import pdfkit, io
+from concurrent.futures import wait, FIRST_COMPLETED
+import threading
+import zipfile
+import time
+import json
+import io
+import os
+
+# Rango aceptado para ?dias= (validez impresa en el PDF)
+COTIZACION_DIAS_MAX = int(os.getenv('COTIZACION_DIAS_MAX', 365))
+
+
+def _dias_validez(valor):
+    """'dias' del request como entero en 1..COTIZACION_DIAS_MAX; ValueError si no"""
+    dias = int(valor)
+    if not 1 <= dias <= COTIZACION_DIAS_MAX:
+        raise ValueError(f"dias debe estar entre 1 y {COTIZACION_DIAS_MAX}")
+    return dias
+
+
+def _version_cotizacion(cursor, id_cotizacion):
+    """Lectura ligera de folio + fechaActualizacion para resolver la caché"""
+    cursor.execute("""
+        SELECT folio, fechaActualizacion
+        FROM cotizaciones
+        WHERE idCotizacion = %s
+    """, (id_cotizacion,))
+    return cursor.fetchone()
+
+
+def _render_cotizacion_html(cursor, id_cotizacion, dias_validez):
+    """Consulta encabezado + items y devuelve (cot, html). None si no existe."""
+    cursor.execute("""
+        SELECT 
+            c.*,
+            u.nombre       AS asesor_nombre,
+            u.apellidop    AS asesor_apellidop,
+            u.apellidom    AS asesor_apellidom,
+            u.telefono     AS asesor_telefono,
+            u.email        AS asesor_email,
+            cl.tipoCliente,
+            cl.nombre      AS cli_nombre,
+            cl.apellidoP   AS cli_apellidoP,
+            cl.apellidoM   AS cli_apellidoM,
+            cl.rfc         AS cli_rfc,
+            cl.telefono    AS cli_telefono,
+            cl.email       AS cli_email,
+            cl.direccion   AS cli_direccion
+        FROM cotizaciones c
+        JOIN usuarios  u  ON u.idUsuario  = c.idUsuario
+        JOIN clientes  cl ON cl.idCliente = c.idCliente
+        WHERE c.idCotizacion = %s
+    """, (id_cotizacion,))
+    cot = cursor.fetchone()
+    if not cot:
+        return None
+
+    cursor.execute("""
+        SELECT nombre, marca, modelo, precioUnitario, cantidad
+        FROM cotizacion_items
+        WHERE idCotizacion = %s
+    """, (id_cotizacion,))
+    items = cursor.fetchall()
+
+    # Fechas
+    fecha_dt = cot['fecha'] if isinstance(cot['fecha'], datetime) else datetime.fromisoformat(str(cot['fecha']))
+    valido_hasta_dt = fecha_dt + timedelta(days=dias_validez)
+
+    # Nombres
+    asesor_nombre_completo = " ".join([x for x in [
+        cot.get('asesor_nombre'), cot.get('asesor_apellidop'), cot.get('asesor_apellidom')
+    ] if x])
+
+    if cot['tipoCliente'] == 'Persona':
+        cliente_nombre = " ".join([x for x in [
+            cot.get('cli_nombre'), cot.get('cli_apellidoP'), cot.get('cli_apellidoM')
+        ] if x])
+    else:
+        cliente_nombre = cot.get('cli_nombre')
+
+    def money(v):
+        try: return f"{float(v):,.2f}"
+        except Exception: return str(v)
+
+    # OJO: usa los nombres REALES de tus columnas
+    html = render_template(
+        "cotizaciones/cotizacion_formato.html",
+        titulo=f"COTIZACIÓN {cot['folio']}",
+        fecha=fecha_dt.strftime("%d/%m/%Y"),
+        folio=cot['folio'],
+        valido_hasta=valido_hasta_dt.strftime("%d/%m/%Y"),
+
+        # Asesor
+        asesor_nombre=asesor_nombre_completo,
+        asesor_telefono=cot.get('asesor_telefono'),
+        asesor_email=cot.get('asesor_email'),
+
+        # Cliente
+        cliente_nombre=cliente_nombre,
+        cliente_rfc=cot.get('cli_rfc'),
+        cliente_direccion=cot.get('cli_direccion'),
+        cliente_telefono=cot.get('cli_telefono'),
+        cliente_email=cot.get('cli_email'),
+
+        # Items / totales (nombres corregidos)
+        items=items,
+        subtotal=cot['subtotal'],
+        descuento_porcentaje=cot['descuentoPorcentaje'],
+        descuento_monto=cot['descuentoImporte'],        # <-- antes: descuentoMonto
+        iva_aplica=bool(cot['ivaHabilitado']),          # <-- antes: ivaAplica
+        iva_porcentaje=cot['ivaPorcentaje'],
+        iva_monto=cot['ivaImporte'],                    # <-- antes: ivaMonto
+        total=cot['total'],
+        money=money
+    )
+    return cot, html
+
+
+def _generar_pdf_cotizacion(cursor, id_cotizacion, dias_validez, version=None):
+    """
+    Devuelve (folio, ruta_o_bytes) usando la caché versionada por
+    idCotizacion + fechaActualizacion + dias. None si no existe la cotización.
+    """
+    if version is None:
+        version = _version_cotizacion(cursor, id_cotizacion)
+        if not version:
+            return None
+
+    ruta = obtener_pdf_cache(id_cotizacion, version['fechaActualizacion'], dias_validez)
+    if ruta:
+        return version['folio'], ruta
+
+    resultado = _render_cotizacion_html(cursor, id_cotizacion, dias_validez)
+    if not resultado:
+        return None
+    cot, html = resultado
+
+    pdf = html_a_pdf(html)
+
+    # Se guarda con la versión leída ANTES de renderizar: si hubo un cambio
+    # concurrente, la siguiente descarga verá otra fechaActualizacion.
+    guardar_pdf_cache(id_cotizacion, version['fechaActualizacion'], dias_validez, pdf)
+    return cot['folio'], pdf
+
+
+def _precalentar_pdf_cotizacion(id_cotizacion, dias_validez=7):
+    """Renderiza en segundo plano el PDF de una cotización recién enviada"""
+    app = current_app._get_current_object()
+
+    def tarea():
+        with app.app_context():
+            conn = get_connection()
+            try:
+                with conn.cursor(dictionary=True) as cursor:
+                    _generar_pdf_cotizacion(cursor, id_cotizacion, dias_validez)
+            except Exception as e:
+                print("Error al precalentar PDF de cotización:", e)
+            finally:
+                conn.close()
+
+    threading.Thread(target=tarea, daemon=True).start()
 
 
 @cotizaciones_bp.route('/cotizaciones/<int:id_cotizacion>/pdf', methods=['GET'])
 @session_validator(tabla="cotizaciones", accion="read")
 def exportar_cotizacion_pdf(id_cotizacion):
-    dias_validez = int(request.args.get('dias', 7))
+    try:
+        dias_validez = _dias_validez(request.args.get('dias', 7))
+    except (TypeError, ValueError):
+        return jsonify({'error': f'dias debe ser un entero entre 1 y {COTIZACION_DIAS_MAX}'}), 400
 
     conn = get_connection()
     try:
         with conn.cursor(dictionary=True) as cursor:
-            cursor.execute("""
-                SELECT 
-                    c.*,
-                    u.nombre       AS asesor_nombre,
-                    u.apellidop    AS asesor_apellidop,
-                    u.apellidom    AS asesor_apellidom,
-                    u.telefono     AS asesor_telefono,
-                    u.email        AS asesor_email,
-                    cl.tipoCliente,
-                    cl.nombre      AS cli_nombre,
-                    cl.apellidoP   AS cli_apellidoP,
-                    cl.apellidoM   AS cli_apellidoM,
-                    cl.rfc         AS cli_rfc,
-                    cl.telefono    AS cli_telefono,
-                    cl.email       AS cli_email,
-                    cl.direccion   AS cli_direccion
-                FROM cotizaciones c
-                JOIN usuarios  u  ON u.idUsuario  = c.idUsuario
-                JOIN clientes  cl ON cl.idCliente = c.idCliente
-                WHERE c.idCotizacion = %s
-            """, (id_cotizacion,))
-            cot = cursor.fetchone()
-            if not cot:
+            version = _version_cotizacion(cursor, id_cotizacion)
+            if not version:
                 return jsonify({'error': 'Cotización no encontrada'}), 404
 
-            cursor.execute("""
-                SELECT nombre, marca, modelo, precioUnitario, cantidad
-                FROM cotizacion_items
-                WHERE idCotizacion = %s
-            """, (id_cotizacion,))
-            items = cursor.fetchall()
-
-        # Fechas
-        fecha_dt = cot['fecha'] if isinstance(cot['fecha'], datetime) else datetime.fromisoformat(str(cot['fecha']))
-        valido_hasta_dt = fecha_dt + timedelta(days=dias_validez)
-
-        # Nombres
-        asesor_nombre_completo = " ".join([x for x in [
-            cot.get('asesor_nombre'), cot.get('asesor_apellidop'), cot.get('asesor_apellidom')
-        ] if x])
-
-        if cot['tipoCliente'] == 'Persona':
-            cliente_nombre = " ".join([x for x in [
-                cot.get('cli_nombre'), cot.get('cli_apellidoP'), cot.get('cli_apellidoM')
-            ] if x])
-        else:
-            cliente_nombre = cot.get('cli_nombre')
-
-        def money(v):
-            try: return f"{float(v):,.2f}"
-            except Exception: return str(v)
-
-        # OJO: usa los nombres REALES de tus columnas
-        html = render_template(
-            "cotizaciones/cotizacion_formato.html",
-            titulo=f"COTIZACIÓN {cot['folio']}",
-            fecha=fecha_dt.strftime("%d/%m/%Y"),
-            folio=cot['folio'],
-            valido_hasta=valido_hasta_dt.strftime("%d/%m/%Y"),
-
-            # Asesor
-            asesor_nombre=asesor_nombre_completo,
-            asesor_telefono=cot.get('asesor_telefono'),
-            asesor_email=cot.get('asesor_email'),
-
-            # Cliente
-            cliente_nombre=cliente_nombre,
-            cliente_rfc=cot.get('cli_rfc'),
-            cliente_direccion=cot.get('cli_direccion'),
-            cliente_telefono=cot.get('cli_telefono'),
-            cliente_email=cot.get('cli_email'),
-
-            # Items / totales (nombres corregidos)
-            items=items,
-            subtotal=cot['subtotal'],
-            descuento_porcentaje=cot['descuentoPorcentaje'],
-            descuento_monto=cot['descuentoImporte'],        # <-- antes: descuentoMonto
-            iva_aplica=bool(cot['ivaHabilitado']),          # <-- antes: ivaAplica
-            iva_porcentaje=cot['ivaPorcentaje'],
-            iva_monto=cot['ivaImporte'],                    # <-- antes: ivaMonto
-            total=cot['total'],
-            money=money
-        )
+            nombre_descarga = f"cotizacion_{version['folio']}.pdf"
+            ruta = obtener_pdf_cache(id_cotizacion, version['fechaActualizacion'], dias_validez)
+            if ruta:
+                return send_file(ruta, as_attachment=True, download_name=nombre_descarga,
+                                 mimetype='application/pdf')
 
-        config = pdfkit.configuration(wkhtmltopdf='/usr/local/bin/wkhtmltopdf')
-        pdf = pdfkit.from_string(html, False, configuration=config)
+            resultado = _render_cotizacion_html(cursor, id_cotizacion, dias_validez)
+            if not resultado:
+                return jsonify({'error': 'Cotización no encontrada'}), 404
 
-        return send_file(
-            io.BytesIO(pdf),
-            as_attachment=True,
-            download_name=f"cotizacion_{cot['folio']}.pdf",
-            mimetype='application/pdf'
+        # Se transmite desde wkhtmltopdf y a la vez se deja en caché
+        _, html = resultado
+        return respuesta_pdf(
+            html,
+            nombre_descarga,
+            guardar_en=ruta_pdf_cache(id_cotizacion, version['fechaActualizacion'], dias_validez)
         )
     except Exception as e:
         print("Error al generar PDF de cotización:", e)
         return jsonify({'error': 'Error generando PDF'}), 500
     finally:
         conn.close()
+
+
+# ----------------------------
+# Exportación masiva (ZIP)
+# ----------------------------
+from flask import Response, stream_with_context
+from utils.salida_zip import SalidaZip
+
+PDF_BULK_MAX = int(os.getenv('PDF_BULK_MAX', 500))
+
+
+def _versiones_bulk(cursor, data):
+    """Resuelve [{id, folio, fechaActualizacion}] a partir de ids o de filtros"""
+    ids = data.get('ids')
+    if ids:
+        ids = [int(x) for x in ids][:PDF_BULK_MAX]
+        marcadores = ", ".join(["%s"] * len(ids))
+        cursor.execute(f"""
+            SELECT idCotizacion AS id, folio, fechaActualizacion
+            FROM cotizaciones
+            WHERE idCotizacion IN ({marcadores})
+            ORDER BY idCotizacion ASC
+        """, tuple(ids))
+        return cursor.fetchall()
+
+    where, params = _filtros_cotizaciones((data.get('search') or '').strip(), data.get('status', 'todos'))
+    if data.get('desde'):
+        where.append("ct.fecha >= %s")
+        params.append(data['desde'])
+    if data.get('hasta'):
+        where.append("ct.fecha < DATE_ADD(%s, INTERVAL 1 DAY)")
+        params.append(data['hasta'])
+
+    cursor.execute(f"""
+        SELECT ct.idCotizacion AS id, ct.folio, ct.fechaActualizacion
+        FROM cotizaciones ct
+        JOIN clientes c ON c.idCliente = ct.idCliente
+        WHERE {' AND '.join(where)}
+        ORDER BY ct.fecha DESC
+        LIMIT %s
+    """, (*params, PDF_BULK_MAX))
+    return cursor.fetchall()
+
+
+def _zip_cotizaciones(versiones, dias_validez):
+    """
+    Generador del ZIP: usa la caché cuando existe y manda el resto al pool de
+    procesos, con a lo sumo PDF_MAX_WORKERS renders en vuelo por petición.
+    """
+    inicio = time.monotonic()
+    salida = SalidaZip()
+    pool = obtener_pool()
+    pendientes = {}  # future -> version
+    errores = []
+    archivos = 0
+    paginas = 0
+    cola = iter(versiones)
+    agotada = False
+
+    conn = get_connection()
+    try:
+        with conn.cursor(dictionary=True) as cursor:
+            zf = zipfile.ZipFile(salida, 'w', zipfile.ZIP_STORED)
+
+            while pendientes or not agotada:
+                # Llenar hasta el tope de concurrencia
+                while not agotada and len(pendientes) < PDF_MAX_WORKERS:
+                    version = next(cola, None)
+                    if version is None:
+                        agotada = True
+                        break
+
+                    ruta = obtener_pdf_cache(version['id'], version['fechaActualizacion'], dias_validez)
+                    if ruta:
+                        with open(ruta, 'rb') as f:
+                            pdf = f.read()
+                        zf.writestr(f"cotizacion_{version['folio']}.pdf", pdf)
+                        archivos += 1
+                        paginas += contar_paginas(pdf)
+                        yield salida.vaciar()
+                        continue
+
+                    resultado = _render_cotizacion_html(cursor, version['id'], dias_validez)
+                    if not resultado:
+                        errores.append({'id': version['id'], 'error': 'Cotización no encontrada'})
+                        continue
+                    pendientes[pool.submit(html_a_pdf, resultado[1])] = version
+
+                if not pendientes:
+                    continue
+
+                listos, _ = wait(pendientes, return_when=FIRST_COMPLETED)
+                for futuro in listos:
+                    version = pendientes.pop(futuro)
+                    try:
+                        pdf = futuro.result()
+                    except Exception as e:
+                        print(f"Error al generar PDF de cotización {version['id']}:", e)
+                        errores.append({'id': version['id'], 'error': 'Error generando PDF'})
+                        continue
+
+                    guardar_pdf_cache(version['id'], version['fechaActualizacion'], dias_validez, pdf)
+                    zf.writestr(f"cotizacion_{version['folio']}.pdf", pdf)
+                    archivos += 1
+                    paginas += contar_paginas(pdf)
+                yield salida.vaciar()
+
+            segundos = time.monotonic() - inicio
+            resumen = {
+                'archivos': archivos,
+                'paginas': paginas,
+                'segundos': round(segundos, 3),
+                'paginas_por_segundo': round(paginas / segundos, 2) if segundos > 0 else None,
+                'errores': errores
+            }
+            print(f"Exportación masiva de cotizaciones: {archivos} PDF(s), {paginas} página(s), "
+                  f"{resumen['paginas_por_segundo']} pág/s")
+            zf.writestr('resumen.json', json.dumps(resumen, ensure_ascii=False, indent=2))
+            zf.close()
+            yield salida.vaciar()
+    finally:
+        # Si el cliente se desconecta no tiene caso seguir renderizando
+        for futuro in pendientes:
+            futuro.cancel()
+        conn.close()
+
+
+@cotizaciones_bp.route('/cotizaciones/pdf/bulk', methods=['POST'])
+@session_validator(tabla="cotizaciones", accion="read")
+def exportar_cotizaciones_pdf_bulk():
+    """
+    Descarga varias cotizaciones en un ZIP generado al vuelo.
+    Body esperado:
+    {
+      "ids": [1, 2, 3]                      (opcional; si no, se usan los filtros)
+      "search": "...", "status": "enviada", (mismos filtros que el listado)
+      "desde": "2025-01-01", "hasta": "2025-01-31",
+      "dias": 7
+    }
+    El ZIP incluye resumen.json con páginas por segundo y errores por cotización.
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        dias_validez = _dias_validez(data.get('dias', 7))
+        if data.get('ids') is not None and not isinstance(data['ids'], list):
+            raise ValueError
+    except (TypeError, ValueError):
+        return jsonify({"error": "Parámetros inválidos"}), 400
+
+    conn = get_connection()
+    try:
+        with conn.cursor(dictionary=True) as cursor:
+            versiones = _versiones_bulk(cursor, data)
+    except (TypeError, ValueError):
+        return jsonify({"error": "ids debe ser una lista de enteros"}), 400
+    except Exception as e:
+        print("Error al preparar exportación masiva:", e)
+        return jsonify({"error": "Error al preparar exportación"}), 500
+    finally:
+        conn.close()
+
+    if not versiones:
+        return jsonify({"error": "No hay cotizaciones para exportar"}), 404
+
+    nombre_zip = f"cotizaciones_{datetime.now().strftime('%Y%m%d_%H%M')}.zip"
+    return Response(
+        stream_with_context(_zip_cotizaciones(versiones, dias_validez)),
+        mimetype='application/zip',
+        headers={'Content-Disposition': f'attachment; filename="{nombre_zip}"'}
+    )
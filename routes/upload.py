@@ -1,8 +1,8 @@
 from flask import Blueprint, request, jsonify, g
-from werkzeug.utils import secure_filename
-import os
 
 from utils.uploader import subir_archivo
+from utils.columnas_archivo import columna_archivo
+from utils.imagenes import ImagenRechazada
 
 upload_bp = Blueprint('upload', __name__)
 
@@ -16,6 +16,15 @@ def upload_imagen():
     if not all([tabla, id_registro, campo, archivo]):
         return jsonify({'error': 'Faltan datos para realizar la subida'}), 400
 
+    # Sólo columnas de archivo registradas (utils/columnas_archivo)
+    if columna_archivo(tabla, campo) is None:
+        return jsonify({'error': f'No se permiten archivos en {tabla}.{campo}'}), 400
+
+    try:
+        id_registro = int(id_registro)
+    except ValueError:
+        return jsonify({'error': 'id_registro inválido'}), 400
+
     try:
         id_usuario_actor = getattr(g, 'user_id', None)
         ruta_guardada = subir_archivo(
@@ -23,7 +32,6 @@ def upload_imagen():
             id_registro=id_registro,
             archivo=archivo,
             campo=campo,
-            carpeta=tabla,
             user_id_actor=id_usuario_actor
         )
 
@@ -32,6 +40,10 @@ def upload_imagen():
             'ruta': ruta_guardada
         }), 200
 
+    except LookupError:
+        return jsonify({'error': 'Registro no encontrado'}), 404
+    except ImagenRechazada:
+        return jsonify({'error': 'Imagen demasiado grande'}), 400
     except Exception as e:
         print("❌ Error al subir archivo:", e)
         return jsonify({'error': 'Error interno al subir archivo'}), 500
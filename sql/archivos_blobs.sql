@@ -0,0 +1,27 @@
+-- Almacén de archivos por contenido (utils/blob_store.py).
+-- archivos_blobs: un renglón por archivo físico en uploads/blobs/, con el
+-- número de registros que lo usan. archivos_referencias: qué registro
+-- (tabla, idRegistro, campo) apunta a qué blob.
+-- Las columnas foto existentes con nombres <id>_<archivo> siguen sirviéndose
+-- desde uploads/<carpeta>/ y no necesitan migrarse.
+
+CREATE TABLE IF NOT EXISTS archivos_blobs (
+    nombre        VARCHAR(80)  NOT NULL,
+    hash          CHAR(64)     NOT NULL,
+    tamanoBytes   BIGINT       NOT NULL DEFAULT 0,
+    referencias   INT          NOT NULL DEFAULT 0,
+    fechaCreacion DATETIME     NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (nombre),
+    KEY idx_archivos_blobs_hash (hash),
+    KEY idx_archivos_blobs_referencias (referencias)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE IF NOT EXISTS archivos_referencias (
+    tabla         VARCHAR(64)  NOT NULL,
+    idRegistro    INT          NOT NULL,
+    campo         VARCHAR(64)  NOT NULL,
+    nombreBlob    VARCHAR(80)  NOT NULL,
+    fechaCreacion DATETIME     NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (tabla, idRegistro, campo),
+    KEY idx_archivos_referencias_blob (nombreBlob)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
@@ -0,0 +1,49 @@
+-- Sesiones buscadas por hash del token (utils/sesiones.py).
+-- token_hash: SHA-256 del JWT (32 bytes) con índice único; cada request
+-- autenticado busca su sesión por esta columna en lugar de token_sesion.
+-- fechaExpira: 'exp' del JWT; el barrido cierra las sesiones vencidas y el
+-- índice (fechaLogout, fechaExpira) le permite encontrarlas sin recorrer la tabla.
+--
+-- Aplicar antes de desplegar el código que escribe estas columnas.
+
+ALTER TABLE historico_sesiones
+    ADD COLUMN token_hash  BINARY(32) NULL,
+    ADD COLUMN fechaExpira DATETIME   NULL;
+
+-- Sesiones existentes (las cerradas también, para que el archivo quede completo)
+UPDATE historico_sesiones
+SET token_hash = UNHEX(SHA2(token_sesion, 256))
+WHERE token_hash IS NULL AND token_sesion IS NOT NULL;
+
+-- Antes del índice único, revisar tokens repetidos (p. ej. sesiones duplicadas):
+--   SELECT token_hash, COUNT(*) FROM historico_sesiones GROUP BY token_hash HAVING COUNT(*) > 1;
+ALTER TABLE historico_sesiones
+    ADD UNIQUE KEY uq_historico_sesiones_token_hash (token_hash),
+    ADD KEY idx_historico_sesiones_abiertas (fechaLogout, fechaExpira);
+
+-- La fechaExpira de las sesiones abiertas existentes la completa el barrido
+-- (python -m utils.sesiones) a partir del 'exp' de cada JWT.
+
+
+-- Archivo de sesiones cerradas, particionado por mes de logout.
+-- Misma estructura que historico_sesiones (el barrido copia con SELECT *), sin
+-- el índice único: MySQL exige que la columna de partición esté en toda llave
+-- única. Si historico_sesiones tiene otras llaves únicas, quitarlas también
+-- (ver SHOW CREATE TABLE historico_sesiones_archivo).
+CREATE TABLE IF NOT EXISTS historico_sesiones_archivo LIKE historico_sesiones;
+
+ALTER TABLE historico_sesiones_archivo
+    DROP INDEX uq_historico_sesiones_token_hash,
+    ADD KEY idx_historico_sesiones_archivo_token_hash (token_hash),
+    MODIFY fechaLogout DATETIME NOT NULL,
+    DROP PRIMARY KEY,
+    ADD PRIMARY KEY (idSesion, fechaLogout);
+
+-- p_anterior recibe todo lo previo a la migración; el barrido parte p_futuro
+-- en particiones mensuales pAAAAMM por adelantado y, con
+-- SESIONES_RETENCION_MESES > 0, elimina las más viejas con DROP PARTITION.
+ALTER TABLE historico_sesiones_archivo
+    PARTITION BY RANGE COLUMNS (fechaLogout) (
+        PARTITION p_anterior VALUES LESS THAN ('2026-11-01'),
+        PARTITION p_futuro VALUES LESS THAN (MAXVALUE)
+    );
@@ -0,0 +1,7 @@
+-- Necesario para el upsert de la importación masiva de productos
+-- (INSERT ... ON DUPLICATE KEY UPDATE por NoSerie).
+-- Antes de aplicarlo, revisar duplicados:
+--   SELECT NoSerie, COUNT(*) FROM productos GROUP BY NoSerie HAVING COUNT(*) > 1;
+
+ALTER TABLE productos
+    ADD UNIQUE KEY uq_productos_noserie (NoSerie);
@@ -4,6 +4,7 @@ from flask import request, jsonify, g, Blueprint
 from db_config import get_connection
 from utils.session_validator import session_validator
 from utils.auditoria import registrar_auditoria
+from utils.cache_permisos import invalidar_permisos_rol
 
 asign_bp = Blueprint('asignar', __name__)
 
@@ -45,6 +46,8 @@ def asignar_permiso():
                 operacion
             ))
             conexion.commit()
+            if tipo_destino == 'rol':
+                invalidar_permisos_rol(id_destino)
 
             # Determinar valores anteriores y nuevos
             valores_anteriores = ""
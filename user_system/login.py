@@ -1,54 +1,21 @@
-from flask import Blueprint, request, jsonify
-import bcrypt
+from flask import Blueprint, Response, request, jsonify
 import jwt
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from db_config import get_connection
 from utils.token_validator import SECRET_KEY
+from utils.session_validator import session_validator
+from utils.contrasenas import verificar_contrasena, PoolContrasenasSaturado, metricas as metricas_contrasenas
+from utils.cache_permisos import (
+    SQL_PERMISOS_DIRECTOS, SQL_VERSION_ROL, permisos_usuario, version_permisos, payload_en_cache, guardar_payload
+)
+from utils.sesiones import SQL_SESION_ACTIVA, hash_token, registrar_sesion
+from utils.limitador_login import (
+    verificar_intento, registrar_fallo, registrar_exito, liberar_intento, metricas as metricas_limitador
+)
 
 auth_bp = Blueprint('auth', __name__)
 
 
-def obtener_permisos_usuario(id_usuario):
-    """Obtiene todos los permisos del usuario (directos y heredados) en formato agrupado"""
-    conn = get_connection()
-    try:
-        with conn.cursor(dictionary=True) as cursor:
-            cursor.execute("""
-                SELECT p.tabla, p.accion
-                FROM (
-                    -- Permisos heredados del rol
-                    SELECT p.tabla, p.accion
-                    FROM usuarios u
-                    JOIN rol_permisos rp ON u.idRol = rp.idRol
-                    JOIN permisos p ON rp.idPermiso = p.idPermiso
-                    WHERE u.idUsuario = %s
-
-                    UNION ALL
-
-                    -- Permisos directos
-                    SELECT p.tabla, p.accion
-                    FROM usuario_permisos up
-                    JOIN permisos p ON up.idPermiso = p.idPermiso
-                    WHERE up.idUsuario = %s
-                ) AS p
-            """, (id_usuario, id_usuario))
-
-            # Convertir a formato agrupado que necesita el frontend
-            permisos = {}
-            for row in cursor.fetchall():
-                tabla = row['tabla']
-                accion = row['accion']
-
-                if tabla not in permisos:
-                    permisos[tabla] = {}
-
-                permisos[tabla][accion] = 1
-
-            # Convertir a lista de objetos
-            return [{"tabla": tabla, **acciones} for tabla, acciones in permisos.items()]
-    finally:
-        conn.close()
-
 #login
 @auth_bp.route('/login', methods=['POST'])
 def login():
@@ -58,72 +25,115 @@ def login():
     direccion_ip = request.remote_addr
     user_agent = request.headers.get('User-Agent')
 
-    conn = get_connection()
-    cursor = conn.cursor(dictionary=True)
+    # Límite por IP y por email antes de cualquier consulta o bcrypt
+    espera = verificar_intento(direccion_ip, email)
+    if espera:
+        respuesta = jsonify({"error": "Demasiados intentos de inicio de sesión, intente más tarde"})
+        respuesta.headers['Retry-After'] = str(espera)
+        return respuesta, 429
 
-    cursor.execute("""
-        SELECT u.idUsuario, u.nombreUsuario, u.email, u.idRol, r.nombreRol,
-               u.password_hash, u.estatus, u.foto, u.is_superadmin
-        FROM usuarios u
-        JOIN roles r ON u.idRol = r.idRol
-        WHERE u.email = %s
-    """, (email,))
-    user = cursor.fetchone()
+    # Usuario + permisos directos en una consulta; la conexión se cierra antes
+    # de bcrypt para no retenerla 100-250 ms por login
+    conn = get_connection()
+    try:
+        with conn.cursor(dictionary=True) as cursor:
+            cursor.execute(f"""
+                SELECT u.idUsuario, u.nombreUsuario, u.email, u.idRol, r.nombreRol,
+                       u.password_hash, u.estatus, u.foto, u.is_superadmin,
+                       {SQL_PERMISOS_DIRECTOS}, {SQL_VERSION_ROL}
+                FROM usuarios u
+                JOIN roles r ON u.idRol = r.idRol
+                WHERE u.email = %s
+            """, (email,))
+            user = cursor.fetchone()
+    finally:
+        conn.close()
 
     if not user:
-        cursor.close()
-        conn.close()
+        registrar_fallo(email)
         return jsonify({"error": "Usuario no encontrado"}), 404
 
     if user['estatus'] != 'Activo':
-        cursor.close()
-        conn.close()
+        registrar_fallo(email)
         return jsonify({"error": "El usuario está inactivo"}), 403
 
-    if bcrypt.checkpw(password.encode('utf-8'), user['password_hash'].encode('utf-8')):
-        payload = {
-            'idUsuario': user['idUsuario'],
-            'exp': datetime.utcnow() + timedelta(hours=2),
-            'iat': datetime.utcnow()
-        }
-        token = jwt.encode(payload, SECRET_KEY, algorithm='HS256')
-
-        cursor.execute("""
-            INSERT INTO historico_sesiones (idUsuario, direccion_ip, user_agent, token_sesion)
-            VALUES (%s, %s, %s, %s)
-        """, (user['idUsuario'], direccion_ip, user_agent, token))
-        conn.commit()
-
-        # CORRECCIÓN: Usar el mismo formato que en /usuarios
-        foto_url = (
-            f"/archivo/usuarios/{user['idUsuario']}/foto"
-            if user['foto'] else None
-        )
-
-        # Obtener permisos del usuario
-        permisos = obtener_permisos_usuario(user['idUsuario'])
-
-        cursor.close()
+    # bcrypt corre en su pool (100-250 ms de CPU)
+    try:
+        correcta, hash_nuevo = verificar_contrasena(password, user['password_hash'])
+    except PoolContrasenasSaturado:
+        liberar_intento(email)
+        respuesta = jsonify({"error": "Servicio ocupado, intente de nuevo en unos segundos"})
+        respuesta.headers['Retry-After'] = '1'
+        return respuesta, 503
+
+    if not correcta:
+        registrar_fallo(email)
+        return jsonify({"error": "Contraseña incorrecta"}), 401
+
+    registrar_exito(email)
+    ahora = datetime.now(timezone.utc)
+    expira = ahora + timedelta(hours=2)
+    payload = {
+        'idUsuario': user['idUsuario'],
+        'exp': expira,
+        'iat': ahora
+    }
+    token = jwt.encode(payload, SECRET_KEY, algorithm='HS256')
+
+    # Conexión nueva para el INSERT de la sesión, el rehash y los permisos del rol
+    conn = get_connection()
+    try:
+        with conn.cursor(dictionary=True) as cursor:
+            # token_hash + fechaExpira: búsqueda por índice y cierre automático al vencer
+            registrar_sesion(cursor, user['idUsuario'], direccion_ip, user_agent,
+                             token, int(expira.timestamp()))
+
+            # Hash con otro costo que BCRYPT_ROUNDS: se reemplaza (si nadie lo cambió mientras tanto)
+            if hash_nuevo:
+                cursor.execute("""
+                    UPDATE usuarios SET password_hash = %s
+                    WHERE idUsuario = %s AND password_hash = %s
+                """, (hash_nuevo, user['idUsuario'], user['password_hash']))
+            conn.commit()
+
+            # Permisos del rol (caché) + directos (ya vienen en el renglón)
+            permisos = permisos_usuario(cursor, user)
+    finally:
         conn.close()
 
-        return jsonify({
-            "mensaje": "Login exitoso",
-            "token": token,
-            "usuario": {
-                "idUsuario": user['idUsuario'],
-                "nombreUsuario": user['nombreUsuario'],
-                "email": user['email'],
-                "idRol": user['idRol'],
-                "nombreRol": user['nombreRol'],
-                "foto_url": foto_url,  # Formato consistente
-                "is_superadmin": bool(user['is_superadmin'])
-            },
-            "permisos": permisos
-        }), 200
+    # CORRECCIÓN: Usar el mismo formato que en /usuarios
+    foto_url = (
+        f"/archivo/usuarios/{user['idUsuario']}/foto"
+        if user['foto'] else None
+    )
+
+    return jsonify({
+        "mensaje": "Login exitoso",
+        "token": token,
+        "usuario": {
+            "idUsuario": user['idUsuario'],
+            "nombreUsuario": user['nombreUsuario'],
+            "email": user['email'],
+            "idRol": user['idRol'],
+            "nombreRol": user['nombreRol'],
+            "foto_url": foto_url,  # Formato consistente
+            "is_superadmin": bool(user['is_superadmin'])
+        },
+        "permisos": permisos
+    }), 200
 
-    cursor.close()
-    conn.close()
-    return jsonify({"error": "Contraseña incorrecta"}), 401
+
+# --------------------------
+# MÉTRICAS DE AUTENTICACIÓN
+# --------------------------
+@auth_bp.route('/auth/metricas', methods=['GET'])
+@session_validator(tabla="usuarios", accion="read")
+def metricas_auth():
+    """Contadores del pool de contraseñas y del limitador de intentos de login"""
+    return jsonify({
+        'contrasenas': metricas_contrasenas(),
+        'limitador_login': metricas_limitador()
+    }), 200
 
 # --------------------------
 # LOGOUT DE USUARIO
@@ -142,8 +152,8 @@ def logout():
     cursor.execute("""
         UPDATE historico_sesiones
         SET fechaLogout = NOW()
-        WHERE token_sesion = %s AND fechaLogout IS NULL
-    """, (token,))
+        WHERE token_hash = %s AND fechaLogout IS NULL
+    """, (hash_token(token),))
     conn.commit()
 
     updated = cursor.rowcount
@@ -157,6 +167,30 @@ def logout():
     return jsonify({"mensaje": "Logout exitoso"}), 200
 
 
+# --------------------------
+# RESPUESTAS VERSIONADAS
+# --------------------------
+def _respuesta_versionada(clave, version, armar):
+    """
+    JSON con ETag = version. Si el cliente manda esa versión en If-None-Match
+    se responde 304 sin cuerpo; si no, se usa el cuerpo en caché de 'clave' o
+    se arma con armar() y se guarda.
+    """
+    if request.if_none_match.contains_weak(version):
+        respuesta = Response(status=304)
+    else:
+        cuerpo = payload_en_cache(clave, version)
+        if cuerpo is None:
+            cuerpo = jsonify(armar()).get_data()
+            guardar_payload(clave, version, cuerpo)
+        respuesta = Response(cuerpo, mimetype='application/json')
+    respuesta.set_etag(version)
+    # El navegador puede guardarla, pero siempre revalida (sesión y permisos)
+    respuesta.cache_control.private = True
+    respuesta.cache_control.no_cache = True
+    return respuesta
+
+
 # --------------------------
 # VERIFICAR TOKEN
 # --------------------------
@@ -169,55 +203,53 @@ def verify_token():
     token = auth_header.split(" ")[1]
 
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
-        id_usuario = payload['idUsuario']
+        jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
     except jwt.ExpiredSignatureError:
         return jsonify({'error': 'Token expirado'}), 401
     except jwt.InvalidTokenError:
         return jsonify({'error': 'Token inválido'}), 401
 
     conn = get_connection()
-    cursor = conn.cursor(dictionary=True)
-
-    cursor.execute("""
-        SELECT u.idUsuario, u.nombreUsuario, u.email, u.idRol, r.nombreRol, u.foto, u.is_superadmin
-        FROM historico_sesiones hs
-        JOIN usuarios u ON hs.idUsuario = u.idUsuario
-        JOIN roles r ON u.idRol = r.idRol
-        WHERE hs.token_sesion = %s AND hs.fechaLogout IS NULL
-    """, (token,))
-
-    user = cursor.fetchone()
-
-    if user:
-        # Construir ruta relativa para la foto
-        foto_url = (
-            f"/archivo/usuarios/{user['idUsuario']}/foto"
-            if user['foto'] else None
-        )
-
-        # Obtener permisos actualizados
-        permisos = obtener_permisos_usuario(user['idUsuario'])
-
-        cursor.close()
-        conn.close()
-
-        return jsonify({
-            'usuario': {
-                'idUsuario': user['idUsuario'],
-                'nombreUsuario': user['nombreUsuario'],
-                'email': user['email'],
-                'idRol': user['idRol'],
-                'nombreRol': user['nombreRol'],
-                'foto_url': foto_url,  # Ruta relativa
-                'is_superadmin': bool(user['is_superadmin'])
-            },
-            'permisos': permisos
-        }), 200
-    else:
-        cursor.close()
+    try:
+        with conn.cursor(dictionary=True) as cursor:
+            # Sesión + usuario + permisos directos en una consulta; los del rol desde caché
+            cursor.execute(f"""
+                SELECT u.idUsuario, u.nombreUsuario, u.email, u.idRol, r.nombreRol, u.foto, u.is_superadmin,
+                       {SQL_PERMISOS_DIRECTOS}, {SQL_VERSION_ROL}
+                FROM historico_sesiones hs
+                JOIN usuarios u ON hs.idUsuario = u.idUsuario
+                JOIN roles r ON u.idRol = r.idRol
+                WHERE {SQL_SESION_ACTIVA}
+            """, (hash_token(token),))
+            user = cursor.fetchone()
+
+            if not user:
+                return jsonify({'error': 'Token inválido o sesión cerrada'}), 401
+
+            # Construir ruta relativa para la foto
+            foto_url = (
+                f"/archivo/usuarios/{user['idUsuario']}/foto"
+                if user['foto'] else None
+            )
+
+            # La versión cubre también los datos del usuario que van en la respuesta
+            version = version_permisos(
+                user, user['nombreUsuario'], user['email'], user['nombreRol'], foto_url)
+
+            return _respuesta_versionada(('verify', user['idUsuario']), version, lambda: {
+                'usuario': {
+                    'idUsuario': user['idUsuario'],
+                    'nombreUsuario': user['nombreUsuario'],
+                    'email': user['email'],
+                    'idRol': user['idRol'],
+                    'nombreRol': user['nombreRol'],
+                    'foto_url': foto_url,  # Ruta relativa
+                    'is_superadmin': bool(user['is_superadmin'])
+                },
+                'permisos': permisos_usuario(cursor, user)
+            })
+    finally:
         conn.close()
-        return jsonify({'error': 'Token inválido o sesión cerrada'}), 401
 
     # --------------------------
     # OBTENER PERMISOS ACTUALIZADOS
@@ -231,45 +263,31 @@ def get_permissions():
         token = auth_header.split(" ")[1]
 
         try:
-            payload = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
-            id_usuario = payload['idUsuario']
+            jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
         except jwt.ExpiredSignatureError:
             return jsonify({'error': 'Token expirado'}), 401
         except jwt.InvalidTokenError:
             return jsonify({'error': 'Token inválido'}), 401
 
         conn = get_connection()
-        cursor = conn.cursor(dictionary=True)
-
-        # Verificar que el token está activo
-        cursor.execute("""
-            SELECT idSesion 
-            FROM historico_sesiones 
-            WHERE token_sesion = %s AND fechaLogout IS NULL
-        """, (token,))
-        session = cursor.fetchone()
-
-        if not session:
-            cursor.close()
+        try:
+            with conn.cursor(dictionary=True) as cursor:
+                # Sesión activa + rol, superadmin y permisos directos en una consulta
+                cursor.execute(f"""
+                    SELECT u.idUsuario, u.idRol, u.is_superadmin, {SQL_PERMISOS_DIRECTOS}, {SQL_VERSION_ROL}
+                    FROM historico_sesiones hs
+                    JOIN usuarios u ON hs.idUsuario = u.idUsuario
+                    WHERE {SQL_SESION_ACTIVA}
+                """, (hash_token(token),))
+                user = cursor.fetchone()
+
+                if not user:
+                    return jsonify({'error': 'Token inválido o sesión cerrada'}), 401
+
+                version = version_permisos(user)
+                return _respuesta_versionada(('permissions', user['idUsuario']), version, lambda: {
+                    'permisos': permisos_usuario(cursor, user),
+                    'is_superadmin': bool(user['is_superadmin'])
+                })
+        finally:
             conn.close()
-            return jsonify({'error': 'Token inválido o sesión cerrada'}), 401
-
-        # Obtener permisos actualizados
-        permisos = obtener_permisos_usuario(id_usuario)
-
-        # Obtener estado de superadmin
-        cursor.execute("""
-            SELECT is_superadmin 
-            FROM usuarios 
-            WHERE idUsuario = %s
-        """, (id_usuario,))
-        user = cursor.fetchone()
-        is_superadmin = user['is_superadmin'] if user else False
-
-        cursor.close()
-        conn.close()
-
-        return jsonify({
-            'permisos': permisos,
-            'is_superadmin': bool(is_superadmin)
-        }), 200
\ No newline at end of file
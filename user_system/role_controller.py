@@ -4,9 +4,10 @@ from flask import request, jsonify, g, Blueprint, send_file  # Añadido send_fil
 from db_config import get_connection
 from utils.session_validator import session_validator
 from utils.auditoria import registrar_auditoria
+from utils.cache_permisos import invalidar_permisos_rol
 # importaciones para la descarga de pdf y excel
 
-import pdfkit
+from utils.pdf_render import respuesta_pdf
 from flask import render_template, request, send_file
 
 from openpyxl import Workbook
@@ -233,6 +234,7 @@ def eliminar_rol(id_rol):
             # Eliminar
             cursor.execute("DELETE FROM roles WHERE idRol = %s", (id_rol,))
             conn.commit()
+            invalidar_permisos_rol(id_rol)
 
             # Auditoría
             registrar_auditoria(
@@ -396,6 +398,8 @@ def gestionar_permisos():
                 data['operacion']
             ))
             conn.commit()
+            if data['tipoDestino'] == 'rol':
+                invalidar_permisos_rol(data['idDestino'])
 
             return jsonify({'mensaje': 'Permiso gestionado correctamente'}), 200
     except Exception as e:
@@ -489,15 +493,9 @@ def exportar_roles_pdf():
             titulo="Reporte de Roles"
         )
 
-        config = pdfkit.configuration(wkhtmltopdf='/usr/local/bin/wkhtmltopdf')
-
-        pdf = pdfkit.from_string(html, False, configuration=config)
-
-        return send_file(
-            io.BytesIO(pdf),
-            as_attachment=True,
-            download_name=f'reporte_roles_{datetime.now().strftime("%Y%m%d_%H%M")}.pdf',
-            mimetype='application/pdf'
+        return respuesta_pdf(
+            html,
+            f'reporte_roles_{datetime.now().strftime("%Y%m%d_%H%M")}.pdf'
         )
 
     except Exception as e:
@@ -1,16 +1,21 @@
 # /user_system/user/registro_usuario.py
 
 from flask import jsonify, g, Blueprint
-import bcrypt
 import os
-from werkzeug.utils import secure_filename
 from db_config import get_connection
 from utils.session_validator import session_validator
 from utils.auditoria import registrar_auditoria
+from utils.pdf_render import respuesta_reporte
+from utils.entrega_archivos import enviar_archivo
+from utils.uploader import reemplazar_archivo, eliminar_archivo
+from utils.imagenes import resolver_variante, ImagenRechazada
+from utils.blob_store import ruta_en_disco, url_blob, es_blob, desvincular_blob, liberar_blob
+from utils.cache_archivos import archivo_registro, invalidar_referencia
+from utils.contrasenas import hashear_contrasena, PoolContrasenasSaturado
+from utils.cache_permisos import invalidar_permisos_rol
 
 # importaciones para la descarga de pdf y excel
 
-import pdfkit
 from flask import render_template, request, send_file
 
 from openpyxl import Workbook
@@ -45,60 +50,7 @@ def es_superusuario(id_usuario):
         conexion.close()
 
 
-# Funciones para manejar archivos
-def subir_archivo(tabla, id_registro, archivo, campo, carpeta, user_id_actor=None):
-    # Crear directorio si no existe
-    ruta_directorio = os.path.join('uploads', carpeta)
-    os.makedirs(ruta_directorio, exist_ok=True)
-
-    # Eliminar archivo anterior si existe
-    conn = get_connection()
-    try:
-        with conn.cursor() as cursor:
-            cursor.execute(f"SELECT {campo} FROM {tabla} WHERE id{tabla[:-1].capitalize()} = %s", (id_registro,))
-            archivo_anterior = cursor.fetchone()
-
-            if archivo_anterior and archivo_anterior[0]:
-                eliminar_archivo(archivo_anterior[0], carpeta)
-    finally:
-        conn.close()
-
-    # Subir nuevo archivo
-    nombre_seguro = secure_filename(archivo.filename)
-    nombre_archivo = f'{id_registro}_{nombre_seguro}'
-
-    ruta_completa = os.path.join(ruta_directorio, nombre_archivo)
-    archivo.save(ruta_completa)
-
-    # Actualizar base de datos
-    conn = get_connection()
-    try:
-        with conn.cursor() as cursor:
-            cursor.execute(f"""
-                UPDATE {tabla}
-                SET {campo} = %s
-                WHERE id{tabla[:-1].capitalize()} = %s
-            """, (nombre_archivo, id_registro))
-            conn.commit()
-    finally:
-        conn.close()
-
-    return nombre_archivo
-
-
-def eliminar_archivo(nombre_archivo, carpeta):
-    if not nombre_archivo:
-        return False
-
-    try:
-        ruta_archivo = os.path.join('uploads', carpeta, nombre_archivo)
-        if os.path.exists(ruta_archivo):
-            os.remove(ruta_archivo)
-            return True
-        return False
-    except Exception as e:
-        print(f"Error al eliminar archivo: {e}")
-        return False
+# Funciones para manejar archivos: ver utils/uploader.py
 
 
 # Endpoint para registrar usuario
@@ -115,10 +67,13 @@ def registrar_usuario():
     if not all(c in datos for c in campos_requeridos):
         return jsonify({'error': 'Faltan campos requeridos'}), 400
 
-    # 2) Hashear la contraseña
-    password_bytes = datos['password'].encode('utf-8')
-    salt = bcrypt.gensalt()
-    password_hash = bcrypt.hashpw(password_bytes, salt).decode('utf-8')
+    # 2) Hashear la contraseña (pool de bcrypt, fuera del worker HTTP)
+    try:
+        password_hash = hashear_contrasena(datos['password'])
+    except PoolContrasenasSaturado:
+        respuesta = jsonify({'error': 'Servicio ocupado, intente de nuevo en unos segundos'})
+        respuesta.headers['Retry-After'] = '1'
+        return respuesta, 503
 
     # Obtener teléfono si está presente (campo opcional)
     telefono = datos.get('telefono', None)  # Usar .get() para evitar KeyError
@@ -197,9 +152,12 @@ def actualizar_usuario(id_usuario):
     password = datos.get('password', None)
     password_hash = None
     if password:
-        password_bytes = password.encode('utf-8')
-        salt = bcrypt.gensalt()
-        password_hash = bcrypt.hashpw(password_bytes, salt).decode('utf-8')
+        try:
+            password_hash = hashear_contrasena(password)
+        except PoolContrasenasSaturado:
+            respuesta = jsonify({'error': 'Servicio ocupado, intente de nuevo en unos segundos'})
+            respuesta.headers['Retry-After'] = '1'
+            return respuesta, 503
 
     conexion = get_connection()
     try:
@@ -305,9 +263,19 @@ def eliminar_usuario(id_usuario):
             if not usuario:
                 return jsonify({'error': 'Usuario no encontrado'}), 404
 
+            # La referencia a la foto se quita en la misma transacción que el DELETE
+            blob_liberado = desvincular_blob(conexion, 'usuarios', id_usuario, 'foto')
+
             # Eliminar usuarios
             cursor.execute("DELETE FROM usuarios WHERE idUsuario = %s", (id_usuario,))
             conexion.commit()
+            invalidar_referencia('usuarios', id_usuario)
+
+            # Después del commit: el blob se borra si nadie más lo usa
+            if blob_liberado:
+                liberar_blob(blob_liberado)
+            elif usuario.get('foto') and not es_blob(usuario['foto']):
+                eliminar_archivo(usuario['foto'], 'usuarios', 'usuarios', id_usuario, 'foto')
 
             # Auditoría
             id_usuario_actor = getattr(g, 'user_id', None)
@@ -349,27 +317,18 @@ def subir_foto_usuario(id_usuario):
     if archivo.filename == '':
         return jsonify({'error': 'Nombre de archivo vacío'}), 400
 
-    conexion = get_connection()
     try:
-        with conexion.cursor(dictionary=True) as cursor:
-            # Obtener foto anterior
-            cursor.execute("SELECT foto FROM usuarios WHERE idUsuario = %s", (id_usuario,))
-            usuario = cursor.fetchone()
-
-            if not usuario:
-                return jsonify({'error': 'Usuario no encontrado'}), 404
-
-            foto_anterior = usuario.get('foto')
-
-        # Subir nuevo archivo
-        nombre_archivo = subir_archivo(
+        # Foto nueva + UPDATE en una sola transacción; la anterior se borra después del commit
+        resultado = reemplazar_archivo(
             tabla='usuarios',
             id_registro=id_usuario,
             archivo=archivo,
-            campo='foto',
-            carpeta='usuarios',
-            user_id_actor=g.user_id
+            campo='foto'
         )
+        if resultado is None:
+            return jsonify({'error': 'Usuario no encontrado'}), 404
+
+        nombre_archivo, foto_anterior = resultado
 
         # Registrar auditoría
         registrar_auditoria(
@@ -384,17 +343,17 @@ def subir_foto_usuario(id_usuario):
         return jsonify({
             'mensaje': 'Foto de perfil actualizada correctamente',
             'nombre_archivo': nombre_archivo,
-            'ruta': f"/archivo/usuarios/{id_usuario}/foto"
+            'ruta': f"/archivo/usuarios/{id_usuario}/foto",
+            # URL por contenido, cacheable indefinidamente
+            'ruta_inmutable': url_blob(nombre_archivo)
         }), 200
 
+    except ImagenRechazada:
+        return jsonify({'error': 'Imagen demasiado grande'}), 400
     except Exception as e:
-        conexion.rollback()
         print("Error al subir la foto de perfil:", e)
         return jsonify({'error': 'Error al subir la foto de perfil'}), 500
 
-    finally:
-        conexion.close()
-
 
 # Endpoint para eliminar foto de perfil
 @registro_bp.route('/usuarios/<int:id_usuario>/foto', methods=['DELETE'])
@@ -419,28 +378,32 @@ def eliminar_foto_usuario(id_usuario):
             if not foto_actual:
                 return jsonify({'mensaje': 'El usuario no tiene foto'}), 200
 
-            # Eliminar archivo físico
-            if eliminar_archivo(foto_actual, 'usuarios'):
-                # Actualizar base de datos
-                cursor.execute(
-                    "UPDATE usuarios SET foto = NULL WHERE idUsuario = %s",
-                    (id_usuario,)
-                )
-                conexion.commit()
-
-                # Auditoría
-                registrar_auditoria(
-                    g.user_id,
-                    'update',
-                    'usuarios',
-                    id_usuario,
-                    valores_anteriores={'foto': foto_actual},
-                    valores_nuevos={'foto': None}
-                )
-
-                return jsonify({'mensaje': 'Foto eliminada correctamente'}), 200
-            else:
-                return jsonify({'error': 'No se pudo eliminar el archivo'}), 500
+            # La referencia se quita en la misma transacción que el UPDATE
+            blob_liberado = desvincular_blob(conexion, 'usuarios', id_usuario, 'foto')
+            cursor.execute(
+                "UPDATE usuarios SET foto = NULL WHERE idUsuario = %s",
+                (id_usuario,)
+            )
+            conexion.commit()
+            invalidar_referencia('usuarios', id_usuario, 'foto')
+
+            # Después del commit: el blob se borra si nadie más lo usa
+            if blob_liberado:
+                liberar_blob(blob_liberado)
+            elif not es_blob(foto_actual):
+                eliminar_archivo(foto_actual, 'usuarios', 'usuarios', id_usuario, 'foto')
+
+            # Auditoría
+            registrar_auditoria(
+                g.user_id,
+                'update',
+                'usuarios',
+                id_usuario,
+                valores_anteriores={'foto': foto_actual},
+                valores_nuevos={'foto': None}
+            )
+
+            return jsonify({'mensaje': 'Foto eliminada correctamente'}), 200
 
     except Exception as e:
         conexion.rollback()
@@ -632,6 +595,8 @@ def ejecutar_procedimiento_permisos():
                 data['operacion']
             ])
             conexion.commit()
+            if data['tipoDestino'] == 'rol':
+                invalidar_permisos_rol(data['idDestino'])
 
             # Registrar auditoría
             registrar_auditoria(
@@ -656,29 +621,25 @@ def ejecutar_procedimiento_permisos():
 # Endpoint para servir fotos de perfil
 @archivos_bp.route('/archivo/usuarios/<int:id_usuario>/foto', methods=['GET'])
 def servir_foto_usuario(id_usuario):
-    conexion = get_connection()
     try:
-        with conexion.cursor(dictionary=True) as cursor:
-            cursor.execute("SELECT foto FROM usuarios WHERE idUsuario = %s", (id_usuario,))
-            usuario = cursor.fetchone()
-
-            if not usuario or not usuario['foto']:
-                # Puedes devolver una imagen por defecto aquí si lo prefieres
-                return jsonify({'error': 'Foto no encontrada'}), 404
+        # Nombre de la foto desde caché (sin conexión a la DB en el caso común)
+        existe, nombre_archivo, ruta_archivo, stat = archivo_registro(
+            'usuarios', id_usuario, 'foto', lambda nombre: ruta_en_disco('usuarios', nombre))
 
-            nombre_archivo = usuario['foto']
-            ruta_archivo = os.path.join('uploads', 'usuarios', nombre_archivo)
+        if not existe or not nombre_archivo:
+            # Puedes devolver una imagen por defecto aquí si lo prefieres
+            return jsonify({'error': 'Foto no encontrada'}), 404
 
-            if not os.path.exists(ruta_archivo):
-                return jsonify({'error': 'Archivo no encontrado'}), 404
+        if stat is None:
+            return jsonify({'error': 'Archivo no encontrado'}), 404
 
-            return send_file(ruta_archivo, mimetype='image/jpeg')
+        # ?size=thumb|medium|full
+        ruta_archivo = resolver_variante(ruta_archivo, request.args.get('size'))
+        return enviar_archivo(ruta_archivo)
 
     except Exception as e:
         print("Error al servir archivo:", e)
         return jsonify({"error": "Error al obtener foto"}), 500
-    finally:
-        conexion.close()
 
 '''
 # Descargar PDF
@@ -785,25 +746,16 @@ def exportar_usuarios_pdf():
 
         usuarios = obtener_usuarios_filtrados(search, status, sort)
 
-        html = render_template(
+        # Listados grandes se parten en bloques renderizados en paralelo
+        return respuesta_reporte(
             "usuarios_reporte.html",
-            usuarios=usuarios,
+            "usuarios",
+            usuarios,
+            f'reporte_usuarios_{datetime.now().strftime("%Y%m%d_%H%M")}.pdf',
             fecha=datetime.now().strftime("%d/%m/%Y %H:%M"),
             titulo="Reporte de Usuarios"
         )
 
-        # Ruta explícita de wkhtmltopdf (importante en macOS)
-        config = pdfkit.configuration(wkhtmltopdf='/usr/local/bin/wkhtmltopdf')
-
-        pdf = pdfkit.from_string(html, False, configuration=config)
-
-        return send_file(
-            io.BytesIO(pdf),
-            as_attachment=True,
-            download_name=f'reporte_usuarios_{datetime.now().strftime("%Y%m%d_%H%M")}.pdf',
-            mimetype='application/pdf'
-        )
-
     except Exception as e:
         import traceback
         print("Error al generar el PDF:", e)
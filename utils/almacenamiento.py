@@ -0,0 +1,161 @@
+# utils/almacenamiento.py
+# Dónde viven los archivos de uploads/: disco local o un bucket S3 compatible.
+#
+# El código de subida sigue escribiendo primero en uploads/ (Pillow y los
+# temporales necesitan un archivo local) y luego llama publicar(); los
+# lectores usan info() / abrir() / url_descarga(). Las rutas son las mismas en
+# ambos backends: 'uploads/blobs/ab/cd/<hash>.jpg' -> clave 'blobs/ab/cd/<hash>.jpg'.
+#
+# ALMACENAMIENTO:
+#   local -> todo en disco (valor por defecto, un solo nodo o disco compartido)
+#   s3    -> publicar() sube al bucket (multipart para archivos grandes) y borra
+#            la copia local; las descargas se redirigen a una URL firmada.
+#            Variables: S3_BUCKET, S3_PREFIJO, S3_ENDPOINT_URL, S3_REGION y las
+#            credenciales estándar de boto3 (AWS_ACCESS_KEY_ID, ...).
+#
+# Para probar contra MinIO local:
+#   docker run -p 9000:9000 minio/minio server /data
+#   ALMACENAMIENTO=s3 S3_ENDPOINT_URL=http://localhost:9000 S3_BUCKET=uploads \
+#   AWS_ACCESS_KEY_ID=minioadmin AWS_SECRET_ACCESS_KEY=minioadmin python main.py
+
+import os
+import mimetypes
+import threading
+from types import SimpleNamespace
+from urllib.parse import quote
+
+UPLOADS_ROOT = 'uploads'
+ALMACENAMIENTO = os.getenv('ALMACENAMIENTO', 'local').lower()
+
+S3_BUCKET = os.getenv('S3_BUCKET')
+S3_PREFIJO = os.getenv('S3_PREFIJO', '')
+S3_ENDPOINT_URL = os.getenv('S3_ENDPOINT_URL') or None
+S3_REGION = os.getenv('S3_REGION') or None
+S3_URL_EXPIRA = int(os.getenv('S3_URL_EXPIRA', 300))
+# Arriba de este tamaño publicar() usa multipart (partes en paralelo)
+S3_MULTIPART_BYTES = int(os.getenv('S3_MULTIPART_BYTES', 16 * 1024 * 1024))
+S3_MULTIPART_HILOS = int(os.getenv('S3_MULTIPART_HILOS', 4))
+# Conservar la copia en disco después de subir al bucket (caché local)
+S3_CONSERVAR_LOCAL = os.getenv('S3_CONSERVAR_LOCAL', '0') == '1'
+
+_almacen = None
+_almacen_lock = threading.Lock()
+
+
+def _clave(ruta):
+    return os.path.relpath(ruta, UPLOADS_ROOT).replace(os.sep, '/')
+
+
+class AlmacenamientoLocal:
+    """Archivos en uploads/ del disco local"""
+
+    def info(self, ruta):
+        """os.stat_result (st_size, st_mtime, st_mtime_ns) o None si no existe"""
+        try:
+            return os.stat(ruta)
+        except OSError:
+            return None
+
+    def abrir(self, ruta):
+        return open(ruta, 'rb')
+
+    def publicar(self, ruta, mimetype=None):
+        """El archivo ya quedó en su lugar"""
+
+    def eliminar(self, ruta):
+        try:
+            os.remove(ruta)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def url_descarga(self, ruta, mimetype=None, download_name=None, as_attachment=False):
+        """Sin URL externa: lo entrega la aplicación (o el proxy)"""
+        return None
+
+
+class AlmacenamientoS3(AlmacenamientoLocal):
+    """
+    Bucket S3 compatible. Un archivo que todavía esté en disco local (recién
+    escrito, o subido antes de activar S3) se sigue sirviendo desde disco.
+    """
+
+    def __init__(self):
+        try:
+            import boto3
+            from boto3.s3.transfer import TransferConfig
+            from botocore.exceptions import ClientError
+        except ImportError:
+            raise RuntimeError("ALMACENAMIENTO=s3 requiere boto3 (pip install boto3)")
+        if not S3_BUCKET:
+            raise RuntimeError("ALMACENAMIENTO=s3 requiere S3_BUCKET")
+
+        self.cliente = boto3.client('s3', endpoint_url=S3_ENDPOINT_URL, region_name=S3_REGION)
+        self.transferencia = TransferConfig(
+            multipart_threshold=S3_MULTIPART_BYTES,
+            multipart_chunksize=S3_MULTIPART_BYTES,
+            max_concurrency=S3_MULTIPART_HILOS
+        )
+        self._ClientError = ClientError
+
+    def _key(self, ruta):
+        return f"{S3_PREFIJO}{_clave(ruta)}"
+
+    def info(self, ruta):
+        local = super().info(ruta)
+        if local is not None:
+            return local
+        try:
+            cabecera = self.cliente.head_object(Bucket=S3_BUCKET, Key=self._key(ruta))
+        except self._ClientError:
+            return None
+        modificado = cabecera['LastModified'].timestamp()
+        return SimpleNamespace(
+            st_size=cabecera['ContentLength'],
+            st_mtime=modificado,
+            st_mtime_ns=int(modificado * 1_000_000_000)
+        )
+
+    def abrir(self, ruta):
+        if os.path.exists(ruta):
+            return super().abrir(ruta)
+        try:
+            return self.cliente.get_object(Bucket=S3_BUCKET, Key=self._key(ruta))['Body']
+        except self.cliente.exceptions.NoSuchKey:
+            raise FileNotFoundError(ruta)
+
+    def publicar(self, ruta, mimetype=None):
+        """Sube el archivo local (multipart si es grande) y libera el disco"""
+        self.cliente.upload_file(
+            ruta, S3_BUCKET, self._key(ruta),
+            ExtraArgs={'ContentType': mimetype or mimetypes.guess_type(ruta)[0] or 'application/octet-stream'},
+            Config=self.transferencia
+        )
+        if not S3_CONSERVAR_LOCAL:
+            super().eliminar(ruta)
+
+    def eliminar(self, ruta):
+        super().eliminar(ruta)
+        self.cliente.delete_object(Bucket=S3_BUCKET, Key=self._key(ruta))
+        return True
+
+    def url_descarga(self, ruta, mimetype=None, download_name=None, as_attachment=False):
+        if os.path.exists(ruta):
+            return None
+        parametros = {'Bucket': S3_BUCKET, 'Key': self._key(ruta)}
+        if mimetype:
+            parametros['ResponseContentType'] = mimetype
+        if download_name or as_attachment:
+            nombre = download_name or os.path.basename(ruta)
+            disposicion = 'attachment' if as_attachment else 'inline'
+            parametros['ResponseContentDisposition'] = f"{disposicion}; filename*=UTF-8''{quote(nombre)}"
+        return self.cliente.generate_presigned_url('get_object', Params=parametros, ExpiresIn=S3_URL_EXPIRA)
+
+
+def obtener_almacenamiento():
+    """Backend configurado (compartido por el proceso)"""
+    global _almacen
+    with _almacen_lock:
+        if _almacen is None:
+            _almacen = AlmacenamientoS3() if ALMACENAMIENTO == 's3' else AlmacenamientoLocal()
+        return _almacen
@@ -0,0 +1,281 @@
+# utils/blob_store.py
+# Almacén de archivos direccionado por contenido (fotos de usuarios/productos).
+#
+#   uploads/blobs/ab/cd/<sha256><ext>
+#
+# El nombre es el SHA-256 del contenido final: las imágenes se normalizan
+# (orientación, sin EXIF; utils/imagenes.normalizar_imagen) en el temporal
+# antes de calcularlo. Una misma imagen subida para varios registros se guarda una sola
+# vez; archivos_referencias mapea (tabla, idRegistro, campo) -> blob y
+# archivos_blobs lleva el conteo de referencias (ver sql/archivos_blobs.sql).
+# El archivo sólo se borra cuando su conteo llega a cero.
+#
+# Después de nombrarlo el archivo ya no se reescribe (publicar_blob sólo
+# agrega variantes), así que el contenido de un nombre nunca cambia y se puede
+# servir con caché inmutable.
+#
+# Los nombres anteriores (<id>_<archivo> en uploads/<carpeta>/) siguen
+# funcionando: ruta_en_disco() resuelve ambos formatos.
+
+import os
+import re
+import uuid
+import time
+import shutil
+import hashlib
+import threading
+from werkzeug.utils import secure_filename
+from db_config import get_connection
+from utils.imagenes import EXTENSIONES_IMAGEN, normalizar_imagen, generar_variantes, eliminar_variantes
+from utils.cache_archivos import olvidar_stat
+from utils.almacenamiento import obtener_almacenamiento
+
+BLOBS_DIR = os.path.join('uploads', 'blobs')
+BLOB_CHUNK = 64 * 1024
+# Reintentos de publicar_blob después del commit (fallos del backend/variantes)
+BLOB_PUBLICAR_REINTENTOS = int(os.getenv('BLOB_PUBLICAR_REINTENTOS', 3))
+BLOB_PUBLICAR_ESPERA = float(os.getenv('BLOB_PUBLICAR_ESPERA', 5))
+
+_RE_BLOB = re.compile(r'^[0-9a-f]{64}(\.[a-z0-9]{1,10})?$')
+
+
+def es_blob(nombre):
+    return bool(nombre) and bool(_RE_BLOB.match(nombre))
+
+
+def ruta_blob(nombre):
+    return os.path.join(BLOBS_DIR, nombre[:2], nombre[2:4], nombre)
+
+
+def ruta_en_disco(carpeta, nombre):
+    """Ruta en disco del valor guardado en la columna (blob o nombre anterior)"""
+    if es_blob(nombre):
+        return ruta_blob(nombre)
+    return os.path.join('uploads', carpeta, nombre)
+
+
+def url_blob(nombre):
+    return f"/api/archivo/blobs/{nombre}"
+
+
+# ----------------------------
+# Escritura
+# ----------------------------
+
+def guardar_blob(archivo):
+    """
+    Escribe el archivo subido a un temporal calculando el hash en el mismo
+    recorrido (se recalcula si la normalización reescribe la imagen). Devuelve
+    {'nombre', 'hash', 'tamano', 'temporal'}; el temporal se coloca en su ruta
+    final con colocar_blob().
+    Lanza ImagenRechazada (sin dejar el temporal) si es una bomba de descompresión.
+    """
+    extension = os.path.splitext(secure_filename(archivo.filename or ''))[1].lower()
+    os.makedirs(BLOBS_DIR, exist_ok=True)
+    temporal = os.path.join(BLOBS_DIR, f".{uuid.uuid4().hex}.tmp")
+
+    digest = hashlib.sha256()
+    tamano = 0
+    try:
+        with open(temporal, 'wb') as destino:
+            while True:
+                bloque = archivo.stream.read(BLOB_CHUNK)
+                if not bloque:
+                    break
+                digest.update(bloque)
+                destino.write(bloque)
+                tamano += len(bloque)
+        if extension in EXTENSIONES_IMAGEN and normalizar_imagen(temporal):
+            digest, tamano = _hash_archivo(temporal)
+    except Exception:
+        descartar_blob({'temporal': temporal})
+        raise
+
+    codigo = digest.hexdigest()
+    return {'nombre': f"{codigo}{extension}", 'hash': codigo, 'tamano': tamano, 'temporal': temporal}
+
+
+def _hash_archivo(ruta):
+    digest = hashlib.sha256()
+    with open(ruta, 'rb') as f:
+        for bloque in iter(lambda: f.read(BLOB_CHUNK), b''):
+            digest.update(bloque)
+    return digest, os.path.getsize(ruta)
+
+
+def blob_desde_archivo(ruta):
+    """
+    Igual que guardar_blob pero para un archivo que ya está en disco (migración
+    de uploads/<carpeta>/). El temporal es una copia: la normalización no debe
+    tocar el original mientras siga en uso.
+    """
+    extension = os.path.splitext(ruta)[1].lower()
+    os.makedirs(BLOBS_DIR, exist_ok=True)
+    temporal = os.path.join(BLOBS_DIR, f".{uuid.uuid4().hex}.tmp")
+
+    shutil.copy2(ruta, temporal)
+    try:
+        if extension in EXTENSIONES_IMAGEN:
+            normalizar_imagen(temporal)
+        digest, tamano = _hash_archivo(temporal)
+    except Exception:
+        descartar_blob({'temporal': temporal})
+        raise
+
+    codigo = digest.hexdigest()
+    return {'nombre': f"{codigo}{extension}", 'hash': codigo, 'tamano': tamano, 'temporal': temporal}
+
+
+def descartar_blob(blob):
+    try:
+        os.remove(blob['temporal'])
+    except OSError:
+        pass
+
+
+def colocar_blob(blob):
+    """
+    Mueve el temporal a su ruta final con un rename atómico (nunca se ve un
+    archivo a medias). Si el contenido ya existía se descarta el temporal.
+    Devuelve True si el blob es nuevo (falta publicar_blob).
+    """
+    ruta = ruta_blob(blob['nombre'])
+    if obtener_almacenamiento().info(ruta) is not None:
+        descartar_blob(blob)
+        return False
+
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    os.replace(blob['temporal'], ruta)
+    return True
+
+
+def publicar_blob(nombre):
+    """Genera las variantes de un blob recién colocado y lo publica en el backend"""
+    almacen = obtener_almacenamiento()
+    ruta = ruta_blob(nombre)
+    variantes = generar_variantes(ruta)
+    for publicable in [ruta, *variantes]:
+        almacen.publicar(publicable)
+    olvidar_stat(*variantes)
+
+
+def _publicar_con_reintentos(nombre, espera):
+    for intento in range(BLOB_PUBLICAR_REINTENTOS):
+        time.sleep(espera * 2 ** intento)
+        try:
+            publicar_blob(nombre)
+            return
+        except Exception as e:
+            print(f"Error al publicar blob {nombre} (reintento {intento + 1}): {e}")
+    print(f"Blob {nombre} sin publicar tras {BLOB_PUBLICAR_REINTENTOS} reintento(s)")
+
+
+def publicar_tras_commit(nombre):
+    """
+    publicar_blob para después del commit: la referencia ya está confirmada,
+    así que un fallo no debe convertirse en error del request ni impedir
+    liberar el archivo anterior. Se registra y se reintenta en segundo plano.
+    """
+    try:
+        publicar_blob(nombre)
+        return True
+    except Exception as e:
+        print(f"Error al publicar blob {nombre}: {e}")
+    if BLOB_PUBLICAR_REINTENTOS > 0:
+        threading.Thread(target=_publicar_con_reintentos, args=(nombre, BLOB_PUBLICAR_ESPERA),
+                         name='publicar-blob', daemon=True).start()
+    return False
+
+
+# ----------------------------
+# Referencias
+# ----------------------------
+
+def vincular_blob(conexion, tabla, id_registro, campo, blob):
+    """
+    Apunta (tabla, id_registro, campo) al blob y suma una referencia; si antes
+    apuntaba a otro blob le resta una. No hace commit. Devuelve el nombre del
+    blob anterior (para liberar_blob después del commit) o None.
+    """
+    with conexion.cursor() as cursor:
+        cursor.execute("""
+            INSERT INTO archivos_blobs (nombre, hash, tamanoBytes, referencias)
+            VALUES (%s, %s, %s, 1)
+            ON DUPLICATE KEY UPDATE referencias = referencias + 1
+        """, (blob['nombre'], blob['hash'], blob['tamano']))
+
+        cursor.execute("""
+            SELECT nombreBlob FROM archivos_referencias
+            WHERE tabla = %s AND idRegistro = %s AND campo = %s
+            FOR UPDATE
+        """, (tabla, id_registro, campo))
+        fila = cursor.fetchone()
+        anterior = fila[0] if fila else None
+
+        cursor.execute("""
+            INSERT INTO archivos_referencias (tabla, idRegistro, campo, nombreBlob)
+            VALUES (%s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE nombreBlob = VALUES(nombreBlob)
+        """, (tabla, id_registro, campo, blob['nombre']))
+
+        if anterior:
+            cursor.execute(
+                "UPDATE archivos_blobs SET referencias = referencias - 1 WHERE nombre = %s",
+                (anterior,))
+
+    return anterior if anterior != blob['nombre'] else None
+
+
+def desvincular_blob(conexion, tabla, id_registro, campo):
+    """Quita la referencia del registro. No hace commit. Devuelve el blob liberado o None"""
+    with conexion.cursor() as cursor:
+        cursor.execute("""
+            SELECT nombreBlob FROM archivos_referencias
+            WHERE tabla = %s AND idRegistro = %s AND campo = %s
+            FOR UPDATE
+        """, (tabla, id_registro, campo))
+        fila = cursor.fetchone()
+        if not fila:
+            return None
+
+        cursor.execute(
+            "DELETE FROM archivos_referencias WHERE tabla = %s AND idRegistro = %s AND campo = %s",
+            (tabla, id_registro, campo))
+        cursor.execute(
+            "UPDATE archivos_blobs SET referencias = referencias - 1 WHERE nombre = %s",
+            (fila[0],))
+        return fila[0]
+
+
+def liberar_blob(nombre):
+    """
+    Borra el blob si ya no tiene referencias. El renglón se bloquea mientras se
+    borra el archivo; una subida concurrente del mismo contenido espera el
+    bloqueo y vuelve a colocar el archivo en disco.
+    """
+    if not es_blob(nombre):
+        return False
+
+    conn = get_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "SELECT referencias FROM archivos_blobs WHERE nombre = %s FOR UPDATE",
+                (nombre,))
+            fila = cursor.fetchone()
+            if fila and fila[0] > 0:
+                conn.rollback()
+                return False
+
+            cursor.execute("DELETE FROM archivos_blobs WHERE nombre = %s", (nombre,))
+            ruta = ruta_blob(nombre)
+            eliminar_variantes(ruta)
+            obtener_almacenamiento().eliminar(ruta)
+        conn.commit()
+        return True
+    except Exception as e:
+        conn.rollback()
+        print(f"Error al liberar blob {nombre}: {e}")
+        return False
+    finally:
+        conn.close()
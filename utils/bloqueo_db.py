@@ -0,0 +1,31 @@
+# utils/bloqueo_db.py
+# Candado con nombre en MySQL (GET_LOCK) para tareas de mantenimiento que no
+# deben correr dos veces a la vez: cada worker de gunicorn (y el reloader de
+# Flask en modo debug) arranca su propio hilo de barrido, y también pueden
+# lanzarse desde cron. El candado vive en la sesión: si el proceso muere, MySQL
+# lo libera al cerrarse la conexión.
+
+from contextlib import contextmanager
+from db_config import get_connection
+
+
+@contextmanager
+def bloqueo_db(nombre):
+    """
+    with bloqueo_db('barrido-huerfanos') as obtenido: ... obtenido es False si
+    otro proceso ya tiene el candado (no se espera).
+    """
+    conn = get_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT GET_LOCK(%s, 0)", (nombre,))
+            obtenido = cursor.fetchone()[0] == 1
+        try:
+            yield obtenido
+        finally:
+            if obtenido:
+                with conn.cursor() as cursor:
+                    cursor.execute("SELECT RELEASE_LOCK(%s)", (nombre,))
+                    cursor.fetchone()
+    finally:
+        conn.close()
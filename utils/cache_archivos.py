@@ -0,0 +1,171 @@
+# utils/cache_archivos.py
+# Caché en memoria del proceso para servir fotos sin ir a la DB en cada request.
+#
+#  - Referencias: (tabla, id, campo) -> nombre del archivo guardado en la columna.
+#  - Stat: ruta -> stat del backend (para ETag / Last-Modified / tamaño).
+#  - Contenido: LRU acotado en bytes con los archivos chicos más pedidos.
+#
+# Las rutas de subida/borrado invalidan la referencia en este proceso. En los
+# demás workers la referencia puede apuntar a un archivo que ya se liberó:
+# archivo_registro() revisa el archivo y, si no está, vuelve a consultar la DB
+# antes de responder que no existe.
+
+import os
+import time
+import threading
+from collections import OrderedDict
+from db_config import get_connection
+from utils.almacenamiento import obtener_almacenamiento
+from utils.columnas_archivo import columna_archivo
+
+ARCHIVOS_REF_TTL = int(os.getenv('ARCHIVOS_REF_TTL', 300))
+ARCHIVOS_REF_MAX = int(os.getenv('ARCHIVOS_REF_MAX', 10000))
+ARCHIVOS_STAT_TTL = int(os.getenv('ARCHIVOS_STAT_TTL', 60))
+# Segundos que se recuerda que una variante no existe (evita un HEAD a S3 por request)
+ARCHIVOS_STAT_AUSENTE_TTL = int(os.getenv('ARCHIVOS_STAT_AUSENTE_TTL', 60))
+ARCHIVOS_CACHE_BYTES = int(os.getenv('ARCHIVOS_CACHE_BYTES', 32 * 1024 * 1024))
+ARCHIVOS_CACHE_MAX_ARCHIVO = int(os.getenv('ARCHIVOS_CACHE_MAX_ARCHIVO', 256 * 1024))
+
+_lock = threading.Lock()
+_referencias = OrderedDict()   # (tabla, id, campo) -> (vence, existe, nombre)
+_stats = OrderedDict()         # ruta -> (vence, stat o None si no existe)
+_contenido = OrderedDict()     # ruta -> (mtime_ns, tamaño, bytes)
+_contenido_bytes = 0
+
+
+def _consultar_referencia(columna, id_registro):
+    conexion = get_connection()
+    try:
+        with conexion.cursor() as cursor:
+            cursor.execute(columna.sql_select, (id_registro,))
+            fila = cursor.fetchone()
+            return (fila is not None), (fila[0] if fila else None)
+    finally:
+        conexion.close()
+
+
+def _referencia(tabla, id_registro, campo):
+    """(existe_registro, nombre_archivo, vino_del_cache)"""
+    columna = columna_archivo(tabla, campo)
+    if columna is None:
+        raise ValueError(f"{tabla}.{campo} no es una columna de archivo")
+
+    clave = (tabla, int(id_registro), campo)
+    ahora = time.monotonic()
+    with _lock:
+        entrada = _referencias.get(clave)
+        if entrada and entrada[0] > ahora:
+            _referencias.move_to_end(clave)
+            return entrada[1], entrada[2], True
+
+    existe, nombre = _consultar_referencia(columna, id_registro)
+    with _lock:
+        _referencias[clave] = (ahora + ARCHIVOS_REF_TTL, existe, nombre)
+        _referencias.move_to_end(clave)
+        while len(_referencias) > ARCHIVOS_REF_MAX:
+            _referencias.popitem(last=False)
+    return existe, nombre, False
+
+
+def referencia_archivo(tabla, id_registro, campo):
+    """
+    (existe_registro, nombre_archivo) de la columna 'campo'. Sólo la primera
+    consulta (o la primera después de invalidar / vencer) va a la DB.
+    (tabla, campo) debe estar en utils/columnas_archivo.
+    """
+    existe, nombre, _ = _referencia(tabla, id_registro, campo)
+    return existe, nombre
+
+
+def archivo_registro(tabla, id_registro, campo, ruta_de):
+    """
+    (existe_registro, nombre_archivo, ruta, stat) del archivo de la columna;
+    ruta_de(nombre) da la ruta en disco. stat es None si no hay archivo.
+    Si la referencia venía del caché y su archivo ya no está (otro worker
+    reemplazó o borró la foto y liberó la anterior), se invalida y se consulta
+    la DB una vez más antes de darlo por inexistente.
+    """
+    while True:
+        existe, nombre, del_cache = _referencia(tabla, id_registro, campo)
+        if not existe or not nombre:
+            return existe, nombre, None, None
+        ruta = ruta_de(nombre)
+        stat = stat_archivo(ruta) if ruta else None
+        if stat is not None or not del_cache:
+            return existe, nombre, ruta, stat
+        invalidar_referencia(tabla, id_registro, campo)
+
+
+def invalidar_referencia(tabla, id_registro, campo=None):
+    """Quita del caché la referencia del registro (todas sus columnas si campo es None)"""
+    with _lock:
+        if campo is not None:
+            _referencias.pop((tabla, int(id_registro), campo), None)
+            return
+        for clave in [c for c in _referencias if c[0] == tabla and c[1] == int(id_registro)]:
+            del _referencias[clave]
+
+
+def stat_archivo(ruta, recordar_ausente=False):
+    """
+    stat (disco o bucket) con caché corto; None si no existe. Lo inexistente
+    sólo se recuerda con recordar_ausente (variantes opcionales: si faltan se
+    sirve el original), y esas entradas las ignoran las demás consultas.
+    """
+    ahora = time.monotonic()
+    with _lock:
+        entrada = _stats.get(ruta)
+        if entrada and entrada[0] > ahora and (entrada[1] is not None or recordar_ausente):
+            return entrada[1]
+
+    stat = obtener_almacenamiento().info(ruta)
+    if stat is None and not recordar_ausente:
+        return None
+
+    vence = ahora + (ARCHIVOS_STAT_TTL if stat is not None else ARCHIVOS_STAT_AUSENTE_TTL)
+    with _lock:
+        _stats[ruta] = (vence, stat)
+        _stats.move_to_end(ruta)
+        while len(_stats) > ARCHIVOS_REF_MAX:
+            _stats.popitem(last=False)
+    return stat
+
+
+def olvidar_stat(*rutas):
+    """Quita del caché el stat de rutas recién publicadas o borradas en este proceso"""
+    with _lock:
+        for ruta in rutas:
+            _stats.pop(ruta, None)
+
+
+def contenido_archivo(ruta, stat):
+    """
+    Bytes del archivo si mide hasta ARCHIVOS_CACHE_MAX_ARCHIVO; se guardan en
+    un LRU de ARCHIVOS_CACHE_BYTES en total. None para archivos grandes.
+    """
+    global _contenido_bytes
+    if stat.st_size > ARCHIVOS_CACHE_MAX_ARCHIVO:
+        return None
+
+    with _lock:
+        entrada = _contenido.get(ruta)
+        if entrada and entrada[0] == stat.st_mtime_ns and entrada[1] == stat.st_size:
+            _contenido.move_to_end(ruta)
+            return entrada[2]
+
+    try:
+        with open(ruta, 'rb') as f:
+            datos = f.read()
+    except OSError:
+        return None
+
+    with _lock:
+        anterior = _contenido.pop(ruta, None)
+        if anterior:
+            _contenido_bytes -= len(anterior[2])
+        _contenido[ruta] = (stat.st_mtime_ns, stat.st_size, datos)
+        _contenido_bytes += len(datos)
+        while _contenido_bytes > ARCHIVOS_CACHE_BYTES and _contenido:
+            _, (_, _, viejo) = _contenido.popitem(last=False)
+            _contenido_bytes -= len(viejo)
+    return datos
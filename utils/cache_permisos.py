@@ -0,0 +1,155 @@
+# utils/cache_permisos.py
+# Permisos agrupados para el front (login, /auth/verify, /auth/permissions).
+#
+# Los permisos de un rol son los mismos para todos sus usuarios: se arman una
+# vez y se guardan en memoria por idRol (PERMISOS_ROL_TTL segundos). Los
+# permisos directos del usuario viajan en la misma consulta que su renglón
+# (columna SQL_PERMISOS_DIRECTOS), así que un login o verify con el rol en
+# caché es una sola consulta.
+#
+# Las rutas que cambian permisos de un rol llaman invalidar_permisos_rol()
+# después del commit. Los otros workers no se enteran de esa invalidación: por
+# eso el SELECT del usuario trae también SQL_VERSION_ROL, una huella de
+# rol_permisos calculada en la misma consulta. Si no coincide con la del caché
+# los permisos del rol se vuelven a leer; el TTL queda para renglones sin esa
+# columna.
+#
+# Versiones: version_permisos() resume en un hash corto lo que define los
+# permisos efectivos de un usuario (huella del rol, superadmin, directos). Sólo
+# cambia si cambia alguno de ellos, así que sirve de ETag para que el front
+# pregunte con If-None-Match y reciba 304. Los cuerpos JSON ya armados se
+# guardan por (ruta, usuario) junto con su versión (PERMISOS_PAYLOADS_MAX).
+
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+PERMISOS_ROL_TTL = int(os.getenv('PERMISOS_ROL_TTL', 300))
+PERMISOS_PAYLOADS_MAX = int(os.getenv('PERMISOS_PAYLOADS_MAX', 5000))
+
+# Columna para agregar al SELECT de usuarios (alias u): JSON con los permisos directos
+SQL_PERMISOS_DIRECTOS = """(
+        SELECT JSON_ARRAYAGG(JSON_OBJECT('tabla', p.tabla, 'accion', p.accion))
+        FROM usuario_permisos up
+        JOIN permisos p ON up.idPermiso = p.idPermiso
+        WHERE up.idUsuario = u.idUsuario
+    ) AS permisosDirectos"""
+
+# Columna para el mismo SELECT: huella de los permisos del rol del usuario
+# (cantidad, suma y XOR de CRC32 de cada tabla:accion; no depende del orden)
+SQL_VERSION_ROL = """(
+        SELECT CONCAT_WS('-', COUNT(*), COALESCE(SUM(CRC32(CONCAT(p.tabla, ':', p.accion))), 0),
+                         BIT_XOR(CRC32(CONCAT(p.tabla, ':', p.accion))))
+        FROM rol_permisos rp
+        JOIN permisos p ON rp.idPermiso = p.idPermiso
+        WHERE rp.idRol = u.idRol
+    ) AS permisosRolVersion"""
+
+_lock = threading.Lock()
+_roles = {}  # idRol -> (vence, [(tabla, accion), ...], huella de SQL_VERSION_ROL o None)
+_payloads = OrderedDict()  # (ruta, idUsuario) -> (version, cuerpo JSON en bytes)
+
+
+def _version(*partes):
+    return hashlib.sha256(json.dumps(partes, default=str).encode('utf-8')).hexdigest()[:20]
+
+
+def permisos_rol(cursor, id_rol, huella=None):
+    """
+    [(tabla, accion)] del rol; sólo va a la DB (con el cursor del llamador,
+    cursor(dictionary=True)) si no está en caché, si 'huella' (columna
+    permisosRolVersion) no coincide con la guardada o, sin huella, si venció.
+    """
+    ahora = time.monotonic()
+    with _lock:
+        entrada = _roles.get(id_rol)
+    if entrada:
+        if huella is not None and entrada[2] is not None:
+            vigente = entrada[2] == huella
+        else:
+            vigente = entrada[0] > ahora
+        if vigente:
+            return entrada[1]
+
+    cursor.execute("""
+        SELECT p.tabla, p.accion
+        FROM rol_permisos rp
+        JOIN permisos p ON rp.idPermiso = p.idPermiso
+        WHERE rp.idRol = %s
+    """, (id_rol,))
+    pares = [(fila['tabla'], fila['accion']) for fila in cursor.fetchall()]
+
+    with _lock:
+        _roles[id_rol] = (ahora + PERMISOS_ROL_TTL, pares, huella)
+    return pares
+
+
+def invalidar_permisos_rol(id_rol=None):
+    """Quita del caché los permisos del rol (todos si id_rol es None)"""
+    with _lock:
+        if id_rol is None:
+            _roles.clear()
+        else:
+            _roles.pop(int(id_rol), None)
+
+
+def permisos_directos(valor):
+    """[(tabla, accion)] a partir de la columna permisosDirectos (JSON o NULL)"""
+    if not valor:
+        return []
+    if isinstance(valor, (bytes, bytearray)):
+        valor = valor.decode('utf-8')
+    return [(p['tabla'], p['accion']) for p in json.loads(valor)]
+
+
+def armar_permisos(*grupos):
+    """[{"tabla": ..., "<accion>": 1, ...}] en el formato que espera el frontend"""
+    permisos = {}
+    for pares in grupos:
+        for tabla, accion in pares:
+            permisos.setdefault(tabla, {})[accion] = 1
+    return [{"tabla": tabla, **acciones} for tabla, acciones in permisos.items()]
+
+
+def permisos_usuario(cursor, usuario):
+    """
+    Permisos del renglón de usuario (con idRol, permisosDirectos y
+    permisosRolVersion) usando el caché del rol
+    """
+    return armar_permisos(
+        permisos_rol(cursor, usuario['idRol'], usuario.get('permisosRolVersion')),
+        permisos_directos(usuario.get('permisosDirectos'))
+    )
+
+
+def version_permisos(usuario, *extra):
+    """
+    Versión de los permisos efectivos del renglón de usuario (idRol,
+    permisosRolVersion, is_superadmin, permisosDirectos) más los valores de
+    'extra' que también vayan en la respuesta. No consulta la DB ni el caché.
+    """
+    return _version(
+        usuario['idRol'], usuario['permisosRolVersion'], bool(usuario.get('is_superadmin')),
+        sorted(permisos_directos(usuario.get('permisosDirectos'))), *extra
+    )
+
+
+def payload_en_cache(clave, version):
+    """Cuerpo guardado para 'clave' si sigue en 'version'; None si no hay o cambió"""
+    with _lock:
+        entrada = _payloads.get(clave)
+        if entrada is None or entrada[0] != version:
+            return None
+        _payloads.move_to_end(clave)
+        return entrada[1]
+
+
+def guardar_payload(clave, version, cuerpo):
+    with _lock:
+        _payloads[clave] = (version, cuerpo)
+        _payloads.move_to_end(clave)
+        while len(_payloads) > PERMISOS_PAYLOADS_MAX:
+            _payloads.popitem(last=False)
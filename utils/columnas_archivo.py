@@ -0,0 +1,44 @@
+# utils/columnas_archivo.py
+# Registro de las columnas que guardan archivos (tabla, campo). Lo comparten el
+# visor genérico (/archivo/<tabla>/<id>/<campo>), la subida genérica
+# (/upload/imagen), la caché de referencias y los scripts de mantenimiento.
+#
+# Las sentencias SQL se arman una sola vez al importar el módulo: en cada
+# request sólo se busca la pareja en el diccionario, y una combinación que no
+# esté aquí se rechaza sin ir a la DB (y sin interpolar nada del URL en SQL).
+
+import os
+
+UPLOADS_ROOT = 'uploads'
+
+
+class ColumnaArchivo:
+    """Columna de archivo de una tabla con su carpeta y SQL precalculado"""
+
+    __slots__ = ('tabla', 'campo', 'id_columna', 'carpeta', 'sql_select', 'sql_bloquear', 'sql_update')
+
+    def __init__(self, tabla, campo, id_columna, carpeta):
+        self.tabla = tabla
+        self.campo = campo
+        self.id_columna = id_columna
+        self.carpeta = carpeta  # nombres planos anteriores a blobs: uploads/<carpeta>/
+        self.sql_select = f"SELECT {campo} FROM {tabla} WHERE {id_columna} = %s"
+        self.sql_bloquear = f"{self.sql_select} FOR UPDATE"
+        self.sql_update = f"UPDATE {tabla} SET {campo} = %s WHERE {id_columna} = %s"
+
+    @property
+    def ruta_carpeta(self):
+        return os.path.join(UPLOADS_ROOT, self.carpeta)
+
+
+COLUMNAS_ARCHIVO = {
+    (c.tabla, c.campo): c for c in (
+        ColumnaArchivo('usuarios', 'foto', 'idUsuario', 'usuarios'),
+        ColumnaArchivo('productos', 'foto', 'idProducto', 'productos'),
+    )
+}
+
+
+def columna_archivo(tabla, campo):
+    """ColumnaArchivo registrada para (tabla, campo) o None"""
+    return COLUMNAS_ARCHIVO.get((tabla, campo))
@@ -0,0 +1,188 @@
+# utils/contrasenas.py
+# Hash y verificación de contraseñas (bcrypt) en un pool de procesos propio.
+#
+# bcrypt cuesta ~100-250 ms de CPU por llamada; hecho en el worker HTTP, una
+# ráfaga de logins deja sin CPU al resto de los endpoints. Aquí:
+#   - BCRYPT_WORKERS procesos dedicados (por defecto la mitad de los núcleos).
+#   - A lo sumo BCRYPT_MAX_PENDIENTES operaciones en cola + en curso; arriba de
+#     eso se espera hasta BCRYPT_ESPERA_MAX segundos por un lugar y, si no se
+#     libera, PoolContrasenasSaturado (503 con Retry-After en la API).
+#   - Si un proceso del pool muere (OOM, kill) el pool queda roto: se recrea y
+#     la operación se reintenta una vez; si vuelve a fallar, PoolContrasenasSaturado.
+#   - Métricas de espera en cola y duración (metricas()).
+#   - Si una contraseña correcta tiene otro costo que BCRYPT_ROUNDS, el mismo
+#     proceso calcula el hash nuevo y verificar_contrasena() lo devuelve para
+#     guardarlo (rehash transparente al subir o bajar el costo).
+
+import os
+import time
+import threading
+import bcrypt
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', 12))
+BCRYPT_WORKERS = int(os.getenv('BCRYPT_WORKERS', max(1, (os.cpu_count() or 2) // 2)))
+BCRYPT_MAX_PENDIENTES = int(os.getenv('BCRYPT_MAX_PENDIENTES', BCRYPT_WORKERS * 8))
+# Segundos máximos esperando lugar en el pool antes de rechazar
+BCRYPT_ESPERA_MAX = float(os.getenv('BCRYPT_ESPERA_MAX', 0.5))
+
+_pool = None
+_pool_lock = threading.Lock()
+_cupos = threading.BoundedSemaphore(BCRYPT_MAX_PENDIENTES)
+
+_metricas_lock = threading.Lock()
+_metricas = {
+    'operaciones': 0,
+    'rechazadas': 0,
+    'rehashes': 0,
+    'en_curso': 0,
+    'espera_total_ms': 0.0,
+    'espera_max_ms': 0.0,
+    'duracion_total_ms': 0.0,
+}
+
+
+class PoolContrasenasSaturado(Exception):
+    """No hay lugar en el pool de bcrypt dentro de BCRYPT_ESPERA_MAX"""
+
+
+# ----------------------------
+# Funciones del proceso (de módulo para poder enviarse al pool)
+# ----------------------------
+
+def _costo(password_hash):
+    """Rounds de un hash '$2b$12$...'; None si no tiene ese formato"""
+    try:
+        return int(password_hash.split(b'$')[2])
+    except (IndexError, ValueError):
+        return None
+
+
+def _hashear(password, rounds):
+    inicio = time.time()
+    return inicio, bcrypt.hashpw(password, bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def _verificar(password, password_hash, rounds):
+    inicio = time.time()
+    if not bcrypt.checkpw(password, password_hash):
+        return inicio, False, None
+    nuevo = None
+    if _costo(password_hash) != rounds:
+        nuevo = bcrypt.hashpw(password, bcrypt.gensalt(rounds)).decode('utf-8')
+    return inicio, True, nuevo
+
+
+# ----------------------------
+# API
+# ----------------------------
+
+def obtener_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=BCRYPT_WORKERS)
+        return _pool
+
+
+def _reiniciar_pool(roto):
+    """Descarta el pool roto; el siguiente obtener_pool() crea uno nuevo"""
+    global _pool
+    with _pool_lock:
+        if _pool is roto:
+            _pool = None
+    roto.shutdown(wait=False, cancel_futures=True)
+
+
+def _intentar(pool, funcion, *args):
+    """Resultado de 'funcion' en 'pool'; None si el pool está roto o ya cerrado"""
+    try:
+        futuro = pool.submit(funcion, *args)
+    except (BrokenProcessPool, RuntimeError) as e:
+        # RuntimeError: otro hilo cerró este pool al recrearlo
+        print("Pool de bcrypt no disponible:", e)
+        return None
+    try:
+        return futuro.result()
+    except BrokenProcessPool as e:
+        print("Pool de bcrypt roto:", e)
+        return None
+
+
+def _enviar(funcion, *args):
+    """Corre 'funcion' en el pool; si está roto lo recrea y reintenta una vez"""
+    for _ in range(2):
+        pool = obtener_pool()
+        resultado = _intentar(pool, funcion, *args)
+        if resultado is not None:
+            return resultado
+        _reiniciar_pool(pool)
+    raise PoolContrasenasSaturado('El pool de contraseñas no está disponible')
+
+
+def _ejecutar(funcion, *args):
+    """Corre 'funcion' en el pool respetando el cupo; devuelve su resultado sin el tiempo de inicio"""
+    if not _cupos.acquire(timeout=BCRYPT_ESPERA_MAX):
+        with _metricas_lock:
+            _metricas['rechazadas'] += 1
+        raise PoolContrasenasSaturado('Demasiadas verificaciones de contraseña en curso')
+
+    with _metricas_lock:
+        _metricas['en_curso'] += 1
+    enviado = time.time()
+    try:
+        inicio, *resultado = _enviar(funcion, *args)
+    finally:
+        _cupos.release()
+        with _metricas_lock:
+            _metricas['en_curso'] -= 1
+    terminado = time.time()
+
+    espera_ms = max(0.0, (inicio - enviado) * 1000)
+    with _metricas_lock:
+        _metricas['operaciones'] += 1
+        _metricas['espera_total_ms'] += espera_ms
+        _metricas['espera_max_ms'] = max(_metricas['espera_max_ms'], espera_ms)
+        _metricas['duracion_total_ms'] += (terminado - inicio) * 1000
+    return resultado
+
+
+def hashear_contrasena(password):
+    """Hash bcrypt (str) con el costo BCRYPT_ROUNDS"""
+    hash_nuevo, = _ejecutar(_hashear, password.encode('utf-8'), BCRYPT_ROUNDS)
+    return hash_nuevo
+
+
+def verificar_contrasena(password, password_hash):
+    """
+    (correcta, hash_nuevo). hash_nuevo no es None cuando la contraseña es
+    correcta pero el hash guardado usa otro costo: el llamador lo guarda.
+    """
+    if not password or not password_hash:
+        return False, None
+    correcta, nuevo = _ejecutar(
+        _verificar, password.encode('utf-8'), password_hash.encode('utf-8'), BCRYPT_ROUNDS)
+    if nuevo:
+        with _metricas_lock:
+            _metricas['rehashes'] += 1
+    return correcta, nuevo
+
+
+def metricas():
+    """Contadores del pool; promedios en milisegundos"""
+    with _metricas_lock:
+        datos = dict(_metricas)
+    operaciones = datos['operaciones'] or 1
+    return {
+        'workers': BCRYPT_WORKERS,
+        'max_pendientes': BCRYPT_MAX_PENDIENTES,
+        'rounds': BCRYPT_ROUNDS,
+        'operaciones': datos['operaciones'],
+        'rechazadas': datos['rechazadas'],
+        'rehashes': datos['rehashes'],
+        'en_curso': datos['en_curso'],
+        'espera_promedio_ms': round(datos['espera_total_ms'] / operaciones, 2),
+        'espera_max_ms': round(datos['espera_max_ms'], 2),
+        'duracion_promedio_ms': round(datos['duracion_total_ms'] / operaciones, 2),
+    }
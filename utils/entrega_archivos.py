@@ -0,0 +1,135 @@
+# utils/entrega_archivos.py
+# Entrega de archivos de uploads/ después de autorizar/ubicar el registro en la DB.
+#
+# ARCHIVOS_ENTREGA:
+#   flask  -> send_file desde el worker (desarrollo, valor por defecto)
+#   nginx  -> cabecera X-Accel-Redirect; nginx lee el archivo. Ejemplo:
+#               location /_uploads/ {
+#                   internal;
+#                   alias /srv/app/uploads/;
+#               }
+#   apache -> cabecera X-Sendfile con la ruta absoluta (mod_xsendfile)
+
+import io
+import os
+import zlib
+import mimetypes
+from urllib.parse import quote
+from flask import Response, request, send_file, redirect
+from utils.cache_archivos import stat_archivo, contenido_archivo
+from utils.almacenamiento import obtener_almacenamiento, S3_URL_EXPIRA
+
+UPLOADS_ROOT = 'uploads'
+ENTREGA_MODO = os.getenv('ARCHIVOS_ENTREGA', 'flask').lower()
+ENTREGA_PREFIJO_INTERNO = os.getenv('ARCHIVOS_PREFIJO_INTERNO', '/_uploads/')
+
+# Las URLs de fotos no cambian al reemplazar la foto (/archivo/usuarios/<id>/foto),
+# por eso el max-age es corto y el resto lo resuelven los validadores (304)
+ARCHIVOS_MAX_AGE = int(os.getenv('ARCHIVOS_MAX_AGE', 60))
+
+# Archivos con nombre por contenido (uploads/blobs/): nunca cambian
+ARCHIVOS_MAX_AGE_INMUTABLE = 365 * 24 * 3600
+
+# Firmas de los formatos que se suben normalmente (offset, bytes, mime)
+_FIRMAS = [
+    (0, b'\xff\xd8\xff', 'image/jpeg'),
+    (0, b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (0, b'GIF87a', 'image/gif'),
+    (0, b'GIF89a', 'image/gif'),
+    (0, b'%PDF-', 'application/pdf'),
+    (4, b'ftypheic', 'image/heic'),
+    (4, b'ftypqt', 'video/quicktime'),
+    (4, b'ftyp', 'video/mp4'),
+]
+
+
+def detectar_mime(ruta, declarado=None, cabecera=None):
+    """
+    MIME por firma del archivo; si no se reconoce usa el declarado (p.ej. el
+    tipoMime guardado en la DB) y al final la extensión.
+    """
+    if cabecera is None:
+        try:
+            with open(ruta, 'rb') as f:
+                cabecera = f.read(16)
+        except OSError:
+            cabecera = b''
+
+    if cabecera[:4] == b'RIFF' and cabecera[8:12] == b'WEBP':
+        return 'image/webp'
+    for offset, firma, mime in _FIRMAS:
+        if cabecera[offset:offset + len(firma)] == firma:
+            return mime
+
+    if declarado and declarado != 'application/octet-stream':
+        return declarado
+    return mimetypes.guess_type(ruta)[0] or 'application/octet-stream'
+
+
+def _etag(ruta, stat):
+    """Validador fuerte a partir de mtime, tamaño y nombre del archivo"""
+    nombre = zlib.crc32(os.path.basename(ruta).encode('utf-8'))
+    return f"{stat.st_mtime_ns:x}-{stat.st_size:x}-{nombre:08x}"
+
+
+def enviar_archivo(ruta, mimetype=None, download_name=None, as_attachment=False, max_age=None,
+                   inmutable=False):
+    """
+    Envía un archivo ubicado bajo uploads/ (ruta relativa a la raíz del proyecto)
+    con ETag / Last-Modified / Cache-Control. Responde 304 a If-None-Match e
+    If-Modified-Since y soporta Range.
+    En modo nginx/apache el worker sólo responde cabeceras y el proxy mueve los
+    bytes (el proxy atiende también los Range).
+    Con 'inmutable' se manda Cache-Control: max-age de un año e immutable.
+    Con ALMACENAMIENTO=s3 se redirige a una URL firmada del bucket.
+    """
+    stat = stat_archivo(ruta)
+    if stat is None:
+        raise FileNotFoundError(ruta)
+    etag = _etag(ruta, stat)
+    if max_age is None:
+        max_age = ARCHIVOS_MAX_AGE_INMUTABLE if inmutable else ARCHIVOS_MAX_AGE
+
+    url = obtener_almacenamiento().url_descarga(ruta, mimetype, download_name, as_attachment)
+    if url:
+        # La URL firmada cambia en cada llamada: se cachea la redirección, no la URL
+        respuesta = redirect(url, 302)
+        respuesta.cache_control.private = True
+        respuesta.cache_control.max_age = min(max_age, S3_URL_EXPIRA // 2)
+        return respuesta
+
+    if ENTREGA_MODO not in ('nginx', 'apache'):
+        # Archivos chicos (avatares, miniaturas) desde el LRU en memoria
+        datos = contenido_archivo(ruta, stat)
+        mimetype = detectar_mime(ruta, mimetype, datos[:16] if datos is not None else None)
+        if download_name is None and datos is not None:
+            download_name = os.path.basename(ruta)
+        origen = io.BytesIO(datos) if datos is not None else ruta
+        respuesta = send_file(origen, mimetype=mimetype, download_name=download_name,
+                              as_attachment=as_attachment, conditional=True, etag=etag,
+                              last_modified=stat.st_mtime, max_age=max_age)
+        respuesta.cache_control.immutable = inmutable or None
+        return respuesta
+
+    mimetype = detectar_mime(ruta, mimetype)
+    respuesta = Response(mimetype=mimetype)
+    respuesta.set_etag(etag)
+    respuesta.last_modified = stat.st_mtime
+    respuesta.cache_control.public = True
+    respuesta.cache_control.max_age = max_age
+    respuesta.cache_control.immutable = inmutable or None
+    respuesta.make_conditional(request)
+    if respuesta.status_code == 304:
+        return respuesta
+
+    if ENTREGA_MODO == 'nginx':
+        relativa = os.path.relpath(ruta, UPLOADS_ROOT).replace(os.sep, '/')
+        respuesta.headers['X-Accel-Redirect'] = ENTREGA_PREFIJO_INTERNO.rstrip('/') + '/' + quote(relativa)
+    else:
+        respuesta.headers['X-Sendfile'] = os.path.abspath(ruta)
+
+    if download_name or as_attachment:
+        nombre = download_name or os.path.basename(ruta)
+        disposicion = 'attachment' if as_attachment else 'inline'
+        respuesta.headers['Content-Disposition'] = f"{disposicion}; filename*=UTF-8''{quote(nombre)}"
+    return respuesta
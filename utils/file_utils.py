@@ -2,37 +2,69 @@
 
 import os
 import bcrypt
-from werkzeug.utils import secure_filename
+from db_config import get_connection
+from utils.imagenes import eliminar_variantes
+from utils.almacenamiento import obtener_almacenamiento
+from utils.blob_store import (
+    es_blob, guardar_blob, descartar_blob, colocar_blob, publicar_tras_commit,
+    vincular_blob, desvincular_blob, liberar_blob
+)
 
 
-def subir_archivo(tabla, id_registro, archivo, campo, carpeta):
-    """Sube un archivo al sistema y actualiza la base de datos"""
-    # Crear directorio si no existe
-    ruta_directorio = os.path.join('uploads', carpeta)
-    os.makedirs(ruta_directorio, exist_ok=True)
+def subir_archivo(conexion, tabla, id_registro, archivo, campo):
+    """
+    Sube un archivo al almacén por contenido y registra la referencia dentro
+    de la transacción del llamador (no hace commit). Devuelve el blob; su
+    'nombre' es lo que se guarda en la columna. Después del commit el llamador
+    llama confirmar_archivo(blob); si hace rollback, cancelar_archivo(blob).
+    """
+    blob = guardar_blob(archivo)
+    blob['colocado'] = False
+    try:
+        blob['anterior'] = vincular_blob(conexion, tabla, id_registro, campo, blob)
+        blob['colocado'] = colocar_blob(blob)
+    except Exception:
+        descartar_blob(blob)
+        raise
+    return blob
+
 
-    # Generar nombre seguro
-    nombre_seguro = secure_filename(archivo.filename)
-    nombre_archivo = f'{id_registro}_{nombre_seguro}'
-    ruta_completa = os.path.join(ruta_directorio, nombre_archivo)
+def confirmar_archivo(blob):
+    """Tras el commit: publica el blob nuevo y libera el que reemplazó"""
+    if blob['colocado']:
+        publicar_tras_commit(blob['nombre'])
+    if blob['anterior']:
+        liberar_blob(blob['anterior'])
 
-    # Guardar archivo
-    archivo.save(ruta_completa)
 
-    return nombre_archivo
+def cancelar_archivo(blob):
+    """Tras el rollback: el blob nuevo quedó sin referencias"""
+    if blob['colocado']:
+        liberar_blob(blob['nombre'])
+    else:
+        descartar_blob(blob)
 
 
-def eliminar_archivo(nombre_archivo, carpeta):
-    """Elimina un archivo del sistema"""
+def eliminar_archivo(nombre_archivo, carpeta, tabla, id_registro, campo):
+    """Elimina un archivo del sistema (los blobs sólo al quedar sin referencias)"""
     if not nombre_archivo:
         return False
 
     try:
-        ruta_archivo = os.path.join('uploads', carpeta, nombre_archivo)
-        if os.path.exists(ruta_archivo):
-            os.remove(ruta_archivo)
+        if es_blob(nombre_archivo):
+            conn = get_connection()
+            try:
+                liberado = desvincular_blob(conn, tabla, id_registro, campo)
+                conn.commit()
+            finally:
+                conn.close()
+            if liberado:
+                liberar_blob(liberado)
             return True
-        return False
+
+        ruta_archivo = os.path.join('uploads', carpeta, nombre_archivo)
+        eliminar_variantes(ruta_archivo)
+        return obtener_almacenamiento().eliminar(ruta_archivo)
     except Exception as e:
         print(f"Error al eliminar archivo: {e}")
-        return False
\ No newline at end of file
+        return False
@@ -0,0 +1,126 @@
+# utils/imagenes.py
+# Post-proceso de imágenes subidas: orientación, limpieza de EXIF y variantes WebP.
+# Variantes junto al original:  <nombre>__thumb.webp / <nombre>__medium.webp / <nombre>__full.webp
+
+import os
+import uuid
+from PIL import Image, ImageOps, UnidentifiedImageError
+from utils.almacenamiento import obtener_almacenamiento
+from utils.cache_archivos import stat_archivo, olvidar_stat
+
+# Lado mayor en px de cada variante
+VARIANTES = {
+    'thumb': 160,
+    'medium': 640,
+    'full': 2048,
+}
+WEBP_CALIDAD = int(os.getenv('WEBP_CALIDAD', 80))
+
+EXTENSIONES_IMAGEN = {'.jpg', '.jpeg', '.png', '.webp', '.gif', '.bmp', '.tif', '.tiff'}
+
+
+class ImagenRechazada(ValueError):
+    """Imagen que no se acepta: más píxeles que Image.MAX_IMAGE_PIXELS (bomba de descompresión)"""
+
+
+def ruta_variante(ruta, tamano):
+    base, _ = os.path.splitext(ruta)
+    return f"{base}__{tamano}.webp"
+
+
+def resolver_variante(ruta, tamano):
+    """Ruta de la variante pedida (?size=thumb|medium|full) o el original si no existe"""
+    if tamano in VARIANTES:
+        variante = ruta_variante(ruta, tamano)
+        if stat_archivo(variante, recordar_ausente=True) is not None:
+            return variante
+    return ruta
+
+
+def _guardar_atomico(imagen, destino, **opciones):
+    """Guarda en un temporal junto al destino y lo renombra: nunca se sirve una imagen a medias"""
+    temporal = os.path.join(os.path.dirname(destino), f".{uuid.uuid4().hex}.tmp")
+    try:
+        imagen.save(temporal, **opciones)
+        os.replace(temporal, destino)
+    except Exception:
+        try:
+            os.remove(temporal)
+        except OSError:
+            pass
+        raise
+
+
+def es_imagen(nombre):
+    return os.path.splitext(nombre)[1].lower() in EXTENSIONES_IMAGEN
+
+
+def normalizar_imagen(ruta):
+    """
+    Corrige la orientación según EXIF y reescribe la imagen sin metadatos (GPS,
+    modelo de teléfono...), sólo si traía EXIF. Se llama antes de nombrar el
+    archivo: lo que se publica ya es la versión final. Devuelve True si el
+    archivo se reescribió. Una imagen que no se pueda leer se deja tal cual;
+    una bomba de descompresión lanza ImagenRechazada (Image.open sólo lee la
+    cabecera, así que se detecta antes de decodificar).
+    """
+    try:
+        with Image.open(ruta) as original:
+            formato = original.format
+            if not original.getexif() or getattr(original, 'is_animated', False):
+                return False
+            imagen = ImageOps.exif_transpose(original)
+            opciones = {'quality': 90} if formato == 'JPEG' else {}
+            _guardar_atomico(imagen, ruta, format=formato, **opciones)
+            return True
+    except Image.DecompressionBombError as e:
+        raise ImagenRechazada(str(e))
+    except (UnidentifiedImageError, OSError, ValueError) as e:
+        print(f"No se pudo normalizar la imagen {ruta}: {e}")
+        return False
+
+
+def generar_variantes(ruta):
+    """Genera las variantes WebP sin tocar el original; devuelve sus rutas"""
+    if not es_imagen(ruta):
+        return []
+
+    generadas = []
+    try:
+        with Image.open(ruta) as original:
+            imagen = ImageOps.exif_transpose(original)
+            if imagen.mode not in ('RGB', 'RGBA'):
+                imagen = imagen.convert('RGBA' if 'A' in imagen.getbands() else 'RGB')
+
+            for tamano, lado in VARIANTES.items():
+                variante = imagen.copy()
+                variante.thumbnail((lado, lado), Image.LANCZOS)
+                destino = ruta_variante(ruta, tamano)
+                _guardar_atomico(variante, destino, format='WEBP', quality=WEBP_CALIDAD, method=4)
+                generadas.append(destino)
+    except Image.DecompressionBombError as e:
+        raise ImagenRechazada(str(e))
+    except (UnidentifiedImageError, OSError, ValueError) as e:
+        print(f"No se pudo procesar la imagen {ruta}: {e}")
+    return generadas
+
+
+def procesar_imagen(ruta):
+    """
+    normalizar_imagen + generar_variantes para archivos que se guardan con su
+    nombre definitivo (evidencias de agenda). Sólo una bomba de descompresión
+    lanza ImagenRechazada (el llamador rechaza la subida y borra el archivo).
+    """
+    if not es_imagen(ruta):
+        return []
+    normalizar_imagen(ruta)
+    return generar_variantes(ruta)
+
+
+def eliminar_variantes(ruta):
+    almacen = obtener_almacenamiento()
+    for tamano in VARIANTES:
+        try:
+            almacen.eliminar(ruta_variante(ruta, tamano))
+        except OSError:
+            pass
@@ -0,0 +1,246 @@
+# utils/limitador_login.py
+# Límite de intentos de login por IP y por email, antes de tocar la DB o bcrypt.
+#
+# Ventana deslizante aproximada: por clave se guardan los contadores de la
+# ventana fija actual y la anterior, y el conteo estimado es
+#     anterior * (1 - fracción transcurrida de la actual) + actual
+# (dos enteros por clave, fácil de compartir con INCR/EXPIRE).
+#
+#   IP     -> todos los intentos:   LOGIN_LIMITE_IP en LOGIN_VENTANA_IP segundos
+#   email  -> intentos fallidos:    LOGIN_LIMITE_EMAIL en LOGIN_VENTANA_EMAIL segundos
+#             (un login correcto limpia el contador del email)
+#
+# El intento se reserva antes de bcrypt: se incrementa el contador y, si con
+# ese incremento se pasa del límite, se devuelve y se rechaza. Así N requests
+# simultáneos con la misma contraseña no pasan todos por la verificación
+# antes de que el primero registre su fallo. Para el email la reserva cuenta
+# como fallo hasta que registrar_exito() la limpia (o liberar_intento() la
+# devuelve si el login no llegó a verificar la contraseña).
+#
+# Almacenamiento: en memoria del proceso por defecto. Con varios workers o
+# nodos, LOGIN_LIMITE_REDIS_URL=redis://host:6379/0 comparte los contadores
+# (requiere el paquete redis). Si Redis falla se deja pasar el intento: el
+# limitador no debe tumbar el login.
+
+import os
+import math
+import time
+import threading
+from collections import OrderedDict
+
+LOGIN_LIMITE_IP = int(os.getenv('LOGIN_LIMITE_IP', 30))
+LOGIN_VENTANA_IP = int(os.getenv('LOGIN_VENTANA_IP', 60))
+LOGIN_LIMITE_EMAIL = int(os.getenv('LOGIN_LIMITE_EMAIL', 5))
+LOGIN_VENTANA_EMAIL = int(os.getenv('LOGIN_VENTANA_EMAIL', 900))
+LOGIN_LIMITE_REDIS_URL = os.getenv('LOGIN_LIMITE_REDIS_URL')
+# Máximo de claves en memoria; arriba de eso se descartan las de incremento más viejo
+LOGIN_LIMITE_CLAVES_MAX = int(os.getenv('LOGIN_LIMITE_CLAVES_MAX', 100000))
+
+_contadores_lock = threading.Lock()
+_contadores = {
+    'rechazados_ip': 0,
+    'rechazados_email': 0,
+    'fallidos': 0,
+    'errores_backend': 0,
+}
+
+
+# ----------------------------
+# Almacenamiento
+# ----------------------------
+
+class _BackendMemoria:
+    """
+    clave -> [ventana, actual, anterior] en un OrderedDict del proceso, en
+    orden de último incremento: las claves vencidas y las que pasen de
+    LOGIN_LIMITE_CLAVES_MAX se quitan por el frente sin recorrer el resto.
+    """
+
+    def __init__(self):
+        self._datos = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _rotar(self, clave, ventana):
+        entrada = self._datos.get(clave)
+        if entrada is None or entrada[0] < ventana - 1:
+            return [ventana, 0, 0]
+        if entrada[0] == ventana - 1:
+            return [ventana, 0, entrada[1]]
+        return entrada
+
+    def incrementar(self, clave, ventana, duracion):
+        """Suma uno a la ventana actual; devuelve (actual, anterior) ya incrementado"""
+        with self._lock:
+            entrada = self._rotar(clave, ventana)
+            entrada[1] += 1
+            self._datos[clave] = entrada
+            self._datos.move_to_end(clave)
+            self._purgar(time.time())
+            return entrada[1], entrada[2]
+
+    def decrementar(self, clave, ventana):
+        with self._lock:
+            entrada = self._datos.get(clave)
+            if entrada and entrada[0] == ventana and entrada[1] > 0:
+                entrada[1] -= 1
+
+    def reiniciar(self, clave):
+        with self._lock:
+            self._datos.pop(clave, None)
+
+    def _purgar(self, ahora):
+        # Desde la clave de incremento más viejo: sale si su ventana ya no cuenta
+        # (más de dos ventanas atrás) o si hay más de LOGIN_LIMITE_CLAVES_MAX
+        while self._datos:
+            clave, entrada = next(iter(self._datos.items()))
+            vencida = entrada[0] < int(ahora // _duracion_de(clave)) - 1
+            if not vencida and len(self._datos) <= LOGIN_LIMITE_CLAVES_MAX:
+                break
+            self._datos.popitem(last=False)
+
+
+class _BackendRedis:
+    """Contadores compartidos: <prefijo>:<clave>:<ventana> con INCR + EXPIRE"""
+
+    def __init__(self, url):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("LOGIN_LIMITE_REDIS_URL requiere el paquete redis (pip install redis)")
+        self.cliente = redis.Redis.from_url(url, socket_timeout=0.2, socket_connect_timeout=0.2)
+
+    def incrementar(self, clave, ventana, duracion):
+        """INCR atómico en un pipeline; devuelve (actual, anterior) ya incrementado"""
+        canal = self.cliente.pipeline()
+        canal.incr(f"login:{clave}:{ventana}")
+        canal.expire(f"login:{clave}:{ventana}", duracion * 2)
+        canal.get(f"login:{clave}:{ventana - 1}")
+        actual, _, anterior = canal.execute()
+        return int(actual), max(0, int(anterior or 0))
+
+    def decrementar(self, clave, ventana):
+        self.cliente.decr(f"login:{clave}:{ventana}")
+
+    def reiniciar(self, clave):
+        ventana = int(time.time() // _duracion_de(clave))
+        self.cliente.delete(f"login:{clave}:{ventana}", f"login:{clave}:{ventana - 1}")
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def _obtener_backend():
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = _BackendRedis(LOGIN_LIMITE_REDIS_URL) if LOGIN_LIMITE_REDIS_URL else _BackendMemoria()
+        return _backend
+
+
+def _duracion_de(clave):
+    return LOGIN_VENTANA_IP if clave.startswith('ip:') else LOGIN_VENTANA_EMAIL
+
+
+# ----------------------------
+# Ventana deslizante
+# ----------------------------
+
+def _reservar(clave, limite):
+    """
+    Suma el intento a 'clave'. Devuelve 0 si cabe bajo 'limite'; si no, lo
+    devuelve y da los segundos hasta que vuelva a caber.
+    """
+    duracion = _duracion_de(clave)
+    ahora = time.time()
+    ventana = int(ahora // duracion)
+    transcurrido = ahora - ventana * duracion
+
+    backend = _obtener_backend()
+    actual, anterior = backend.incrementar(clave, ventana, duracion)
+    actual -= 1  # conteo sin este intento
+    if anterior * (1 - transcurrido / duracion) + actual < limite:
+        return 0
+    backend.decrementar(clave, ventana)
+    if actual >= limite or not anterior:
+        # sólo se libera cuando la ventana actual pase a ser la anterior
+        return math.ceil(duracion - transcurrido) or 1
+    # el peso de la ventana anterior baja con el tiempo
+    fraccion = 1 - (limite - actual) / anterior
+    return max(1, math.ceil(fraccion * duracion - transcurrido))
+
+
+def _clave_email(email):
+    return f"email:{(email or '').strip().lower()}"
+
+
+def _contar(nombre):
+    with _contadores_lock:
+        _contadores[nombre] += 1
+
+
+def verificar_intento(ip, email):
+    """
+    Segundos de Retry-After si el intento se rechaza, 0 si puede continuar.
+    Reserva el intento para la IP y, si hay email, un fallo provisional para
+    el email (ver registrar_exito / liberar_intento). Un intento rechazado no
+    queda contado.
+    """
+    try:
+        espera = _reservar(f"ip:{ip}", LOGIN_LIMITE_IP)
+        if espera:
+            _contar('rechazados_ip')
+            return espera
+
+        if email:
+            espera = _reservar(_clave_email(email), LOGIN_LIMITE_EMAIL)
+            if espera:
+                _contar('rechazados_email')
+                _devolver(f"ip:{ip}")
+                return espera
+    except Exception as e:
+        _contar('errores_backend')
+        print("Error en limitador de login:", e)
+    return 0
+
+
+def _devolver(clave):
+    _obtener_backend().decrementar(clave, int(time.time() // _duracion_de(clave)))
+
+
+def registrar_fallo(email):
+    """Login fallido: el fallo del email ya quedó reservado en verificar_intento"""
+    _contar('fallidos')
+
+
+def liberar_intento(email):
+    """El login terminó sin verificar la contraseña (p. ej. 503): devuelve la reserva del email"""
+    if not email:
+        return
+    try:
+        _devolver(_clave_email(email))
+    except Exception as e:
+        _contar('errores_backend')
+        print("Error en limitador de login:", e)
+
+
+def registrar_exito(email):
+    """Login correcto: limpia los fallos acumulados del email"""
+    try:
+        _obtener_backend().reiniciar(_clave_email(email))
+    except Exception as e:
+        _contar('errores_backend')
+        print("Error en limitador de login:", e)
+
+
+def metricas():
+    with _contadores_lock:
+        datos = dict(_contadores)
+    datos.update({
+        'backend': 'redis' if LOGIN_LIMITE_REDIS_URL else 'memoria',
+        'limite_ip': LOGIN_LIMITE_IP,
+        'ventana_ip': LOGIN_VENTANA_IP,
+        'limite_email': LOGIN_LIMITE_EMAIL,
+        'ventana_email': LOGIN_VENTANA_EMAIL,
+    })
+    return datos
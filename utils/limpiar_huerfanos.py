@@ -0,0 +1,334 @@
+# utils/limpiar_huerfanos.py
+# Busca (y opcionalmente borra) archivos de uploads/ que ya no tienen referencia
+# en la base: subidas que fallaron antes del commit, fotos reemplazadas o
+# registros eliminados sin su archivo.
+#
+#   uploads/usuarios/, uploads/productos/  -> usuarios.foto / productos.foto (nombres planos)
+#   uploads/blobs/                         -> archivos_blobs.nombre
+#   uploads/agenda/item-<id>/              -> agenda_archivos.rutaArchivo
+#
+# Los listados se recorren con os.scandir (sin cargar carpetas completas a
+# memoria) y se comparan contra la DB por lotes. Sólo se consideran huérfanos
+# los archivos con más de HUERFANOS_GRACIA segundos sin modificarse: un archivo
+# recién escrito puede estar esperando el INSERT/UPDATE de su subida.
+#
+# No se tocan: uploads/agenda/_subidas (las vence subidas_agenda), los archivos
+# planos ya migrados que esperan su periodo de gracia (utils/migrar_uploads) ni
+# los temporales .tmp más nuevos que la gracia.
+#
+# El recorrido es sobre el disco local; con ALMACENAMIENTO=s3 sólo revisa las
+# copias que sigan en disco (el bucket se limpia con sus reglas de ciclo de vida).
+#
+# Uso:  python -m utils.limpiar_huerfanos [--borrar] [--lote 500] [--pausa 0.2]
+#                                          [--gracia 86400] [--tasa 50]
+# Sin --borrar sólo reporta (dry-run).
+# En la aplicación: HUERFANOS_INTERVALO > 0 lanza un barrido periódico en segundo plano.
+# Un candado de MySQL (BLOQUEO_HUERFANOS) evita que dos workers, o un worker y
+# cron, barran a la vez.
+
+import os
+import json
+import time
+import argparse
+import threading
+from itertools import islice
+
+from db_config import get_connection
+from utils.imagenes import VARIANTES, EXTENSIONES_IMAGEN, es_imagen, eliminar_variantes
+from utils.almacenamiento import obtener_almacenamiento
+from utils.blob_store import BLOBS_DIR
+from utils.migrar_uploads import ESTADO_MIGRACION
+from utils.columnas_archivo import COLUMNAS_ARCHIVO
+from utils.bloqueo_db import bloqueo_db
+
+UPLOADS_ROOT = 'uploads'
+
+HUERFANOS_GRACIA = int(os.getenv('HUERFANOS_GRACIA', 24 * 3600))
+HUERFANOS_LOTE = int(os.getenv('HUERFANOS_LOTE', 500))
+HUERFANOS_PAUSA = float(os.getenv('HUERFANOS_PAUSA', 0.2))
+# Máximo de archivos borrados por segundo (0 = sin límite)
+HUERFANOS_TASA = float(os.getenv('HUERFANOS_TASA', 50))
+# Barrido periódico dentro de la aplicación (segundos; 0 = desactivado)
+HUERFANOS_INTERVALO = int(os.getenv('HUERFANOS_INTERVALO', 0))
+HUERFANOS_BORRAR = os.getenv('HUERFANOS_BORRAR', '0') == '1'
+
+BLOQUEO_HUERFANOS = 'barrido-huerfanos'
+
+_SUFIJOS_VARIANTE = tuple(f"__{tamano}.webp" for tamano in VARIANTES)
+
+
+# ----------------------------
+# Listados
+# ----------------------------
+
+def _recorrer(carpeta, omitir=()):
+    """Genera (ruta, stat) de los archivos bajo 'carpeta', recursivo y sin listas completas"""
+    try:
+        entradas = os.scandir(carpeta)
+    except FileNotFoundError:
+        return
+    with entradas:
+        for entrada in entradas:
+            try:
+                if entrada.is_dir(follow_symlinks=False):
+                    if entrada.name not in omitir:
+                        yield from _recorrer(entrada.path, omitir)
+                elif entrada.is_file(follow_symlinks=False):
+                    yield entrada.path, entrada.stat(follow_symlinks=False)
+            except FileNotFoundError:
+                continue  # se borró mientras se recorría
+
+
+def _original_de_variante(ruta):
+    """Para '<base>__thumb.webp' devuelve '<base>'; None si no es variante"""
+    for sufijo in _SUFIJOS_VARIANTE:
+        if ruta.endswith(sufijo):
+            return ruta[:-len(sufijo)]
+    return None
+
+
+def _original_existe(base):
+    almacen = obtener_almacenamiento()
+    return any(
+        almacen.info(f"{base}{e}") is not None
+        for ext in EXTENSIONES_IMAGEN for e in (ext, ext.upper())
+    )
+
+
+# ----------------------------
+# Referencias por lote (devuelven el subconjunto de claves que sí existen en la DB)
+# ----------------------------
+
+def _marcadores(valores):
+    return ", ".join(["%s"] * len(valores))
+
+
+def _referenciados_columna(columna):
+    def consultar(cursor, nombres):
+        cursor.execute(
+            f"SELECT {columna.campo} FROM {columna.tabla} WHERE {columna.campo} IN ({_marcadores(nombres)})",
+            tuple(nombres))
+        return {fila[0] for fila in cursor.fetchall()}
+    return consultar
+
+
+def _referenciados_blobs(cursor, nombres):
+    cursor.execute(
+        f"SELECT nombre FROM archivos_blobs WHERE nombre IN ({_marcadores(nombres)})",
+        tuple(nombres))
+    return {fila[0] for fila in cursor.fetchall()}
+
+
+def _referenciados_agenda(cursor, rutas):
+    cursor.execute(
+        f"SELECT rutaArchivo FROM agenda_archivos WHERE rutaArchivo IN ({_marcadores(rutas)})",
+        tuple(rutas))
+    encontrados = {fila[0] for fila in cursor.fetchall()}
+
+    # Renglones viejos sin rutaArchivo: agenda/item-<idItem>/<nombreArchivo>
+    items = {r.split('/')[1][len('item-'):] for r in rutas if r not in encontrados}
+    items = [i for i in items if i.isdigit()]
+    if items:
+        cursor.execute(f"""
+            SELECT CONCAT('agenda/item-', idItem, '/', nombreArchivo)
+            FROM agenda_archivos
+            WHERE (rutaArchivo IS NULL OR rutaArchivo = '') AND idItem IN ({_marcadores(items)})
+        """, tuple(int(i) for i in items))
+        encontrados.update(fila[0] for fila in cursor.fetchall())
+    return encontrados
+
+
+def _clave_nombre(ruta):
+    return os.path.basename(ruta)
+
+
+def _clave_agenda(ruta):
+    return os.path.relpath(ruta, UPLOADS_ROOT).replace(os.sep, '/')
+
+
+# (carpeta, carpetas a omitir, clave del archivo en la DB, consulta del lote, es almacén de blobs)
+COLECCIONES = [
+    *((c.ruta_carpeta, (), _clave_nombre, _referenciados_columna(c), False) for c in COLUMNAS_ARCHIVO.values()),
+    (BLOBS_DIR, (), _clave_nombre, _referenciados_blobs, True),
+    (os.path.join(UPLOADS_ROOT, 'agenda'), ('_subidas',), _clave_agenda, _referenciados_agenda, False),
+]
+
+
+# ----------------------------
+# Borrado
+# ----------------------------
+
+def _borrar_blob(conn, ruta):
+    """
+    Borra un blob sin renglón en archivos_blobs. El SELECT ... FOR UPDATE
+    bloquea la clave: una subida del mismo contenido que llegue ahora espera en
+    vincular_blob y coloca el archivo después del borrado.
+    """
+    nombre = os.path.basename(ruta)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM archivos_blobs WHERE nombre = %s FOR UPDATE", (nombre,))
+            if cursor.fetchone():
+                conn.rollback()
+                return False
+            eliminar_variantes(ruta)
+            obtener_almacenamiento().eliminar(ruta)
+        conn.commit()
+        return True
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def _borrar(conn, ruta, es_blob_store):
+    if es_blob_store and not os.path.basename(ruta).startswith('.'):
+        return _borrar_blob(conn, ruta)
+    if es_imagen(ruta):
+        eliminar_variantes(ruta)
+    obtener_almacenamiento().eliminar(ruta)
+    return True
+
+
+class _Ritmo:
+    """Limita los borrados a 'tasa' por segundo para no saturar el disco"""
+
+    def __init__(self, tasa):
+        self.intervalo = 1.0 / tasa if tasa > 0 else 0
+        self.siguiente = time.monotonic()
+
+    def esperar(self):
+        if not self.intervalo:
+            return
+        ahora = time.monotonic()
+        if self.siguiente > ahora:
+            time.sleep(self.siguiente - ahora)
+        self.siguiente = max(ahora, self.siguiente) + self.intervalo
+
+
+# ----------------------------
+# Barrido
+# ----------------------------
+
+def _pendientes_migracion():
+    """Archivos planos que migrar_uploads todavía va a borrar (no son huérfanos nuestros)"""
+    try:
+        with open(ESTADO_MIGRACION, encoding='utf-8') as f:
+            return {os.path.normpath(p['ruta']) for p in json.load(f).get('pendientesBorrar', [])}
+    except (FileNotFoundError, ValueError):
+        return set()
+
+
+def _revisar_lote(conn, lote, clave, consultar, es_blob_store, borrar, ritmo, resumen):
+    candidatos = {}
+    for ruta, stat in lote:
+        nombre = os.path.basename(ruta)
+        if nombre.startswith('.'):
+            # temporales de blob_store / estado: huérfanos si ya pasó la gracia
+            if nombre.endswith('.tmp'):
+                candidatos.setdefault(None, []).append((ruta, stat))
+            continue
+        base = _original_de_variante(ruta)
+        if base is not None:
+            if not _original_existe(base):
+                candidatos.setdefault(None, []).append((ruta, stat))
+            continue
+        candidatos.setdefault(clave(ruta), []).append((ruta, stat))
+
+    claves = [c for c in candidatos if c is not None]
+    referenciados = set()
+    if claves:
+        with conn.cursor() as cursor:
+            referenciados = consultar(cursor, claves)
+        conn.commit()  # cierra la lectura para no retener el snapshot
+
+    for c, archivos in candidatos.items():
+        if c in referenciados:
+            continue
+        for ruta, stat in archivos:
+            resumen['huerfanos'] += 1
+            resumen['bytes'] += stat.st_size
+            print(f"  huérfano: {ruta} ({stat.st_size} bytes)")
+            if not borrar:
+                continue
+            ritmo.esperar()
+            try:
+                if _borrar(conn, ruta, es_blob_store):
+                    resumen['borrados'] += 1
+            except Exception as e:
+                print(f"  Error al borrar {ruta}: {e}")
+
+
+def barrer(borrar=False, lote=HUERFANOS_LOTE, pausa=HUERFANOS_PAUSA,
+           gracia=HUERFANOS_GRACIA, tasa=HUERFANOS_TASA):
+    """
+    Recorre las carpetas de COLECCIONES y reporta (o borra, con borrar=True)
+    los archivos sin referencia más viejos que 'gracia'. Devuelve el resumen
+    por carpeta.
+    """
+    limite = time.time() - gracia
+    en_migracion = _pendientes_migracion()
+    ritmo = _Ritmo(tasa)
+    resumenes = {}
+
+    conn = get_connection()
+    try:
+        for carpeta, omitir, clave, consultar, es_blob_store in COLECCIONES:
+            resumen = {'revisados': 0, 'huerfanos': 0, 'bytes': 0, 'borrados': 0}
+            resumenes[carpeta] = resumen
+            archivos = (
+                (ruta, stat) for ruta, stat in _recorrer(carpeta, omitir)
+                if stat.st_mtime < limite and os.path.normpath(ruta) not in en_migracion
+            )
+            while True:
+                bloque = list(islice(archivos, lote))
+                if not bloque:
+                    break
+                resumen['revisados'] += len(bloque)
+                _revisar_lote(conn, bloque, clave, consultar, es_blob_store, borrar, ritmo, resumen)
+                if pausa:
+                    time.sleep(pausa)
+    finally:
+        conn.close()
+    return resumenes
+
+
+def _barrido_periodico():
+    while True:
+        time.sleep(HUERFANOS_INTERVALO)
+        try:
+            with bloqueo_db(BLOQUEO_HUERFANOS) as obtenido:
+                if not obtenido:
+                    continue  # otro proceso está barriendo
+                resumenes = barrer(borrar=HUERFANOS_BORRAR)
+            huerfanos = sum(r['huerfanos'] for r in resumenes.values())
+            borrados = sum(r['borrados'] for r in resumenes.values())
+            print(f"Barrido de huérfanos: {huerfanos} huérfano(s), {borrados} borrado(s)")
+        except Exception as e:
+            print("Error en barrido de huérfanos:", e)
+
+
+def iniciar_barrido_periodico():
+    """Lanza el barrido en un hilo de fondo si HUERFANOS_INTERVALO > 0"""
+    if HUERFANOS_INTERVALO > 0:
+        threading.Thread(target=_barrido_periodico, name='barrido-huerfanos', daemon=True).start()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Reporta o borra archivos de uploads/ sin referencia en la DB')
+    parser.add_argument('--borrar', action='store_true', help='borrar los huérfanos (sin esto sólo se reportan)')
+    parser.add_argument('--lote', type=int, default=HUERFANOS_LOTE, help='archivos por consulta a la DB')
+    parser.add_argument('--pausa', type=float, default=HUERFANOS_PAUSA, help='segundos de espera entre lotes')
+    parser.add_argument('--gracia', type=int, default=HUERFANOS_GRACIA,
+                        help='segundos sin modificarse antes de considerar huérfano un archivo')
+    parser.add_argument('--tasa', type=float, default=HUERFANOS_TASA, help='máximo de borrados por segundo (0 = sin límite)')
+    args = parser.parse_args()
+
+    with bloqueo_db(BLOQUEO_HUERFANOS) as obtenido:
+        if not obtenido:
+            raise SystemExit("Otro proceso está barriendo huérfanos; intente más tarde.")
+        resumenes = barrer(args.borrar, args.lote, args.pausa, args.gracia, args.tasa)
+    for carpeta, r in resumenes.items():
+        print(f"{carpeta}: {r['revisados']} revisado(s), {r['huerfanos']} huérfano(s) "
+              f"({r['bytes']} bytes), {r['borrados']} borrado(s)")
+    if not args.borrar:
+        print("Dry-run: no se borró nada. Use --borrar para eliminar los huérfanos.")
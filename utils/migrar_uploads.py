@@ -0,0 +1,184 @@
+# utils/migrar_uploads.py
+# Migra las fotos guardadas en carpetas planas (uploads/usuarios/<id>_<archivo>,
+# uploads/productos/...) al almacén por contenido, repartido en subcarpetas por
+# prefijo del hash: uploads/blobs/ab/cd/<sha256><ext> (ver utils/blob_store.py).
+#
+# Se puede correr con la aplicación en línea:
+#   - Por lotes (keyset por id) con pausa opcional entre lotes.
+#   - Cada registro se actualiza sólo si la columna sigue teniendo el nombre
+#     viejo (si alguien subió otra foto mientras tanto, se respeta la nueva).
+#   - El archivo plano no se borra en la misma corrida: queda en la lista de
+#     pendientes y se elimina en una corrida posterior, pasado el periodo de
+#     gracia (los workers pueden tener el nombre viejo en caché hasta
+#     ARCHIVOS_REF_TTL y mientras tanto lo siguen sirviendo desde la carpeta).
+#   - El avance se guarda en uploads/.migracion_uploads.json después de cada
+#     lote: si se interrumpe, la siguiente corrida continúa donde se quedó.
+#
+# Uso:  python -m utils.migrar_uploads [--lote 200] [--pausa 0.5] [--gracia 600]
+
+import os
+import json
+import time
+import argparse
+from datetime import datetime
+
+from db_config import get_connection
+from utils.imagenes import eliminar_variantes
+from utils.cache_archivos import ARCHIVOS_REF_TTL, invalidar_referencia
+from utils.columnas_archivo import COLUMNAS_ARCHIVO
+from utils.blob_store import (
+    es_blob, blob_desde_archivo, descartar_blob, colocar_blob, publicar_tras_commit,
+    vincular_blob, liberar_blob
+)
+
+ESTADO_MIGRACION = os.path.join('uploads', '.migracion_uploads.json')
+
+
+def _leer_estado():
+    if not os.path.exists(ESTADO_MIGRACION):
+        return {'columnas': {}, 'pendientesBorrar': []}
+    with open(ESTADO_MIGRACION, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _guardar_estado(estado):
+    temporal = f"{ESTADO_MIGRACION}.tmp"
+    with open(temporal, 'w', encoding='utf-8') as f:
+        json.dump(estado, f, ensure_ascii=False, indent=2)
+    os.replace(temporal, ESTADO_MIGRACION)
+
+
+def _migrar_registro(conn, columna, id_registro, nombre, ruta):
+    """
+    Pasa un archivo plano a blob. Devuelve True si el registro quedó apuntando al blob.
+    Como en uploader.reemplazar_archivo, el blob queda en su ruta final antes
+    del commit: un registro migrado nunca apunta a un archivo inexistente.
+    """
+    tabla, campo = columna.tabla, columna.campo
+    blob = blob_desde_archivo(ruta)
+    colocado = False
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                f"{columna.sql_update} AND {campo} = %s",
+                (blob['nombre'], id_registro, nombre))
+            if cursor.rowcount != 1:
+                conn.rollback()
+                descartar_blob(blob)
+                return False
+        blob_anterior = vincular_blob(conn, tabla, id_registro, campo, blob)
+        colocado = colocar_blob(blob)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        if colocado:
+            liberar_blob(blob['nombre'])  # sin el commit el blob no tiene referencias
+        else:
+            descartar_blob(blob)
+        raise
+
+    invalidar_referencia(tabla, id_registro, campo)
+    if colocado:
+        publicar_tras_commit(blob['nombre'])
+    if blob_anterior:
+        liberar_blob(blob_anterior)
+    return True
+
+
+def migrar_columna(estado, columna, lote, pausa):
+    tabla, campo, id_columna = columna.tabla, columna.campo, columna.id_columna
+    clave = f"{tabla}.{campo}"
+    avance = estado['columnas'].setdefault(clave, {'ultimoId': 0, 'migrados': 0, 'faltantes': 0})
+    if avance.get('terminado'):
+        return avance
+
+    conn = get_connection()
+    try:
+        while True:
+            with conn.cursor() as cursor:
+                cursor.execute(f"""
+                    SELECT {id_columna}, {campo} FROM {tabla}
+                    WHERE {id_columna} > %s AND {campo} IS NOT NULL AND {campo} <> ''
+                    ORDER BY {id_columna} ASC
+                    LIMIT %s
+                """, (avance['ultimoId'], lote))
+                filas = cursor.fetchall()
+            conn.commit()  # cierra la lectura para no retener el snapshot
+            if not filas:
+                avance['terminado'] = True
+                break
+
+            for id_registro, nombre in filas:
+                if es_blob(nombre):
+                    continue
+                ruta = os.path.join(columna.ruta_carpeta, nombre)
+                if not os.path.isfile(ruta):
+                    avance['faltantes'] += 1
+                    print(f"  {clave} {id_registro}: no existe {ruta}")
+                    continue
+                if _migrar_registro(conn, columna, id_registro, nombre, ruta):
+                    avance['migrados'] += 1
+                    estado['pendientesBorrar'].append({'ruta': ruta, 'migrado': time.time()})
+
+            avance['ultimoId'] = filas[-1][0]
+            _guardar_estado(estado)
+            print(f"  {clave}: hasta id {avance['ultimoId']} ({avance['migrados']} migrado(s))")
+            if pausa:
+                time.sleep(pausa)
+    finally:
+        conn.close()
+
+    _guardar_estado(estado)
+    return avance
+
+
+def limpiar_planos(estado, gracia):
+    """Borra los archivos planos ya migrados cuyo periodo de gracia terminó"""
+    ahora = time.time()
+    quedan = []
+    borrados = 0
+    for pendiente in estado['pendientesBorrar']:
+        if ahora - pendiente['migrado'] < gracia:
+            quedan.append(pendiente)
+            continue
+        eliminar_variantes(pendiente['ruta'])
+        try:
+            os.remove(pendiente['ruta'])
+            borrados += 1
+        except FileNotFoundError:
+            pass
+    estado['pendientesBorrar'] = quedan
+    _guardar_estado(estado)
+    return borrados
+
+
+def migrar(lote=200, pausa=0.0, gracia=None):
+    gracia = ARCHIVOS_REF_TTL + 60 if gracia is None else gracia
+    estado = _leer_estado()
+    borrados = limpiar_planos(estado, gracia)
+
+    for columna in COLUMNAS_ARCHIVO.values():
+        print(f"Migrando {columna.tabla}.{columna.campo} ({columna.ruta_carpeta}/)")
+        migrar_columna(estado, columna, lote, pausa)
+
+    estado['ultimaCorrida'] = datetime.now().isoformat(timespec='seconds')
+    _guardar_estado(estado)
+    return {'borrados': borrados, 'pendientesBorrar': len(estado['pendientesBorrar']),
+            'columnas': estado['columnas']}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Migra uploads planos al almacén por contenido')
+    parser.add_argument('--lote', type=int, default=200, help='registros por lote')
+    parser.add_argument('--pausa', type=float, default=0.0, help='segundos de espera entre lotes')
+    parser.add_argument('--gracia', type=int, default=None,
+                        help='segundos antes de borrar un archivo plano ya migrado')
+    args = parser.parse_args()
+
+    resumen = migrar(args.lote, args.pausa, args.gracia)
+    for clave, avance in resumen['columnas'].items():
+        print(f"{clave}: {avance['migrados']} migrado(s), {avance['faltantes']} faltante(s)")
+    print(f"Archivos planos borrados: {resumen['borrados']}; "
+          f"pendientes de borrar: {resumen['pendientesBorrar']}")
+    if resumen['pendientesBorrar']:
+        print("Vuelva a correr el comando después del periodo de gracia para borrarlos.")
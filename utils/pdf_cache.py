@@ -0,0 +1,69 @@
+# utils/pdf_cache.py
+# Caché en disco de PDFs de cotizaciones ya renderizados.
+# Nombre en disco: cache/cotizaciones/<idCotizacion>_<fechaActualizacion>_<dias>.pdf
+# Sólo se guarda la validez por defecto (PDF_CACHE_DIAS): 'dias' viene del
+# request y cada valor distinto sería otro archivo por cotización.
+
+import os
+import glob
+import uuid
+
+PDF_CACHE_DIR = os.getenv('PDF_CACHE_DIR', os.path.join('cache', 'cotizaciones'))
+PDF_CACHE_DIAS = int(os.getenv('PDF_CACHE_DIAS', 7))
+
+
+def _version(fecha_actualizacion):
+    """Convierte fechaActualizacion en un sello apto para nombre de archivo"""
+    if fecha_actualizacion is None:
+        return '0'
+    if hasattr(fecha_actualizacion, 'strftime'):
+        return fecha_actualizacion.strftime('%Y%m%d%H%M%S%f')
+    return ''.join(ch for ch in str(fecha_actualizacion) if ch.isdigit()) or '0'
+
+
+def ruta_pdf_cache(id_cotizacion, fecha_actualizacion, dias):
+    """Ruta en caché de esa versión; None si 'dias' no es la validez que se guarda"""
+    if int(dias) != PDF_CACHE_DIAS:
+        return None
+    nombre = f"{int(id_cotizacion)}_{_version(fecha_actualizacion)}_{int(dias)}.pdf"
+    return os.path.join(PDF_CACHE_DIR, nombre)
+
+
+def obtener_pdf_cache(id_cotizacion, fecha_actualizacion, dias):
+    """Devuelve la ruta del PDF cacheado o None si no existe esa versión"""
+    ruta = ruta_pdf_cache(id_cotizacion, fecha_actualizacion, dias)
+    return ruta if ruta and os.path.isfile(ruta) else None
+
+
+def guardar_pdf_cache(id_cotizacion, fecha_actualizacion, dias, pdf):
+    """
+    Guarda el PDF de forma atómica (archivo temporal + rename) para que una
+    descarga concurrente nunca lea un archivo a medio escribir.
+    """
+    ruta = ruta_pdf_cache(id_cotizacion, fecha_actualizacion, dias)
+    if ruta is None:
+        return None
+    os.makedirs(PDF_CACHE_DIR, exist_ok=True)
+    temporal = f"{ruta}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(temporal, 'wb') as f:
+            f.write(pdf)
+        os.replace(temporal, ruta)
+    except Exception as e:
+        print("Error al guardar PDF en caché:", e)
+        if os.path.exists(temporal):
+            os.remove(temporal)
+        return None
+    return ruta
+
+
+def invalidar_pdf_cache(id_cotizacion):
+    """Elimina todas las versiones cacheadas de una cotización"""
+    eliminados = 0
+    for ruta in glob.glob(os.path.join(PDF_CACHE_DIR, f"{int(id_cotizacion)}_*.pdf")):
+        try:
+            os.remove(ruta)
+            eliminados += 1
+        except OSError:
+            pass
+    return eliminados
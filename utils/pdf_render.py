@@ -0,0 +1,327 @@
+# utils/pdf_render.py
+# Conversión HTML -> PDF con wkhtmltopdf y pool de procesos para lotes.
+
+import io
+import os
+import re
+import queue
+import shutil
+import subprocess
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from flask import render_template, Response
+from pypdf import PdfReader, PdfWriter
+from reportlab.pdfgen import canvas
+import pdfkit
+
+# Ruta explícita de wkhtmltopdf (importante en macOS); si no existe se busca en el PATH
+_WKHTMLTOPDF_DEFAULT = '/usr/local/bin/wkhtmltopdf'
+WKHTMLTOPDF_PATH = os.getenv('WKHTMLTOPDF_PATH') or (
+    _WKHTMLTOPDF_DEFAULT if os.path.exists(_WKHTMLTOPDF_DEFAULT)
+    else shutil.which('wkhtmltopdf') or _WKHTMLTOPDF_DEFAULT
+)
+
+# Filas por bloque al partir reportes grandes (cada bloque es un wkhtmltopdf)
+REPORTE_FILAS_POR_BLOQUE = int(os.getenv('REPORTE_FILAS_POR_BLOQUE', 500))
+
+# Segundos máximos que puede tardar un wkhtmltopdf en streaming antes de matarlo
+PDF_TIMEOUT = int(os.getenv('PDF_TIMEOUT', 120))
+PDF_CHUNK = 64 * 1024
+
+# Tope de procesos wkhtmltopdf simultáneos para trabajos en lote
+PDF_MAX_WORKERS = int(os.getenv('PDF_MAX_WORKERS', os.cpu_count() or 2))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+_RE_PAGINA = re.compile(rb'/Type\s*/Page(?![a-zA-Z])')
+
+
+def html_a_pdf(html, options=None):
+    """Renderiza HTML a bytes PDF (función de módulo para poder usarse en el pool)"""
+    config = pdfkit.configuration(wkhtmltopdf=WKHTMLTOPDF_PATH)
+    return pdfkit.from_string(html, False, configuration=config, options=options)
+
+
+def obtener_pool():
+    """Pool de procesos compartido, dimensionado a los núcleos disponibles"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=PDF_MAX_WORKERS)
+        return _pool
+
+
+def contar_paginas(pdf):
+    """Cuenta páginas de un PDF sin parsearlo completo (objetos /Type /Page)"""
+    return len(_RE_PAGINA.findall(pdf))
+
+
+def _pdf_con_paginas(html, options=None):
+    pdf = html_a_pdf(html, options)
+    return pdf, len(PdfReader(io.BytesIO(pdf)).pages)
+
+
+def numerar_paginas(pdf, inicio, total):
+    """Estampa 'Página X de Y' al pie de cada página, empezando en 'inicio'"""
+    lector = PdfReader(io.BytesIO(pdf))
+    escritor = PdfWriter()
+    for i, pagina in enumerate(lector.pages):
+        ancho = float(pagina.mediabox.width)
+        alto = float(pagina.mediabox.height)
+
+        capa = io.BytesIO()
+        c = canvas.Canvas(capa, pagesize=(ancho, alto))
+        c.setFont('Helvetica', 8)
+        c.setFillGray(0.45)
+        c.drawCentredString(ancho / 2, 14, f"Página {inicio + i} de {total}")
+        c.save()
+
+        pagina.merge_page(PdfReader(capa).pages[0])
+        escritor.add_page(pagina)
+
+    salida = io.BytesIO()
+    escritor.write(salida)
+    return salida.getvalue()
+
+
+def _escritor_unido(pdfs):
+    """PdfWriter con varios PDFs unidos (se escribe con _transmitir_pdf)"""
+    escritor = PdfWriter()
+    for pdf in pdfs:
+        escritor.append(PdfReader(io.BytesIO(pdf)))
+    return escritor
+
+
+class _SalidaCola:
+    """
+    Destino para PdfWriter.write() en otro hilo: junta bloques de PDF_CHUNK y
+    los pasa por una cola acotada al generador de la respuesta (sin archivo
+    temporal ni el PDF unido completo en bytes). pypdf sólo necesita write()
+    y tell() para escribir sin incrementos.
+    """
+    def __init__(self):
+        self.cola = queue.Queue(maxsize=4)
+        self.cancelado = threading.Event()
+        self._buffer = bytearray()
+        self._posicion = 0
+
+    def write(self, datos):
+        self._buffer += datos
+        self._posicion += len(datos)
+        if len(self._buffer) >= PDF_CHUNK:
+            self._entregar(bytes(self._buffer))
+            self._buffer.clear()
+        return len(datos)
+
+    def tell(self):
+        return self._posicion
+
+    def flush(self):
+        pass
+
+    def terminar(self, error=None):
+        """Entrega lo pendiente y la marca de fin (None) o el error"""
+        try:
+            if error is None and self._buffer:
+                self._entregar(bytes(self._buffer))
+            self._entregar(error)
+        except BrokenPipeError:
+            pass
+
+    def _entregar(self, bloque):
+        while True:
+            if self.cancelado.is_set():
+                raise BrokenPipeError('cliente desconectado')
+            try:
+                self.cola.put(bloque, timeout=1)
+                return
+            except queue.Full:
+                pass
+
+
+def _transmitir_pdf(escritor):
+    """Generador con la salida de escritor.write(), escrita en un hilo aparte"""
+    salida = _SalidaCola()
+
+    def escribir():
+        try:
+            escritor.write(salida)
+            salida.terminar()
+        except Exception as e:
+            salida.terminar(e)
+
+    threading.Thread(target=escribir, daemon=True).start()
+    try:
+        while True:
+            bloque = salida.cola.get()
+            if bloque is None:
+                return
+            if isinstance(bloque, Exception):
+                raise bloque  # corta la respuesta chunked en vez de cerrarla como completa
+            yield bloque
+    finally:
+        # Cliente desconectado: el hilo deja de escribir en su siguiente bloque
+        salida.cancelado.set()
+
+
+def _argumentos(options):
+    """Convierte opciones estilo pdfkit ({'encoding': 'UTF-8', 'flag': None}) a argumentos CLI"""
+    args = []
+    for clave, valor in (options or {}).items():
+        args.append(clave if clave.startswith('--') else f'--{clave}')
+        if valor not in (None, ''):
+            args.append(str(valor))
+    return args
+
+
+def respuesta_pdf(html, nombre_descarga, options=None, timeout=None, guardar_en=None):
+    """
+    Respuesta Flask que transmite la salida de wkhtmltopdf conforme se genera
+    (chunked), sin juntar el PDF completo en memoria. El HTML entra por stdin.
+    El proceso se mata si excede 'timeout' o si el cliente se desconecta, y
+    se recoge al cerrar la respuesta aunque el cuerpo no se haya leído (HEAD,
+    error antes de transmitir). Si wkhtmltopdf termina con error a media
+    transmisión se corta la respuesta en lugar de cerrarla como completa.
+    Con 'guardar_en' se deja además una copia en disco (escritura atómica)
+    sólo si el render terminó bien.
+    """
+    proceso = subprocess.Popen(
+        [WKHTMLTOPDF_PATH, '--quiet', *_argumentos(options), '-', '-'],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL
+    )
+    vigilante = threading.Timer(timeout or PDF_TIMEOUT, proceso.kill)
+    vigilante.daemon = True
+    vigilante.start()
+
+    def alimentar():
+        # En hilo aparte: si wkhtmltopdf llena stdout antes de leer todo el
+        # HTML, escribir desde este hilo provocaría un interbloqueo
+        try:
+            proceso.stdin.write(html.encode('utf-8'))
+        except (BrokenPipeError, OSError):
+            pass
+        finally:
+            try:
+                proceso.stdin.close()
+            except OSError:
+                pass
+
+    threading.Thread(target=alimentar, daemon=True).start()
+
+    def terminar():
+        vigilante.cancel()
+        if proceso.poll() is None:
+            proceso.kill()
+        proceso.wait()
+        proceso.stdout.close()
+
+    # Se lee el primer bloque antes de mandar cabeceras: si wkhtmltopdf falla
+    # de entrada todavía se puede responder con error
+    try:
+        primero = proceso.stdout.read1(PDF_CHUNK)
+    except Exception:
+        terminar()
+        raise
+    if not primero:
+        terminar()
+        raise RuntimeError(f"wkhtmltopdf no generó salida (código {proceso.returncode})")
+
+    def generar():
+        copia = None
+        temporal = None
+        completo = False
+        try:
+            if guardar_en:
+                os.makedirs(os.path.dirname(guardar_en) or '.', exist_ok=True)
+                temporal = f"{guardar_en}.{uuid.uuid4().hex}.tmp"
+                copia = open(temporal, 'wb')
+
+            bloque = primero
+            while bloque:
+                if copia:
+                    copia.write(bloque)
+                yield bloque
+                bloque = proceso.stdout.read1(PDF_CHUNK)
+
+            completo = proceso.wait() == 0
+            if not completo:
+                raise RuntimeError(
+                    f"wkhtmltopdf terminó con código {proceso.returncode} generando {nombre_descarga}")
+        finally:
+            # GeneratorExit (cliente desconectado) también pasa por aquí
+            terminar()
+            if copia:
+                copia.close()
+                if completo:
+                    os.replace(temporal, guardar_en)
+                else:
+                    os.remove(temporal)
+
+    respuesta = Response(
+        generar(),
+        mimetype='application/pdf',
+        headers={'Content-Disposition': f'attachment; filename="{nombre_descarga}"'},
+        direct_passthrough=True
+    )
+    # close() de un generador que nunca arrancó no ejecuta su finally
+    respuesta.call_on_close(terminar)
+    return respuesta
+
+
+def _htmls_reporte(template, clave_filas, filas, contexto):
+    filas = list(filas)
+    n = REPORTE_FILAS_POR_BLOQUE
+    bloques = [filas[i:i + n] for i in range(0, len(filas), n)] or [[]]
+    return [
+        render_template(
+            template,
+            primer_bloque=(i == 0),
+            ultimo_bloque=(i == len(bloques) - 1),
+            **{clave_filas: bloque},
+            **contexto
+        )
+        for i, bloque in enumerate(bloques)
+    ]
+
+
+def _pdf_por_bloques(htmls, options=None):
+    """PdfWriter con los bloques renderizados, numerados con el total global y unidos"""
+    pool = obtener_pool()
+
+    # 1) Render de bloques en paralelo
+    resultados = [f.result() for f in [pool.submit(_pdf_con_paginas, h, options) for h in htmls]]
+    total = sum(paginas for _, paginas in resultados)
+
+    # 2) Numeración en paralelo: ya se conoce el desplazamiento de cada bloque
+    futuros = []
+    inicio = 1
+    for pdf, paginas in resultados:
+        futuros.append(pool.submit(numerar_paginas, pdf, inicio, total))
+        inicio += paginas
+    del resultados
+
+    return _escritor_unido([f.result() for f in futuros])
+
+
+def respuesta_reporte(template, clave_filas, filas, nombre_descarga, options=None, **contexto):
+    """
+    Respuesta PDF de un reporte de listado. Las filas se parten en bloques de
+    REPORTE_FILAS_POR_BLOQUE; el encabezado del reporte va sólo en el primero y
+    las notas en el último (variables primer_bloque / ultimo_bloque de la
+    plantilla). Los bloques se renderizan en paralelo en el pool y se numeran
+    con numerar_paginas (el mismo pie con uno o varios bloques); el PDF unido
+    se transmite conforme pypdf lo escribe, sin archivo temporal. Las páginas
+    sí quedan en memoria: pypdf necesita todas para escribir el documento.
+    """
+    htmls = _htmls_reporte(template, clave_filas, filas, contexto)
+    escritor = _pdf_por_bloques(htmls, options)
+    return Response(
+        _transmitir_pdf(escritor),
+        mimetype='application/pdf',
+        headers={'Content-Disposition': f'attachment; filename="{nombre_descarga}"'},
+        direct_passthrough=True
+    )
@@ -0,0 +1,24 @@
+# utils/salida_zip.py
+# Destino para generar un ZIP al vuelo con zipfile dentro de una respuesta
+# en streaming (exportación masiva de cotizaciones, evidencias de agenda).
+
+
+class SalidaZip:
+    """
+    Destino sin seek para zipfile: acumula lo escrito y el generador lo
+    va entregando al cliente con vaciar() conforme se completa cada archivo.
+    """
+    def __init__(self):
+        self._partes = []
+
+    def write(self, datos):
+        self._partes.append(bytes(datos))
+        return len(datos)
+
+    def flush(self):
+        pass
+
+    def vaciar(self):
+        datos = b''.join(self._partes)
+        self._partes = []
+        return datos
@@ -0,0 +1,289 @@
+# utils/sesiones.py
+# Sesiones en historico_sesiones: búsqueda por hash del token y mantenimiento
+# de la tabla (sql/historico_sesiones_token_hash.sql).
+#
+# Cada request autenticado busca su sesión. Comparar el JWT completo obliga a
+# indexar (o recorrer) una columna de cientos de bytes; en su lugar se guarda
+# token_hash = SHA-256 del token (BINARY(32), índice único) y se busca por él.
+# fechaExpira es el 'exp' del JWT: una sesión vencida ya no cuenta como activa
+# aunque nadie haya hecho logout.
+#
+# Barrido (en lotes cortos, cada uno en su transacción):
+#   1. Sesiones abiertas de antes de la migración sin fechaExpira: se toma el
+#      'exp' del JWT guardado en token_sesion.
+#   2. Sesiones abiertas ya vencidas: fechaLogout = fechaExpira.
+#   3. Sesiones cerradas hace más de SESIONES_ARCHIVAR_DIAS: se mueven a
+#      historico_sesiones_archivo, particionada por mes.
+#   4. Con SESIONES_RETENCION_MESES > 0 se eliminan las particiones del archivo
+#      más viejas que eso (DROP PARTITION, sin borrar renglón por renglón).
+#
+# Uso:  python -m utils.sesiones [--lote 1000] [--pausa 0.1] [--dias 30] [--meses 0]
+# En la aplicación: SESIONES_INTERVALO > 0 lanza el barrido periódico en segundo plano.
+# Un candado de MySQL (BLOQUEO_SESIONES) evita que dos workers, o un worker y
+# cron, barran a la vez (REORGANIZE PARTITION no admite ejecuciones paralelas).
+
+import os
+import time
+import hashlib
+import argparse
+import threading
+from datetime import date
+
+import jwt
+
+from db_config import get_connection
+from utils.bloqueo_db import bloqueo_db
+
+SESIONES_LOTE = int(os.getenv('SESIONES_LOTE', 1000))
+SESIONES_PAUSA = float(os.getenv('SESIONES_PAUSA', 0.1))
+# Días que una sesión cerrada queda en historico_sesiones antes de archivarse
+SESIONES_ARCHIVAR_DIAS = int(os.getenv('SESIONES_ARCHIVAR_DIAS', 30))
+# Meses que se conservan en el archivo (0 = sin límite)
+SESIONES_RETENCION_MESES = int(os.getenv('SESIONES_RETENCION_MESES', 0))
+# Barrido periódico dentro de la aplicación (segundos; 0 = desactivado)
+SESIONES_INTERVALO = int(os.getenv('SESIONES_INTERVALO', 0))
+
+TABLA_ARCHIVO = 'historico_sesiones_archivo'
+BLOQUEO_SESIONES = 'barrido-sesiones'
+
+# Condición de sesión activa para consultas con alias hs; parámetro: hash_token(token)
+SQL_SESION_ACTIVA = (
+    "hs.token_hash = %s AND hs.fechaLogout IS NULL "
+    "AND (hs.fechaExpira IS NULL OR hs.fechaExpira > NOW())"
+)
+
+
+def hash_token(token):
+    """SHA-256 (32 bytes) del token, la llave de búsqueda en historico_sesiones"""
+    return hashlib.sha256(token.encode('utf-8')).digest()
+
+
+def registrar_sesion(cursor, id_usuario, direccion_ip, user_agent, token, expira):
+    """INSERT de la sesión; 'expira' es el 'exp' del JWT en segundos epoch"""
+    cursor.execute("""
+        INSERT INTO historico_sesiones
+            (idUsuario, direccion_ip, user_agent, token_sesion, token_hash, fechaExpira)
+        VALUES (%s, %s, %s, %s, %s, FROM_UNIXTIME(%s))
+    """, (id_usuario, direccion_ip, user_agent, token, hash_token(token), expira))
+
+
+# ----------------------------
+# Barrido
+# ----------------------------
+
+def _exp_del_token(token):
+    """'exp' (epoch) de un JWT sin validar la firma; None si no es un JWT con exp"""
+    try:
+        exp = jwt.decode(token, options={"verify_signature": False}).get('exp')
+        return int(exp) if exp is not None else None
+    except (jwt.InvalidTokenError, TypeError, ValueError):
+        return None
+
+
+def completar_expiracion(conn, lote=SESIONES_LOTE, pausa=SESIONES_PAUSA):
+    """fechaExpira de las sesiones abiertas que no la tienen; devuelve cuántas se completaron"""
+    completadas = 0
+    ultimo = 0
+    while True:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                SELECT idSesion, token_sesion FROM historico_sesiones
+                WHERE fechaLogout IS NULL AND fechaExpira IS NULL AND idSesion > %s
+                ORDER BY idSesion
+                LIMIT %s
+            """, (ultimo, lote))
+            filas = cursor.fetchall()
+            if not filas:
+                break
+            ultimo = filas[-1][0]
+
+            # Tokens que no son JWT (o sin exp) se dejan como están
+            valores = [(exp, id_sesion) for id_sesion, token in filas
+                       if token and (exp := _exp_del_token(token)) is not None]
+            if valores:
+                cursor.executemany("""
+                    UPDATE historico_sesiones SET fechaExpira = FROM_UNIXTIME(%s)
+                    WHERE idSesion = %s
+                """, valores)
+            conn.commit()
+            completadas += len(valores)
+        if len(filas) < lote:
+            break
+        if pausa:
+            time.sleep(pausa)
+    return completadas
+
+
+def cerrar_vencidas(conn, lote=SESIONES_LOTE, pausa=SESIONES_PAUSA):
+    """Cierra las sesiones abiertas cuyo JWT ya venció; devuelve cuántas"""
+    cerradas = 0
+    while True:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                UPDATE historico_sesiones
+                SET fechaLogout = fechaExpira
+                WHERE fechaLogout IS NULL AND fechaExpira < NOW()
+                ORDER BY fechaExpira
+                LIMIT %s
+            """, (lote,))
+            afectadas = cursor.rowcount
+            conn.commit()
+        cerradas += afectadas
+        if afectadas < lote:
+            break
+        if pausa:
+            time.sleep(pausa)
+    return cerradas
+
+
+def _marcadores(valores):
+    return ', '.join(['%s'] * len(valores))
+
+
+def archivar_cerradas(conn, dias=SESIONES_ARCHIVAR_DIAS, lote=SESIONES_LOTE, pausa=SESIONES_PAUSA):
+    """Mueve a TABLA_ARCHIVO las sesiones cerradas hace más de 'dias'; devuelve cuántas"""
+    archivadas = 0
+    while True:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                SELECT idSesion FROM historico_sesiones
+                WHERE fechaLogout < NOW() - INTERVAL %s DAY
+                ORDER BY fechaLogout
+                LIMIT %s
+                FOR UPDATE
+            """, (dias, lote))
+            ids = [fila[0] for fila in cursor.fetchall()]
+            if not ids:
+                conn.rollback()
+                break
+            cursor.execute(f"""
+                INSERT INTO {TABLA_ARCHIVO}
+                SELECT * FROM historico_sesiones WHERE idSesion IN ({_marcadores(ids)})
+            """, ids)
+            cursor.execute(
+                f"DELETE FROM historico_sesiones WHERE idSesion IN ({_marcadores(ids)})", ids)
+            conn.commit()
+        archivadas += len(ids)
+        if len(ids) < lote:
+            break
+        if pausa:
+            time.sleep(pausa)
+    return archivadas
+
+
+def _mes_siguiente(dia):
+    return date(dia.year + dia.month // 12, dia.month % 12 + 1, 1)
+
+
+def _particiones_archivo(cursor):
+    """{nombre: límite (date) o None para MAXVALUE}; vacío si el archivo no está particionado"""
+    cursor.execute("""
+        SELECT PARTITION_NAME, PARTITION_DESCRIPTION
+        FROM information_schema.PARTITIONS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND PARTITION_NAME IS NOT NULL
+    """, (TABLA_ARCHIVO,))
+    particiones = {}
+    for nombre, descripcion in cursor.fetchall():
+        descripcion = descripcion.strip("'") if descripcion else ''
+        particiones[nombre] = None if descripcion == 'MAXVALUE' else date.fromisoformat(descripcion[:10])
+    return particiones
+
+
+def asegurar_particiones(conn):
+    """
+    Parte p_futuro (MAXVALUE) en particiones mensuales pAAAAMM hasta el mes
+    siguiente al actual, para que p_futuro quede vacía. Devuelve las creadas.
+    """
+    creadas = []
+    with conn.cursor() as cursor:
+        particiones = _particiones_archivo(cursor)
+        if 'p_futuro' not in particiones:
+            return creadas
+        limites = [l for l in particiones.values() if l is not None]
+        desde = max(limites) if limites else date.today().replace(day=1)
+        hasta = _mes_siguiente(_mes_siguiente(date.today().replace(day=1)))
+
+        while desde < hasta:
+            nombre = f"p{desde:%Y%m}"
+            limite = _mes_siguiente(desde)
+            cursor.execute(f"""
+                ALTER TABLE {TABLA_ARCHIVO} REORGANIZE PARTITION p_futuro INTO (
+                    PARTITION {nombre} VALUES LESS THAN ('{limite.isoformat()}'),
+                    PARTITION p_futuro VALUES LESS THAN (MAXVALUE)
+                )
+            """)
+            creadas.append(nombre)
+            desde = limite
+    return creadas
+
+
+def purgar_archivo(conn, meses=SESIONES_RETENCION_MESES):
+    """Elimina las particiones del archivo anteriores a 'meses' atrás; devuelve sus nombres"""
+    if meses <= 0:
+        return []
+    corte = date.today().replace(day=1)
+    for _ in range(meses):
+        corte = date(corte.year - (corte.month == 1), (corte.month - 2) % 12 + 1, 1)
+
+    with conn.cursor() as cursor:
+        viejas = sorted(nombre for nombre, limite in _particiones_archivo(cursor).items()
+                        if limite is not None and limite <= corte)
+        if viejas:
+            cursor.execute(f"ALTER TABLE {TABLA_ARCHIVO} DROP PARTITION {', '.join(viejas)}")
+    return viejas
+
+
+def barrer_sesiones(lote=SESIONES_LOTE, pausa=SESIONES_PAUSA,
+                    dias=SESIONES_ARCHIVAR_DIAS, meses=SESIONES_RETENCION_MESES):
+    """Ejecuta los pasos del barrido y devuelve el resumen"""
+    conn = get_connection()
+    try:
+        resumen = {'expiracion_completada': completar_expiracion(conn, lote, pausa)}
+        resumen['cerradas'] = cerrar_vencidas(conn, lote, pausa)
+        resumen['particiones_creadas'] = asegurar_particiones(conn)
+        resumen['archivadas'] = archivar_cerradas(conn, dias, lote, pausa)
+        resumen['particiones_eliminadas'] = purgar_archivo(conn, meses)
+    finally:
+        conn.close()
+    return resumen
+
+
+def _barrido_periodico():
+    while True:
+        time.sleep(SESIONES_INTERVALO)
+        try:
+            with bloqueo_db(BLOQUEO_SESIONES) as obtenido:
+                if not obtenido:
+                    continue  # otro proceso está barriendo
+                resumen = barrer_sesiones()
+            print(f"Barrido de sesiones: {resumen['cerradas']} cerrada(s), "
+                  f"{resumen['archivadas']} archivada(s)")
+        except Exception as e:
+            print("Error en barrido de sesiones:", e)
+
+
+def iniciar_barrido_sesiones():
+    """Lanza el barrido en un hilo de fondo si SESIONES_INTERVALO > 0"""
+    if SESIONES_INTERVALO > 0:
+        threading.Thread(target=_barrido_periodico, name='barrido-sesiones', daemon=True).start()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Cierra sesiones vencidas y archiva las cerradas')
+    parser.add_argument('--lote', type=int, default=SESIONES_LOTE, help='renglones por transacción')
+    parser.add_argument('--pausa', type=float, default=SESIONES_PAUSA, help='segundos de espera entre lotes')
+    parser.add_argument('--dias', type=int, default=SESIONES_ARCHIVAR_DIAS,
+                        help='días desde el logout antes de archivar una sesión')
+    parser.add_argument('--meses', type=int, default=SESIONES_RETENCION_MESES,
+                        help='meses que se conservan en el archivo (0 = sin límite)')
+    args = parser.parse_args()
+
+    with bloqueo_db(BLOQUEO_SESIONES) as obtenido:
+        if not obtenido:
+            raise SystemExit("Otro proceso está barriendo sesiones; intente más tarde.")
+        resumen = barrer_sesiones(args.lote, args.pausa, args.dias, args.meses)
+    print(f"Expiración completada: {resumen['expiracion_completada']}")
+    print(f"Sesiones vencidas cerradas: {resumen['cerradas']}")
+    print(f"Sesiones archivadas: {resumen['archivadas']}")
+    print(f"Particiones creadas: {', '.join(resumen['particiones_creadas']) or '-'}")
+    print(f"Particiones eliminadas: {', '.join(resumen['particiones_eliminadas']) or '-'}")
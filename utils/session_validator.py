@@ -4,6 +4,7 @@ from functools import wraps
 from flask import request, jsonify, g
 from utils.verificador_permisos import verificar_permiso
 from db_config import get_connection
+from utils.sesiones import SQL_SESION_ACTIVA, hash_token
 
 def session_validator(tabla=None, accion=None):
     """
@@ -23,12 +24,13 @@ def session_validator(tabla=None, accion=None):
             try:
                 conexion = get_connection()
                 with conexion.cursor() as cursor:
-                    cursor.execute("""
+                    # Búsqueda por el índice único de token_hash
+                    cursor.execute(f"""
                         SELECT u.idUsuario 
                         FROM historico_sesiones hs
                         JOIN usuarios u ON hs.idUsuario = u.idUsuario
-                        WHERE hs.token_sesion = %s AND hs.fechaLogout IS NULL
-                    """, (token,))
+                        WHERE {SQL_SESION_ACTIVA}
+                    """, (hash_token(token),))
                     result = cursor.fetchone()
 
                     if not result:
@@ -1,56 +1,111 @@
 import os
-from werkzeug.utils import secure_filename
 from db_config import get_connection
+from utils.cache_archivos import invalidar_referencia
+from utils.columnas_archivo import columna_archivo
+from utils.imagenes import eliminar_variantes
+from utils.almacenamiento import obtener_almacenamiento
+from utils.blob_store import (
+    es_blob, guardar_blob, descartar_blob, colocar_blob, publicar_tras_commit,
+    vincular_blob, desvincular_blob, liberar_blob
+)
 
 
-def subir_archivo(tabla, id_registro, archivo, campo, carpeta, user_id_actor=None):
-    # Eliminar archivo anterior si existe
-    conn = get_connection()
-    try:
-        with conn.cursor() as cursor:
-            cursor.execute(f"SELECT {campo} FROM {tabla} WHERE id{tabla[:-1].capitalize()} = %s", (id_registro,))
-            archivo_anterior = cursor.fetchone()
+def reemplazar_archivo(tabla, id_registro, archivo, campo):
+    """
+    Reemplaza el archivo de (tabla, id_registro, campo) en una sola conexión:
 
-            if archivo_anterior and archivo_anterior[0]:
-                eliminar_archivo(archivo_anterior[0], carpeta)
-    finally:
-        conn.close()
+      1. El archivo subido se escribe a un temporal (fuera de la transacción).
+      2. Transacción corta: bloquea el registro, suma la referencia al blob,
+         lo mueve a su ruta final (rename atómico, con el renglón del blob
+         bloqueado), actualiza la columna y hace commit.
+      3. Después del commit: variantes/publicación del blob nuevo (si falla
+         se registra y se reintenta en segundo plano) y borrado del archivo
+         anterior.
 
-    # Subir nuevo archivo
-    nombre_seguro = secure_filename(archivo.filename)
-    nombre_archivo = f'{id_registro}_{nombre_seguro}'
-    ruta_directorio = f'uploads/{carpeta}'
-    os.makedirs(ruta_directorio, exist_ok=True)
+    Si algo falla antes del commit no queda ninguna referencia al archivo
+    nuevo. Devuelve (nombre_nuevo, nombre_anterior), o None si el registro
+    no existe. (tabla, campo) debe estar en utils/columnas_archivo.
+    """
+    columna = columna_archivo(tabla, campo)
+    if columna is None:
+        raise ValueError(f"{tabla}.{campo} no es una columna de archivo")
 
-    ruta_completa = os.path.join(ruta_directorio, nombre_archivo)
-    archivo.save(ruta_completa)
+    blob = guardar_blob(archivo)
+    colocado = False
 
-    # Actualizar base de datos
     conn = get_connection()
     try:
         with conn.cursor() as cursor:
-            cursor.execute(f"""
-                UPDATE {tabla}
-                SET {campo} = %s
-                WHERE id{tabla[:-1].capitalize()} = %s
-            """, (nombre_archivo, id_registro))
-            conn.commit()
+            cursor.execute(columna.sql_bloquear, (id_registro,))
+            fila = cursor.fetchone()
+            if not fila:
+                conn.rollback()
+                descartar_blob(blob)
+                return None
+            archivo_anterior = fila[0]
+
+            blob_anterior = vincular_blob(conn, tabla, id_registro, campo, blob)
+            colocado = colocar_blob(blob)
+
+            cursor.execute(columna.sql_update, (blob['nombre'], id_registro))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        if colocado:
+            liberar_blob(blob['nombre'])  # sin el commit el blob nuevo no tiene referencias
+        else:
+            descartar_blob(blob)
+        raise
     finally:
         conn.close()
 
-    return nombre_archivo
+    invalidar_referencia(tabla, id_registro, campo)
+    if colocado:
+        publicar_tras_commit(blob['nombre'])
+
+    # Eliminar archivo anterior: blob sin referencias o archivo con nombre anterior
+    if blob_anterior:
+        liberar_blob(blob_anterior)
+    elif archivo_anterior and not es_blob(archivo_anterior):
+        eliminar_archivo(archivo_anterior, columna.carpeta, tabla, id_registro, campo)
 
+    return blob['nombre'], archivo_anterior
 
-def eliminar_archivo(nombre_archivo, carpeta):
+
+def subir_archivo(tabla, id_registro, archivo, campo, user_id_actor=None):
+    """
+    Sube el archivo del registro y devuelve el nombre guardado en la columna
+    (la carpeta la define el registro de columnas).
+    """
+    resultado = reemplazar_archivo(tabla, id_registro, archivo, campo)
+    if resultado is None:
+        raise LookupError(f"No existe {tabla} {id_registro}")
+    return resultado[0]
+
+
+def eliminar_archivo(nombre_archivo, carpeta, tabla, id_registro, campo):
+    """
+    Elimina el archivo de un registro. Para blobs se quita la referencia de
+    (tabla, id_registro, campo) y el archivo sólo se borra si nadie más lo usa.
+    """
     if not nombre_archivo:
         return False
 
     try:
-        ruta_archivo = os.path.join('uploads', carpeta, nombre_archivo)
-        if os.path.exists(ruta_archivo):
-            os.remove(ruta_archivo)
+        if es_blob(nombre_archivo):
+            conn = get_connection()
+            try:
+                liberado = desvincular_blob(conn, tabla, id_registro, campo)
+                conn.commit()
+            finally:
+                conn.close()
+            if liberado:
+                liberar_blob(liberado)
             return True
-        return False
+
+        ruta_archivo = os.path.join('uploads', carpeta, nombre_archivo)
+        eliminar_variantes(ruta_archivo)
+        return obtener_almacenamiento().eliminar(ruta_archivo)
     except Exception as e:
         print(f"Error al eliminar archivo: {e}")
-        return False
\ No newline at end of file
+        return False
@@ -1,38 +1,53 @@
-from flask import Blueprint, send_from_directory, jsonify, g
-from db_config import get_connection
-import os
+from flask import Blueprint, jsonify, g, request
+from werkzeug.security import safe_join
+from utils.cache_archivos import archivo_registro, stat_archivo
+from utils.entrega_archivos import enviar_archivo
+from utils.imagenes import resolver_variante
+from utils.blob_store import es_blob, ruta_blob
+from utils.columnas_archivo import columna_archivo
 
 visor_bp = Blueprint('visor_archivo', __name__)
 
 @visor_bp.route('/archivo/<string:tabla>/<int:id_registro>/<string:campo>', methods=['GET'])
 def obtener_archivo(tabla, id_registro, campo):
-    conexion = get_connection()
-    try:
-        with conexion.cursor(dictionary=True) as cursor:
-            # Construir dinámicamente el nombre de la columna ID
-            id_columna = f"id{tabla[:-1].capitalize()}"  # Quita la 's' y pone mayúscula
-
-            cursor.execute(f"SELECT {campo} FROM {tabla} WHERE {id_columna} = %s", (id_registro,))
-            resultado = cursor.fetchone()
+    # Sólo columnas registradas: lo demás se rechaza sin consultar la DB
+    columna = columna_archivo(tabla, campo)
+    if columna is None:
+        return jsonify({'error': 'Archivo no encontrado'}), 404
 
-            if not resultado:
-                return jsonify({'error': f'{tabla.capitalize()} no encontrado'}), 404
+    try:
+        # SQL precalculado en el registro, con caché por (tabla, id, campo)
+        existe, nombre_archivo, ruta_archivo, stat = archivo_registro(
+            tabla, id_registro, campo,
+            lambda nombre: ruta_blob(nombre) if es_blob(nombre) else safe_join(columna.ruta_carpeta, nombre)
+        )
 
-            nombre_archivo = resultado.get(campo)
-            if not nombre_archivo:
-                return jsonify({'error': f'{campo} no definido para este registro'}), 404
+        if not existe:
+            return jsonify({'error': f'{tabla.capitalize()} no encontrado'}), 404
 
-            carpeta = os.path.join("uploads", tabla)
-            ruta_archivo = os.path.join(carpeta, nombre_archivo)
+        if not nombre_archivo:
+            return jsonify({'error': f'{campo} no definido para este registro'}), 404
 
-            if not os.path.exists(ruta_archivo):
-                return jsonify({'error': 'Archivo no encontrado'}), 404
+        if stat is None:
+            return jsonify({'error': 'Archivo no encontrado'}), 404
 
-            return send_from_directory(carpeta, nombre_archivo)
+        ruta_archivo = resolver_variante(ruta_archivo, request.args.get('size'))
+        return enviar_archivo(ruta_archivo)
 
     except Exception as e:
         print("Error al obtener archivo:", e)
         return jsonify({'error': 'Error interno al obtener archivo'}), 500
 
-    finally:
-        conexion.close()
+
+# Archivos por contenido (uploads/blobs/): el nombre es el hash, se cachean sin expiración
+@visor_bp.route('/archivo/blobs/<string:nombre>', methods=['GET'])
+def obtener_blob(nombre):
+    if not es_blob(nombre):
+        return jsonify({'error': 'Archivo no encontrado'}), 404
+
+    ruta_archivo = ruta_blob(nombre)
+    if stat_archivo(ruta_archivo) is None:
+        return jsonify({'error': 'Archivo no encontrado'}), 404
+
+    ruta_archivo = resolver_variante(ruta_archivo, request.args.get('size'))
+    return enviar_archivo(ruta_archivo, inmutable=True)